@@ -0,0 +1,39 @@
+"""Store refresh tokens by digest
+
+Revision ID: a7d3f58e21b4
+Revises: 5e2b9d41c7a8
+Create Date: 2026-10-18 12:41:55.108263
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7d3f58e21b4'
+down_revision: Union[str, None] = '5e2b9d41c7a8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('refresh_tokens', sa.Column('token_digest', sa.String(length=64), nullable=True))
+    op.execute("UPDATE refresh_tokens SET token_digest = encode(sha256(convert_to(token, 'UTF8')), 'hex')")
+    op.alter_column('refresh_tokens', 'token_digest', nullable=False)
+    op.create_index(op.f('ix_refresh_tokens_token_digest'), 'refresh_tokens', ['token_digest'], unique=True)
+    op.create_index(op.f('ix_refresh_tokens_user_id'), 'refresh_tokens', ['user_id'], unique=False)
+    op.drop_index('ix_refresh_tokens_token', table_name='refresh_tokens')
+    op.drop_column('refresh_tokens', 'token')
+
+
+def downgrade() -> None:
+    # Raw tokens cannot be recovered from their digests; every stored token is revoked instead
+    op.add_column('refresh_tokens', sa.Column('token', sa.String(), nullable=True))
+    op.execute("UPDATE refresh_tokens SET token = token_digest, revoked = true")
+    op.alter_column('refresh_tokens', 'token', nullable=False)
+    op.create_index('ix_refresh_tokens_token', 'refresh_tokens', ['token'], unique=True)
+    op.drop_index(op.f('ix_refresh_tokens_user_id'), table_name='refresh_tokens')
+    op.drop_index(op.f('ix_refresh_tokens_token_digest'), table_name='refresh_tokens')
+    op.drop_column('refresh_tokens', 'token_digest')
@@ -0,0 +1,43 @@
+"""Workload aligned indexes for content, users and workspaces
+
+Revision ID: b6c3e9a1d7f0
+Revises: f2a9c7d4e815
+Create Date: 2026-10-18 14:22:37.905114
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b6c3e9a1d7f0'
+down_revision: Union[str, None] = 'f2a9c7d4e815'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Duplicates of the primary key indexes
+    op.drop_index('ix_content_id', table_name='content')
+    op.drop_index('ix_users_id', table_name='users')
+    op.drop_index('ix_workspaces_id', table_name='workspaces')
+    op.drop_index('ix_workspace_user_mapping_id', table_name='workspace_user_mapping')
+    op.drop_index('ix_refresh_tokens_id', table_name='refresh_tokens')
+    # Columns no query filters or sorts on
+    op.drop_index('ix_users_first_name', table_name='users')
+    op.drop_index('ix_users_last_name', table_name='users')
+    # Listing a user's workspaces
+    op.create_index(op.f('ix_workspaces_owner_id'), 'workspaces', ['owner_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_workspaces_owner_id'), table_name='workspaces')
+    op.create_index('ix_users_last_name', 'users', ['last_name'], unique=False)
+    op.create_index('ix_users_first_name', 'users', ['first_name'], unique=False)
+    op.create_index('ix_refresh_tokens_id', 'refresh_tokens', ['id'], unique=False)
+    op.create_index('ix_workspace_user_mapping_id', 'workspace_user_mapping', ['id'], unique=False)
+    op.create_index('ix_workspaces_id', 'workspaces', ['id'], unique=False)
+    op.create_index('ix_users_id', 'users', ['id'], unique=False)
+    op.create_index('ix_content_id', 'content', ['id'], unique=False)
@@ -0,0 +1,36 @@
+"""Workspace API key lookup by public key id
+
+Revision ID: c1f0e7a25d93
+Revises: 8404388860a6
+Create Date: 2026-10-18 10:02:17.284519
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c1f0e7a25d93'
+down_revision: Union[str, None] = '8404388860a6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # bcrypt hashes of the key cannot be searched, so existing workspaces have their credentials
+    # re-issued by their owner (PUT /workspace/{id}/api-key)
+    op.add_column('workspaces', sa.Column('api_key', sa.String(), nullable=True))
+    op.add_column('workspaces', sa.Column('api_secret_digest', sa.String(length=64), nullable=True))
+    op.create_index(op.f('ix_workspaces_api_key'), 'workspaces', ['api_key'], unique=True)
+    op.drop_column('workspaces', 'hashed_api_secret')
+    op.drop_column('workspaces', 'hashed_api_key')
+
+
+def downgrade() -> None:
+    op.add_column('workspaces', sa.Column('hashed_api_key', sa.String(), nullable=True))
+    op.add_column('workspaces', sa.Column('hashed_api_secret', sa.String(), nullable=True))
+    op.drop_index(op.f('ix_workspaces_api_key'), table_name='workspaces')
+    op.drop_column('workspaces', 'api_secret_digest')
+    op.drop_column('workspaces', 'api_key')
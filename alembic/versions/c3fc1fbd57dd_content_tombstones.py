@@ -0,0 +1,30 @@
+"""Content tombstones for background media collection
+
+Revision ID: c3fc1fbd57dd
+Revises: 4f173b4c72a4
+Create Date: 2026-10-18 09:37:58.159519
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3fc1fbd57dd'
+down_revision: Union[str, None] = '4f173b4c72a4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('content', sa.Column('deleted_datetime', sa.DateTime(timezone=True), nullable=True))
+    op.create_index('ix_content_deleted_datetime', 'content', ['deleted_datetime'], unique=False, postgresql_where=sa.text('deleted_datetime IS NOT NULL'))
+    # Contents deleted so far kept their media (it was looked up under the wrong path), so hand them to the collector
+    op.execute("UPDATE content SET deleted_datetime = coalesce(updated_datetime, now()) WHERE NOT is_available")
+
+
+def downgrade() -> None:
+    op.drop_index('ix_content_deleted_datetime', table_name='content', postgresql_where=sa.text('deleted_datetime IS NOT NULL'))
+    op.drop_column('content', 'deleted_datetime')
@@ -0,0 +1,38 @@
+"""Unique workspace membership per user
+
+Revision ID: d4e8b1f3a6c2
+Revises: a7d3f58e21b4
+Create Date: 2026-10-18 13:05:41.772019
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd4e8b1f3a6c2'
+down_revision: Union[str, None] = 'a7d3f58e21b4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Collapse duplicate memberships left by retried requests, keeping the strongest role
+    op.execute("""
+        DELETE FROM workspace_user_mapping AS m
+        USING (
+            SELECT id, row_number() OVER (
+                PARTITION BY workspace_id, user_id
+                ORDER BY (role = 'owner') DESC, id
+            ) AS rank
+            FROM workspace_user_mapping
+        ) AS ranked
+        WHERE m.id = ranked.id AND ranked.rank > 1
+    """)
+    op.create_unique_constraint('uq_workspace_user_mapping_workspace_id_user_id', 'workspace_user_mapping', ['workspace_id', 'user_id'])
+
+
+def downgrade() -> None:
+    op.drop_constraint('uq_workspace_user_mapping_workspace_id_user_id', 'workspace_user_mapping', type_='unique')
@@ -0,0 +1,44 @@
+"""Content search vector and trigram indexes
+
+Revision ID: f2a9c7d4e815
+Revises: d4e8b1f3a6c2
+Create Date: 2026-10-18 13:48:09.310552
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2a9c7d4e815'
+down_revision: Union[str, None] = 'd4e8b1f3a6c2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.add_column('content', sa.Column(
+        'search_vector',
+        postgresql.TSVECTOR(),
+        sa.Computed("setweight(to_tsvector('simple', coalesce(title, '')), 'A') || setweight(to_tsvector('simple', coalesce(name, '')), 'B')", persisted=True),
+        nullable=True,
+    ))
+    op.create_index('ix_content_search_vector', 'content', ['search_vector'], unique=False, postgresql_using='gin')
+    op.create_index('ix_content_name_trgm', 'content', ['name'], unique=False, postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+    op.create_index('ix_content_title_trgm', 'content', ['title'], unique=False, postgresql_using='gin', postgresql_ops={'title': 'gin_trgm_ops'})
+    # Plain btree indexes on name and title served no query
+    op.drop_index('ix_content_name', table_name='content')
+    op.drop_index('ix_content_title', table_name='content')
+
+
+def downgrade() -> None:
+    op.create_index('ix_content_title', 'content', ['title'], unique=False)
+    op.create_index('ix_content_name', 'content', ['name'], unique=False)
+    op.drop_index('ix_content_title_trgm', table_name='content')
+    op.drop_index('ix_content_name_trgm', table_name='content')
+    op.drop_index('ix_content_search_vector', table_name='content')
+    op.drop_column('content', 'search_vector')
@@ -1,129 +1,264 @@
-from fastapi import FastAPI, Depends, HTTPException, APIRouter, UploadFile, File
-from sqlalchemy.orm import Session
+from fastapi import FastAPI, Depends, HTTPException, APIRouter, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
 from db import crud, models, schemas
-from db.database import SessionLocal, engine, get_db
-from db.models.workspace import Workspace, WorkspaceUserMapping
-from utils import auth
-from typing import List
-import os
-from fastapi import UploadFile, Form
-from fastapi.param_functions import File
-import aiofiles
-from core.config import MEDIA_PATH
-import datetime  
-
-SUPPORTED_EXTENSIONS = ["mp4", "mov", "avi", "wmv", "flv", "webm", "mpeg4", "3gpp", "mpegps", "cineform", "hevc", "dnxhr", "prores"]
-
-
+from db.database import AsyncSessionLocal, get_db, read_engine
+from utils import auth, conditional, export, ingest, media, pagination, storage, streaming, uploads
+from utils.access import AccessResolver, get_access
+from typing import List, Literal, Optional
+from core.config import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, EXPORT_BATCH_SIZE, MEDIA_ACCEL_REDIRECT_PREFIX
 
 
 router = APIRouter()
 
 # Content Endpoints
-def is_owner_of_workspace(db: Session, user_id: int, workspace_id: int) -> bool:
-    """Check if the user is the owner of the given workspace."""
-    workspace = db.query(Workspace).filter(id == workspace_id).first()
-    if workspace and workspace.owner_id == user_id:
-        return True
-    return False
-
-def verify_content_access(db: Session, user_id: int, content_id: int):
-    """Verify if the user has access to the given content (either as an owner or workspace owner)."""
-    content = crud.get_content(db, content_id)
-    if not content:
-        raise HTTPException(status_code=404, detail="Content not found")
 
-    if content.user_id != user_id and not is_owner_of_workspace(db, user_id, content.workspace_id):
-        raise HTTPException(status_code=403, detail="Access forbidden: You don't have permissions")
-
-def verify_workspace_access(db: Session, user_id: int, workspace_id: int):
-    """Verify if the user is a member or an owner of the given workspace."""
-    # Check if the user is the owner
-    if is_owner_of_workspace(db, user_id, workspace_id):
-        return True
-    
-    # Check if the user is a member (you'll need a method to fetch this from your database)
-    user_mapping = db.query(WorkspaceUserMapping).filter_by(workspace_id=workspace_id, user_id=user_id).first()
-    
-    if not user_mapping:
-        raise HTTPException(status_code=403, detail="Access forbidden: You are not a member or owner of this workspace")
-    
-    return True
-
-
-@router.post("/content/", response_model=schemas.Content)
+# Request body of the upload endpoint, documented by hand since it is parsed from the raw stream
+UPLOAD_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["name", "title", "workspace_id", "file"],
+                    "properties": {
+                        "name": {"type": "string"},
+                        "title": {"type": "string"},
+                        "workspace_id": {"type": "integer"},
+                        "file": {"type": "string", "format": "binary"},
+                    },
+                }
+            }
+        },
+    }
+}
+
+
+@router.post("/content/", response_model=schemas.Content, openapi_extra=UPLOAD_REQUEST_BODY)
 async def create_content_endpoint(
-    name: str = Form(...),
-    title: str = Form(...),
-    workspace_id: int = Form(...),
-    file: UploadFile = File(...),
-    current_user: schemas.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    request: Request,
+    current_user: schemas.User = Depends(auth.get_current_user_or_api_key),
+    access: AccessResolver = Depends(get_access),
+    db: AsyncSession = Depends(get_db)
 ):
-    """Create new content with text fields and a file upload."""
-
-    # Check if the file's extension is supported
-    file_extension = file.filename.split(".")[-1].lower()
-    if file_extension not in SUPPORTED_EXTENSIONS:
-        raise HTTPException(status_code=400, detail="Unsupported file format")
-
-    # Generate a timestamped filename to avoid naming conflicts
-    timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
-    new_filename = f"{timestamp}_{file.filename}"
-    file_path = os.path.join(MEDIA_PATH, new_filename)
-
-    # Save the file in chunks to the specified path
-    async with aiofiles.open(file_path, 'wb') as buffer:
-        while data_chunk := await file.read(1024):  # read by 1KB chunks
-            await buffer.write(data_chunk)
-
-    # Construct the content data model for database operation
-    content_data = schemas.CreateContent(
-        name=name,
-        title=title,
-        workspace_id=workspace_id,
-        path=file_path  # Assuming CreateContent schema includes a 'path' field
-    )
+    """Create new content with text fields and a file upload streamed straight to disk."""
+
+    def open_file(field_name: str, filename: str):
+        if field_name != "file":
+            raise HTTPException(status_code=400, detail=f"Unexpected file field '{field_name}'")
+        # Check if the file's extension is supported before reading any of it
+        media.check_file_extension(filename)
+        return media.MediaWriter()
+
+    async def on_field(name: str, value: str):
+        # Reject a workspace the caller cannot write to before the file part is read, when it comes first
+        if name == "workspace_id" and value.isascii() and value.isdigit():
+            await access.require_workspace(int(value))
+
+    fields, files = await uploads.stream_multipart(request, open_file, on_field=on_field)
+    if len(files) != 1:
+        for _, _, writer in files:
+            await writer.discard()
+        raise HTTPException(status_code=400, detail="Exactly one file is required")
+    _, filename, writer = files[0]
+
+    try:
+        try:
+            form = schemas.ContentUpload(**fields)
+        except ValidationError as e:
+            raise RequestValidationError(e.errors())
+        await access.require_workspace(form.workspace_id)
+
+        digest = await writer.finish()
+        source = (writer.temp_path, digest, writer.size, filename)
+        placed = await media.upload_blobs(db, [source])
+        file_path, = await media.reference_blobs(db, [source], placed)
+
+        # Construct the content data model for database operation
+        content_data = schemas.CreateContent(
+            name=form.name,
+            title=form.title,
+            workspace_id=form.workspace_id,
+            path=file_path,
+            media_digest=digest,
+        )
+
+        # Save the content metadata to the database, in the transaction holding the blob reference
+        return await crud.create_content(db=db, content=content_data, user_id=current_user.id)
+    finally:
+        # The blob has its own link to the file by now
+        await writer.discard()
+
+
+# Request body of the batch ingest endpoint
+BATCH_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["items"],
+                    "properties": {
+                        "items": {
+                            "type": "string",
+                            "description": "JSON array of {name, title, workspace_id} records, each with either "
+                                           "'file' (the name of a file part in this request) or 'upload_id' (a fully received resumable upload)",
+                        },
+                    },
+                    "additionalProperties": {"type": "string", "format": "binary"},
+                }
+            }
+        },
+    }
+}
+
+# The items field of a batch carries up to BATCH_MAX_ITEMS JSON records
+BATCH_ITEMS_FIELD_SIZE = 4 * 1024 * 1024
+
+
+@router.post("/content/batch", response_model=schemas.BatchResult, openapi_extra=BATCH_REQUEST_BODY)
+async def create_contents_batch(request: Request, access: AccessResolver = Depends(get_access), db: AsyncSession = Depends(get_db)):
+    """Create many contents in one request, from file parts and/or finished resumable uploads, reporting each item's outcome."""
+    rejected_files = {}
 
-    # Save the content metadata to the database
-    created_content = crud.create_content(db=db, content=content_data, user_id=current_user.id)
-    
-    return created_content
+    def open_file(field_name: str, filename: str):
+        # An unsupported file only fails the items that use it, so skip it without reading it
+        try:
+            media.check_file_extension(filename)
+        except HTTPException as e:
+            rejected_files[field_name] = e.detail
+            return None
+        return media.MediaWriter()
+
+    fields, files = await uploads.stream_multipart(request, open_file, max_field_size=BATCH_ITEMS_FIELD_SIZE)
+    try:
+        if len({field_name for field_name, _, _ in files}) != len(files):
+            raise HTTPException(status_code=400, detail="File part names must be unique")
+        records = ingest.parse_items(fields.get("items"))
+        writers = {field_name: (filename, writer) for field_name, filename, writer in files}
+        return await ingest.ingest(db, access, records, writers, rejected_files)
+    finally:
+        # Files that were not published, because their item failed or no item used them
+        for _, _, writer in files:
+            await writer.discard()
 
 
 @router.get("/content/{content_id}", response_model=schemas.Content)
-def get_content_by_id(content_id: int, current_user: schemas.User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
-    """Retrieve a content by its ID."""
-    verify_content_access(db, current_user.id, content_id)
-    db_content = crud.get_content(db, content_id=content_id)
-    if not db_content:
+async def get_content_by_id(request: Request, response: Response, content_id: int, access: AccessResolver = Depends(get_access)):
+    """Retrieve a content by its ID, or 304 when the client's copy is still current."""
+    content = await access.require_content(content_id)
+    version = content.updated_datetime or content.created_datetime
+    return conditional.evaluate(request, response, conditional.version_tag(content.id, version), version) or content
+
+@router.api_route("/content/{content_id}/stream", methods=["GET", "HEAD"], response_class=streaming.RangeFileResponse)
+async def stream_content(request: Request, content_id: int, access: AccessResolver = Depends(get_access), db: AsyncSession = Depends(get_db)):
+    """Stream a content's media, honouring Range/If-Range so players can seek."""
+    content = await access.require_content(content_id)
+    if not content.is_available:
         raise HTTPException(status_code=404, detail="Content not found")
-    return db_content
+    # Give the connection back to the pool before a potentially long transfer
+    await db.close()
+
+    if MEDIA_ACCEL_REDIRECT_PREFIX and storage.backend.local_path(content.path) is not None:
+        return streaming.accel_redirect(content.path)
+    stat = await storage.backend.stat(content.path)
+    if stat is None:
+        raise HTTPException(status_code=404, detail="Media not found")
+    return streaming.RangeFileResponse(content.path, stat, request.headers, method=request.method)
 
-@router.get("/contents/workspace/{workspace_id}", response_model=List[schemas.Content])
-def get_contents_by_workspace_id(workspace_id: int, current_user: schemas.User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
-    """Retrieve all content items for a specific workspace."""
-    verify_workspace_access(db, current_user.id, workspace_id)
-    return crud.get_contents_by_workspace(db, workspace_id=workspace_id)
 
+@router.get("/contents/workspace/{workspace_id}", response_model=schemas.ContentPage)
+async def get_contents_by_workspace_id(
+    request: Request,
+    response: Response,
+    workspace_id: int,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    access: AccessResolver = Depends(get_access),
+    db: AsyncSession = Depends(get_db)
+):
+    """Retrieve a page of content items for a specific workspace, newest first, or 304 when it has not changed."""
+    await access.require_workspace(workspace_id)
+    items, last_keyset = await crud.get_contents_by_workspace(db, workspace_id=workspace_id, limit=limit, after=pagination.decode_cursor(cursor))
+    next_cursor = pagination.encode_cursor(last_keyset)
+    # The page is fully determined by its rows' versions and where the next page starts, so removals
+    # change the tag too; there is no Last-Modified, since the newest row version cannot show a removal
+    etag = conditional.version_tag([(item.id, item.updated_datetime or item.created_datetime) for item in items], next_cursor)
+    return conditional.evaluate(request, response, etag) or {"items": items, "next_cursor": next_cursor}
+
+
+@router.get("/contents/workspace/{workspace_id}/search", response_model=schemas.ContentPage)
+async def search_contents_by_workspace_id(
+    workspace_id: int,
+    q: str = Query(..., min_length=1, max_length=200),
+    mode: Literal["fulltext", "prefix", "fuzzy"] = "fulltext",
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    access: AccessResolver = Depends(get_access),
+    db: AsyncSession = Depends(get_db)
+):
+    """Search a workspace's content by name and title, best matches first."""
+    await access.require_workspace(workspace_id)
+    items, last_keyset = await crud.search_contents_by_workspace(
+        db, workspace_id=workspace_id, q=q, mode=mode, limit=limit, after=pagination.decode_rank_cursor(cursor)
+    )
+    return {"items": items, "next_cursor": pagination.encode_rank_cursor(last_keyset)}
 
-@router.get("/contents/user/", response_model=List[schemas.Content])
-def get_contents_by_current_user(current_user: schemas.User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
-    """Retrieve all content items added by the currently authenticated user."""
-    return crud.get_contents_by_user(db, user_id=current_user.id)
+
+@router.get("/contents/workspace/{workspace_id}/export", response_class=StreamingResponse)
+async def export_contents_by_workspace_id(
+    workspace_id: int,
+    format: Literal["ndjson", "csv"] = "ndjson",
+    access: AccessResolver = Depends(get_access),
+    db: AsyncSession = Depends(get_db)
+):
+    """Stream every content item of a workspace as NDJSON or CSV, in constant memory."""
+    await access.require_workspace(workspace_id)
+    # The export reads through its own session (on a replica when one is in rotation), which lives exactly
+    # as long as the response body
+    await db.close()
+
+    async def body():
+        async with AsyncSessionLocal(bind=read_engine()) as export_db:
+            batches = crud.stream_contents_by_workspace(export_db, workspace_id=workspace_id, batch_size=EXPORT_BATCH_SIZE)
+            columns = [column.key for column in crud.CONTENT_EXPORT_COLUMNS]
+            async for chunk in export.encode(batches, format, columns):
+                yield chunk
+
+    return StreamingResponse(
+        body(),
+        media_type=export.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="workspace-{workspace_id}.{format}"'},
+    )
+
+
+@router.get("/contents/user/", response_model=schemas.ContentPage)
+async def get_contents_by_current_user(
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current_user: schemas.User = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Retrieve a page of content items added by the currently authenticated user, newest first."""
+    items, last_keyset = await crud.get_contents_by_user(db, user_id=current_user.id, limit=limit, after=pagination.decode_cursor(cursor))
+    return {"items": items, "next_cursor": pagination.encode_cursor(last_keyset)}
 
 @router.put("/content/{content_id}", response_model=schemas.Content)
-def update_content_endpoint(content_id: int, updated_content: schemas.UpdateContent, current_user: schemas.User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
+async def update_content_endpoint(content_id: int, updated_content: schemas.UpdateContent, access: AccessResolver = Depends(get_access), db: AsyncSession = Depends(get_db)):
     """Update a content by its ID."""
-    verify_content_access(db, current_user.id, content_id)
-    db_content = crud.update_content(db, content_id=content_id, updated_content=updated_content)
+    await access.require_content(content_id)
+    db_content = await crud.update_content(db, content_id=content_id, updated_content=updated_content)
     if not db_content:
         raise HTTPException(status_code=404, detail="Content not found")
     return db_content
 
-@router.delete("/content/{content_id}", response_model=schemas.Content)
-def delete_content_endpoint(content_id: int, current_user: schemas.User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
-    """Mark content as unavailable and delete its associated media."""
-    verify_content_access(db, current_user.id, content_id)
-    crud.delete_content(db, content_id=content_id)
-    return {"status": "success", "message": "Content marked as unavailable and media deleted."}
\ No newline at end of file
+@router.delete("/content/{content_id}")
+async def delete_content_endpoint(content_id: int, access: AccessResolver = Depends(get_access), db: AsyncSession = Depends(get_db)):
+    """Mark content as deleted; its media and row are removed in the background."""
+    await access.require_content(content_id)
+    await crud.delete_content(db, content_id=content_id)
+    return {"status": "success", "message": "Content marked as unavailable; its media will be deleted shortly."}
\ No newline at end of file
@@ -1,28 +1,41 @@
-from fastapi import FastAPI, HTTPException, Depends, Body, APIRouter
+from fastapi import FastAPI, HTTPException, Depends, Body, APIRouter, Header, Request
 from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette.responses import JSONResponse
-import stripe
-from core.config import STRIPE_SECRET_KEY 
+from typing import Optional
+import uuid
+from db import crud
+from db.database import get_db
+from utils import metrics, payments, webhooks
 router = APIRouter()
 
-# Set your secret key. Remember to switch to your live secret key in production!
-# See your keys here: https://dashboard.stripe.com/account/apikeys
-stripe.api_key = STRIPE_SECRET_KEY
-
 class PaymentData(BaseModel):
     token: str
 
 @router.post("/charge/")
-async def create_charge(payment_data: PaymentData):
+async def create_charge(payment_data: PaymentData, idempotency_key: Optional[str] = Header(None, max_length=255)):
+    """Charge a card token. Sending an Idempotency-Key header makes the request safe to resend."""
     try:
-        # Use Stripe's library to make charges
-        charge = stripe.Charge.create(
+        await payments.create_charge(
             amount=2000, # Amount in cents, for example: $20.00
             currency="usd",
             source=payment_data.token,
-            description="My Payment"
+            description="My Payment",
+            # Without a key from the client, retries of this one request still share a key
+            idempotency_key=idempotency_key or uuid.uuid4().hex,
         )
         return JSONResponse(content={"status": "success"}, status_code=200)
-    except stripe.error.StripeError as e:
-        # Handle the exception
-        return JSONResponse(content={"status": "error", "error": str(e)}, status_code=400)
+    except payments.PaymentError as e:
+        # Declines answer 400 as before; an unreachable provider answers 502
+        return JSONResponse(content={"status": "error", "error": str(e)}, status_code=e.status_code)
+
+@router.post("/payment/webhook", include_in_schema=False)
+async def receive_payment_webhook(request: Request, stripe_signature: Optional[str] = Header(None), db: AsyncSession = Depends(get_db)):
+    """Verify and store a provider event, then acknowledge it; the event workers handle it afterwards."""
+    payload = await webhooks.read_payload(request)
+    webhooks.verify_signature(payload, stripe_signature)
+    event = webhooks.parse_event(payload)
+    # A redelivery of an event already stored is acknowledged too, so the provider stops sending it
+    created = await crud.create_payment_event(db, event["id"], event["type"], event)
+    metrics.payment_events.inc(labels=("received" if created else "duplicate",))
+    return JSONResponse(content={"status": "received"}, status_code=200)
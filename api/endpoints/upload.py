@@ -0,0 +1,150 @@
+# Imports organized by package
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from fastapi import Depends, HTTPException, APIRouter, Query, Request
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.config import UPLOAD_MAX_SIZE, UPLOAD_SESSION_TTL_HOURS
+from db import crud, schemas
+from db.database import get_db, use_primary
+from utils import auth, media, uploads
+from utils.access import AccessResolver, get_access
+
+# Instantiation
+router = APIRouter()
+
+
+def _expiry():
+    return datetime.now(timezone.utc) + timedelta(hours=UPLOAD_SESSION_TTL_HOURS)
+
+
+async def _get_session_or_404(db: AsyncSession, upload_id: str, current_user: schemas.User, for_update: bool = False):
+    upload = await crud.get_upload_session(db, upload_id=upload_id, user_id=current_user.id, for_update=for_update)
+    if not upload:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    # A workspace API key resolves to the workspace owner, whose sessions may belong to other workspaces
+    auth.check_workspace_scope(current_user, upload.workspace_id)
+    return upload
+
+
+async def _progress(db: AsyncSession, upload):
+    received, missing = uploads.merge_ranges(await crud.get_upload_chunks(db, upload.id), upload.size)
+    return {
+        "id": upload.id,
+        "size": upload.size,
+        "received_bytes": received,
+        "missing_ranges": missing,
+        "expires_datetime": upload.expires_datetime,
+    }
+
+
+# Resumable Upload Endpoints
+
+@router.post("/uploads/", response_model=schemas.UploadProgress)
+async def create_upload_session(upload: schemas.CreateUploadSession, current_user: schemas.User = Depends(auth.get_current_user_or_api_key), access: AccessResolver = Depends(get_access), db: AsyncSession = Depends(get_db)):
+    """Start a resumable upload; chunks are then sent with PUT /uploads/{upload_id}/chunks."""
+    await access.require_workspace(upload.workspace_id)
+    media.check_file_extension(upload.filename)
+    if upload.size > UPLOAD_MAX_SIZE:
+        raise HTTPException(status_code=413, detail="File is too large")
+
+    upload_id = uuid.uuid4().hex
+    await asyncio.get_running_loop().run_in_executor(None, uploads.create_staging_file, upload_id, upload.size)
+    db_upload = await crud.create_upload_session(db, upload_id=upload_id, upload=upload, user_id=current_user.id, expires_datetime=_expiry())
+    return await _progress(db, db_upload)
+
+
+@router.put("/uploads/{upload_id}/chunks", response_model=schemas.UploadProgress)
+async def upload_chunk(request: Request, upload_id: str, offset: int = Query(..., ge=0), current_user: schemas.User = Depends(auth.get_current_user_or_api_key), db: AsyncSession = Depends(get_db)):
+    """Write the raw request body at `offset`; chunks may arrive in any order or in parallel."""
+    upload = await _get_session_or_404(db, upload_id, current_user)
+    if offset >= upload.size:
+        raise HTTPException(status_code=416, detail="Offset is past the end of the file")
+
+    # Release the pooled connection while the body streams in
+    await db.commit()
+
+    try:
+        writer = await asyncio.get_running_loop().run_in_executor(None, uploads.open_chunk_writer, upload_id, offset)
+    except FileNotFoundError:
+        # The session expired and the collector removed its staged data while this chunk was on its way
+        raise HTTPException(status_code=410, detail="Upload has expired")
+    try:
+        async for data in request.stream():
+            if offset + writer.size + len(data) > upload.size:
+                raise HTTPException(status_code=413, detail="Chunk runs past the end of the file")
+            await writer.write(data)
+        await writer.close()
+    except BaseException:
+        await writer.abort()
+        raise
+
+    if writer.size:
+        # Locked while the chunk is recorded; the upload may have been completed, aborted or collected meanwhile
+        upload = await _get_session_or_404(db, upload_id, current_user, for_update=True)
+        await crud.record_upload_chunk(db, upload_id=upload_id, offset=offset, length=writer.size, expires_datetime=_expiry())
+        await db.refresh(upload)
+    return await _progress(db, upload)
+
+
+@router.get("/uploads/{upload_id}", response_model=schemas.UploadProgress)
+@use_primary
+async def get_upload_progress(upload_id: str, current_user: schemas.User = Depends(auth.get_current_user_or_api_key), db: AsyncSession = Depends(get_db)):
+    """Report how much of an upload has arrived and which byte ranges are still missing."""
+    upload = await _get_session_or_404(db, upload_id, current_user)
+    return await _progress(db, upload)
+
+
+@router.post("/uploads/{upload_id}/complete", response_model=schemas.Content)
+async def complete_upload(upload_id: str, current_user: schemas.User = Depends(auth.get_current_user_or_api_key), access: AccessResolver = Depends(get_access), db: AsyncSession = Depends(get_db)):
+    """Move a fully received upload into the media library and create its content."""
+    # Lock the session while it is checked, so concurrent completions cannot both publish it
+    upload = await _get_session_or_404(db, upload_id, current_user, for_update=True)
+    # Membership may have been revoked since the upload started
+    await access.require_workspace(upload.workspace_id)
+    _, missing = uploads.merge_ranges(await crud.get_upload_chunks(db, upload_id), upload.size)
+    if missing:
+        raise HTTPException(status_code=409, detail={"message": "Upload is incomplete", "missing_ranges": missing})
+
+    # Let go of the lock and the connection while the file is copied and stored
+    await db.commit()
+    loop = asyncio.get_running_loop()
+    try:
+        copy_path, digest = await loop.run_in_executor(None, uploads.copy_staged_file, upload_id)
+    except FileNotFoundError:
+        # A concurrent completion published it and removed the staged file
+        raise HTTPException(status_code=404, detail="Upload not found")
+    try:
+        source = (copy_path, digest, upload.size, upload.filename)
+        placed = await media.upload_blobs(db, [source])
+        # Locked again before publishing; it is gone if a concurrent completion got there first
+        upload = await _get_session_or_404(db, upload_id, current_user, for_update=True)
+        file_path, = await media.reference_blobs(db, [source], placed)
+
+        content_data = schemas.CreateContent(
+            name=upload.name,
+            title=upload.title,
+            workspace_id=upload.workspace_id,
+            path=file_path,
+            media_digest=digest,
+        )
+        # The session row goes away in the same transaction that creates the content
+        await db.delete(upload)
+        content = await crud.create_content(db=db, content=content_data, user_id=current_user.id)
+    finally:
+        # The blob has its own link to the copy by now, or the completion failed and can be retried
+        await loop.run_in_executor(None, uploads.remove_file, copy_path)
+    # Only now, so a failed completion leaves the upload intact to retry
+    await loop.run_in_executor(None, uploads.remove_staging_file, upload_id)
+    return content
+
+
+@router.delete("/uploads/{upload_id}")
+async def abort_upload(upload_id: str, current_user: schemas.User = Depends(auth.get_current_user_or_api_key), db: AsyncSession = Depends(get_db)):
+    """Abandon an upload and drop everything received so far."""
+    await _get_session_or_404(db, upload_id, current_user)
+    await asyncio.get_running_loop().run_in_executor(None, uploads.remove_staging_file, upload_id)
+    await crud.delete_upload_session(db, upload_id)
+    return {"detail": "Upload aborted"}
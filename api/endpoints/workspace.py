@@ -1,14 +1,17 @@
 # Imports organized by package
-from fastapi import FastAPI, Depends, HTTPException, APIRouter
+from fastapi import FastAPI, Depends, HTTPException, APIRouter, Request, Response
 from fastapi.security import OAuth2PasswordRequestForm
 
-from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from db import crud, models, schemas
-from db.database import SessionLocal, engine, get_db
+from db.database import get_db
 
-from utils import auth
-from typing import Annotated, List
+from core.config import BATCH_MAX_ITEMS
+from utils import auth, conditional
+from utils.access import AccessResolver, get_access
+from typing import Annotated, List, Literal
 
 # Instantiation
 router = APIRouter()
@@ -16,31 +19,78 @@ router = APIRouter()
 # Workspace Endpoints
 
 @router.post("/workspace/", response_model=schemas.Workspace)  # Ensure you have a schema named Workspace
-def create_workspace_endpoint(workspace: schemas.CreateWorkspace, current_user: schemas.User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
+async def create_workspace_endpoint(workspace: schemas.CreateWorkspace, current_user: schemas.User = Depends(auth.get_current_user), db: AsyncSession = Depends(get_db)):
     """Create a new workspace."""
-    return crud.create_workspace(db=db, workspace=workspace, owner_id=current_user.id)
+    if await crud.get_workspace_by_api_key(db, api_key=workspace.api_key):
+        raise HTTPException(status_code=400, detail="API key already in use")
+    try:
+        return await crud.create_workspace(db=db, workspace=workspace, owner_id=current_user.id)
+    except IntegrityError:
+        # Lost the race to another request creating a workspace with the same key
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="API key already in use")
 
 @router.get("/workspace/{workspace_id}", response_model=schemas.Workspace)
-def get_workspace_by_id(workspace_id: int, current_user: schemas.User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
-    """Retrieve a workspace by its ID."""
-    db_workspace = crud.get_workspace(db, workspace_id=workspace_id)
+async def get_workspace_by_id(request: Request, response: Response, workspace_id: int, current_user: schemas.User = Depends(auth.get_current_user), db: AsyncSession = Depends(get_db)):
+    """Retrieve a workspace by its ID, or 304 when the client's copy is still current."""
+    db_workspace = await crud.get_workspace(db, workspace_id=workspace_id)
     if not db_workspace:
         raise HTTPException(status_code=404, detail="Workspace not found")
-    return db_workspace
+    version = db_workspace.update_datetime or db_workspace.create_datetime
+    return conditional.evaluate(request, response, conditional.version_tag(db_workspace.id, version), version) or db_workspace
 
 @router.get("/workspaces/owner/", response_model=List[schemas.Workspace])  # Ensure you have a List imported from typing
-def get_workspaces_by_owner_id(current_user: schemas.User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
+async def get_workspaces_by_owner_id(current_user: schemas.User = Depends(auth.get_current_user), db: AsyncSession = Depends(get_db)):
     """Retrieve all workspaces by the owner's ID."""
-    return crud.get_workspaces_by_owner(db, owner_id=current_user.id)
+    return await crud.get_workspaces_by_owner(db, owner_id=current_user.id)
+
+@router.put("/workspace/{workspace_id}/api-key", response_model=schemas.Workspace)
+async def set_workspace_api_key(workspace_id: int, credentials: schemas.WorkspaceApiKey, current_user: schemas.User = Depends(auth.get_current_user), access: AccessResolver = Depends(get_access), db: AsyncSession = Depends(get_db)):
+    """Replace a workspace's API key and secret; owners only. Workspaces created before keys could be
+    looked up have no working credentials until this is called, and sending the old ones keeps their clients working."""
+    await access.require_workspace_owner(workspace_id)
+    workspace = await crud.get_workspace(db, workspace_id=workspace_id)
+    old_api_key = workspace.api_key
+    try:
+        workspace = await crud.set_workspace_api_key(db, workspace, credentials.api_key, credentials.api_secret)
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="API key already in use")
+    # The update listener only sees the new key
+    if old_api_key:
+        auth.api_key_cache.pop(old_api_key)
+    return workspace
 
 # WorkspaceUserMapping Endpoints
 
 @router.get("/workspace/{workspace_id}/users", response_model=List[schemas.WorkspaceUserMapping])  # Ensure you have a schema named WorkspaceUserMapping
-def get_users_by_workspace_id(workspace_id: int, current_user: schemas.User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
+async def get_users_by_workspace_id(workspace_id: int, current_user: schemas.User = Depends(auth.get_current_user), db: AsyncSession = Depends(get_db)):
     """Retrieve all user mappings for a specific workspace."""
-    return crud.get_user_mappings_by_workspace(db, workspace_id=workspace_id)
+    return await crud.get_user_mappings_by_workspace(db, workspace_id=workspace_id)
 
 @router.post("/workspace/{workspace_id}/user", response_model=schemas.WorkspaceUserMapping)
-def add_user_to_workspace(workspace_id: int, user_id: int, role: str, current_user: schemas.User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
+async def add_user_to_workspace(workspace_id: int, user_id: int, role: Literal["owner", "editor"], current_user: schemas.User = Depends(auth.get_current_user), access: AccessResolver = Depends(get_access), db: AsyncSession = Depends(get_db)):
     """Add a user to a specific workspace with a designated role."""
-    return crud.create_user_mapping_for_workspace(db, workspace_id=workspace_id, user_id=user_id, role=role)
+    await access.require_workspace_owner(workspace_id)
+    return await crud.create_user_mapping_for_workspace(db, workspace_id=workspace_id, user_id=user_id, role=role)
+
+@router.patch("/workspace/{workspace_id}/users", response_model=schemas.WorkspaceMembersChange)
+async def update_workspace_users(workspace_id: int, changes: schemas.UpdateWorkspaceMembers, access: AccessResolver = Depends(get_access), db: AsyncSession = Depends(get_db)):
+    """Add, re-role and remove many members of a workspace in one transaction."""
+    await access.require_workspace_owner(workspace_id)
+    if len(changes.upsert) + len(changes.remove) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_ITEMS} membership changes per request")
+
+    # A user listed twice keeps the last role given
+    roles = {member.user_id: member.role for member in changes.upsert}
+    if roles.keys() & set(changes.remove):
+        raise HTTPException(status_code=400, detail="A user cannot be both added and removed")
+    workspace = await crud.get_workspace(db, workspace_id=workspace_id)
+    if workspace.owner_id in changes.remove:
+        raise HTTPException(status_code=400, detail="The workspace owner cannot be removed")
+    unknown = roles.keys() - await crud.get_existing_user_ids(db, roles.keys()) if roles else set()
+    if unknown:
+        raise HTTPException(status_code=404, detail={"message": "Users not found", "user_ids": sorted(unknown)})
+
+    upserted, removed = await crud.update_user_mappings_for_workspace(db, workspace_id=workspace_id, roles=roles, remove_user_ids=changes.remove)
+    return {"upserted": upserted, "removed": removed}
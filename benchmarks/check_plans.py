@@ -0,0 +1,94 @@
+"""Fail when a hot query's plan falls back to a sequential scan.
+
+Runs each hot path through the real crud/access code, captures the SQL it sends, and EXPLAINs it with
+sequential scans priced out (enable_seqscan = off). If a plan still contains a Seq Scan, no index
+serves that query. tests/test_query_plans.py runs the same check whenever a database is reachable;
+to run it by hand:
+
+    python -m benchmarks.check_plans
+"""
+import asyncio
+import json
+import sys
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from sqlalchemy import event, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db import crud
+from db.database import async_engine
+from db.models.utils import RefreshToken
+from utils.access import AccessResolver
+
+# Tables the hot paths read; a Seq Scan on any of them fails the check
+CHECKED_TABLES = {"content", "users", "workspaces", "workspace_user_mapping", "refresh_tokens", "upload_sessions", "upload_chunks"}
+
+_user = SimpleNamespace(id=1, api_workspace_id=None)
+
+HOT_PATHS = {
+    "content by id with caller role": lambda db: AccessResolver(db, _user).resolve_content(1),
+    "caller roles in workspaces": lambda db: AccessResolver(db, _user).workspace_roles([1, 2]),
+    "workspace content page": lambda db: crud.get_contents_by_workspace(db, workspace_id=1, limit=50),
+    "user content page": lambda db: crud.get_contents_by_user(db, user_id=1, limit=50),
+    "workspace search": lambda db: crud.search_contents_by_workspace(db, workspace_id=1, q="clip", mode="fulltext", limit=50),
+    "login user lookup": lambda db: crud.get_user_by_username(db, username="someone"),
+    "api key lookup": lambda db: crud.get_workspace_and_owner_by_api_key(db, api_key="key"),
+    "refresh token lookup": lambda db: db.scalar(select(RefreshToken.id).where(RefreshToken.token_digest == "0" * 64)),
+    "workspaces by owner": lambda db: crud.get_workspaces_by_owner(db, owner_id=1),
+    "workspace members": lambda db: crud.get_user_mappings_by_workspace(db, workspace_id=1),
+    "upload session chunks": lambda db: crud.get_upload_chunks(db, upload_id="0" * 32),
+    "media collector claim": lambda db: crud.claim_deleted_contents(db, before=datetime.now(timezone.utc), limit=100),
+    "media reconciliation lookup": lambda db: crud.get_referenced_paths(db, ["media/clip.mp4"]),
+}
+
+
+def seq_scans(plan):
+    """Relations read by a Seq Scan anywhere in a JSON plan tree."""
+    found = []
+    if plan.get("Node Type") == "Seq Scan" and plan.get("Relation Name") in CHECKED_TABLES:
+        found.append(plan["Relation Name"])
+    for child in plan.get("Plans", []):
+        found.extend(seq_scans(child))
+    return found
+
+
+async def hot_path_seq_scans(conn, run):
+    """EXPLAIN every statement a hot path sends on conn; returns (statement, seq-scanned tables) for each."""
+    captured = []
+
+    def capture(conn_, cursor, statement, parameters, context, executemany):
+        captured.append((statement, parameters))
+
+    event.listen(conn.sync_connection, "after_cursor_execute", capture)
+    try:
+        async with AsyncSession(bind=conn) as db:
+            await run(db)
+    finally:
+        event.remove(conn.sync_connection, "after_cursor_execute", capture)
+    results = []
+    for statement, parameters in captured:
+        result = await conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}", parameters)
+        plan = result.scalar()
+        plan = json.loads(plan) if isinstance(plan, str) else plan
+        results.append((statement, seq_scans(plan[0]["Plan"])))
+    return results
+
+
+async def check() -> bool:
+    ok = True
+    async with async_engine.connect() as conn:
+        await conn.execute(text("SET enable_seqscan = off"))
+        for name, run in HOT_PATHS.items():
+            for statement, scans in await hot_path_seq_scans(conn, run):
+                status = "SEQ SCAN on " + ", ".join(scans) if scans else "ok"
+                print(f"{name}: {status}")
+                if scans:
+                    ok = False
+                    print("  " + " ".join(statement.split()))
+        await conn.rollback()
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(check()) else 1)
@@ -0,0 +1,438 @@
+"""Load benchmark for the API hot paths.
+
+Seeds users, workspaces, memberships and content straight into the configured database, boots the
+app, then drives each scenario with concurrent clients and prints one JSON report with p50/p95/p99
+latency and throughput per scenario. Reports from two commits can be diffed to spot regressions.
+
+    python -m benchmarks.run --output before.json
+    python -m benchmarks.run --scenarios login refresh --concurrency 32
+    python -m benchmarks.run --scenarios upload --upload-size 4294967296
+    python -m benchmarks.run --scenarios charge --charge-latency-ms 1000
+    python -m benchmarks.run --scenarios upload --storage s3 --storage-latency-ms 20
+
+Point DB_* at a scratch database migrated to head; everything seeded is removed afterwards
+unless --keep is given. By default the app runs under uvicorn in a subprocess so the load generator
+does not share its event loop; --server inprocess drives it through httpx's ASGI transport instead,
+and --base-url targets a server that is already running.
+
+The charge scenario sends payments to a local stub of the provider (benchmarks/stripe_stub.py) while
+content reads run alongside, so the reads' latency shows whether slow charges hold up other traffic.
+The stub is started next to the uvicorn server; with --base-url, point that server's STRIPE_API_BASE
+at a stub yourself.
+
+--storage s3 has the server keep media in a local object store stand-in (benchmarks/s3_stub.py)
+instead of on its own disk, which is how several API nodes would share media.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from datetime import date, datetime, timezone
+
+import httpx
+from sqlalchemy import delete, func, insert, or_, select, update
+
+from db.database import AsyncSessionLocal
+from db.models.content import Content
+from db.models.media import MediaBlob
+from db.models.upload import UploadSession
+from db.models.user import User
+from db.models.utils import RefreshToken
+from db.models.workspace import Workspace, WorkspaceUserMapping
+from utils import hashing, storage
+
+SCENARIOS = ["login", "refresh", "content_get", "content_list", "upload", "charge"]
+PASSWORD = "benchmark-password"
+BLOCK = os.urandom(1024 * 1024)
+
+
+def percentile(sorted_values, pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(pct / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarize(latencies, errors: int, elapsed: float, transferred: int = 0) -> dict:
+    latencies = sorted(latencies)
+    report = {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+    }
+    if transferred:
+        report["bytes"] = transferred
+        report["bytes_per_s"] = round(transferred / elapsed) if elapsed else 0
+    return report
+
+
+# Seeding
+
+async def seed(args, run_id: str) -> dict:
+    """Bulk insert the benchmark data set and return the ids the scenarios need."""
+    hashed_password = hashing._hash(PASSWORD, hashing.bcrypt_rounds)
+    async with AsyncSessionLocal() as db:
+        usernames = [f"bench_{run_id}_{i}" for i in range(args.users)]
+        user_ids = list(await db.scalars(insert(User).returning(User.id), [
+            {
+                "username": username,
+                "email": f"{username}@example.com",
+                "hashed_password": hashed_password,
+                "first_name": "Bench",
+                "last_name": str(i),
+                "date_of_birth": date(1990, 1, 1),
+            }
+            for i, username in enumerate(usernames)
+        ]))
+
+        workspace_rows = [
+            {"name": f"bench {run_id} {i}", "description": "benchmark", "owner_id": user_ids[i % len(user_ids)]}
+            for i in range(args.workspaces)
+        ]
+        workspace_ids = list(await db.scalars(insert(Workspace).returning(Workspace.id), workspace_rows))
+        owners = {workspace_id: row["owner_id"] for workspace_id, row in zip(workspace_ids, workspace_rows)}
+
+        mappings = [{"workspace_id": workspace_id, "user_id": owner_id, "role": "owner"} for workspace_id, owner_id in owners.items()]
+        for n, workspace_id in enumerate(workspace_ids):
+            for k in range(1, args.members + 1):
+                member_id = user_ids[(n + k) % len(user_ids)]
+                if member_id != owners[workspace_id]:
+                    mappings.append({"workspace_id": workspace_id, "user_id": member_id, "role": "editor"})
+        await db.execute(insert(WorkspaceUserMapping), mappings)
+
+        content_ids = []
+        for start in range(0, args.contents, 10000):
+            batch = []
+            for i in range(start, min(start + 10000, args.contents)):
+                workspace_id = workspace_ids[i % len(workspace_ids)]
+                batch.append({
+                    "name": f"clip {i}",
+                    "title": f"Benchmark clip {i}",
+                    "path": f"bench/{run_id}/{i}.mp4",
+                    "user_id": owners[workspace_id],
+                    "workspace_id": workspace_id,
+                    "is_available": True,
+                })
+            content_ids.extend((await db.execute(insert(Content).returning(Content.id, Content.user_id), batch)).all())
+        await db.commit()
+
+    return {
+        "usernames": usernames,
+        "user_ids": user_ids,
+        "workspaces": owners,
+        "contents": content_ids,
+    }
+
+
+async def cleanup(data: dict):
+    user_ids = data["user_ids"]
+    workspace_ids = list(data["workspaces"])
+    async with AsyncSessionLocal() as db:
+        seeded = or_(Content.user_id.in_(user_ids), Content.workspace_id.in_(workspace_ids))
+        paths = list((await db.scalars(select(Content.path).where(seeded, Content.media_digest.is_(None), ~Content.path.like("bench/%")))).all())
+        # Uploaded media lives in shared blobs: drop this run's references and remove blobs nobody else uses
+        released = (await db.execute(select(Content.media_digest, func.count()).where(seeded, Content.media_digest.isnot(None)).group_by(Content.media_digest))).all()
+        for digest, count in sorted(released):
+            await db.execute(update(MediaBlob).where(MediaBlob.digest == digest).values(ref_count=MediaBlob.ref_count - count))
+        if released:
+            paths += (await db.scalars(
+                delete(MediaBlob).where(MediaBlob.digest.in_([digest for digest, _ in released]), MediaBlob.ref_count <= 0).returning(MediaBlob.path)
+            )).all()
+        await db.execute(delete(RefreshToken).where(RefreshToken.user_id.in_(user_ids)))
+        await db.execute(delete(UploadSession).where(UploadSession.user_id.in_(user_ids)))
+        await db.execute(delete(Content).where(seeded))
+        await db.execute(delete(WorkspaceUserMapping).where(WorkspaceUserMapping.workspace_id.in_(workspace_ids)))
+        await db.execute(delete(Workspace).where(Workspace.id.in_(workspace_ids)))
+        await db.execute(delete(User).where(User.id.in_(user_ids)))
+        await db.commit()
+    storage.start()
+    try:
+        for path in paths:
+            await storage.backend.delete(path)
+    finally:
+        await storage.close()
+
+
+# Scenarios
+
+async def drive(count: int, concurrency: int, request) -> dict:
+    """Issue `count` calls of request(i) from `concurrency` clients and summarize them."""
+    latencies, errors = [], 0
+    next_index = iter(range(count))
+
+    async def client():
+        nonlocal errors
+        for i in next_index:
+            start = time.perf_counter()
+            try:
+                ok = await request(i)
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+async def login(client: httpx.AsyncClient, username: str):
+    return await client.post("/api/login/", data={"username": username, "password": PASSWORD})
+
+
+async def login_all(client: httpx.AsyncClient, data: dict, concurrency: int) -> dict:
+    """A token pair for every seeded user, keyed by user id."""
+    tokens = {}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(user_id, username):
+        async with semaphore:
+            response = await login(client, username)
+            response.raise_for_status()
+            tokens[user_id] = response.json()
+
+    await asyncio.gather(*(one(user_id, username) for user_id, username in zip(data["user_ids"], data["usernames"])))
+    return tokens
+
+
+def bearer(tokens: dict, user_id: int) -> dict:
+    return {"Authorization": f"Bearer {tokens[user_id]['access_token']}"}
+
+
+async def run_upload(client: httpx.AsyncClient, args, data: dict, tokens: dict) -> dict:
+    """Resumable uploads of --upload-size bytes, with --upload-parallel chunks in flight at once."""
+    workspace_id, owner_id = next(iter(data["workspaces"].items()))
+    headers = bearer(tokens, owner_id)
+    chunk_latencies, errors, transferred = [], 0, 0
+
+    async def body(length: int):
+        remaining = length
+        while remaining > 0:
+            block = BLOCK[:min(len(BLOCK), remaining)]
+            remaining -= len(block)
+            yield block
+
+    start = time.perf_counter()
+    for n in range(args.uploads):
+        response = await client.post("/api/uploads/", headers=headers, json={
+            "name": f"upload {n}", "title": "Benchmark upload", "workspace_id": workspace_id,
+            "filename": "benchmark.mp4", "size": args.upload_size,
+        })
+        response.raise_for_status()
+        upload_id = response.json()["id"]
+
+        offsets = iter(range(0, args.upload_size, args.upload_chunk_size))
+
+        async def sender():
+            nonlocal errors, transferred
+            for offset in offsets:
+                length = min(args.upload_chunk_size, args.upload_size - offset)
+                chunk_start = time.perf_counter()
+                chunk = await client.put(f"/api/uploads/{upload_id}/chunks", params={"offset": offset}, headers=headers, content=body(length))
+                if chunk.status_code == 200:
+                    chunk_latencies.append(time.perf_counter() - chunk_start)
+                    transferred += length
+                else:
+                    errors += 1
+
+        await asyncio.gather(*(sender() for _ in range(args.upload_parallel)))
+        response = await client.post(f"/api/uploads/{upload_id}/complete", headers=headers)
+        if response.status_code != 200:
+            errors += 1
+    return summarize(chunk_latencies, errors, time.perf_counter() - start, transferred)
+
+
+async def run_scenarios(client: httpx.AsyncClient, args, data: dict) -> dict:
+    results = {}
+    users = list(zip(data["user_ids"], data["usernames"]))
+    contents = data["contents"]
+    workspaces = list(data["workspaces"].items())
+
+    if "login" in args.scenarios:
+        async def one_login(i):
+            return (await login(client, users[i % len(users)][1])).status_code == 200
+        results["login"] = await drive(args.requests, args.concurrency, one_login)
+
+    # Later scenarios use one fresh token pair per user
+    tokens = await login_all(client, data, args.concurrency)
+
+    if "refresh" in args.scenarios:
+        async def one_refresh(i):
+            user_id = users[i % len(users)][0]
+            response = await client.post("/api/token/refresh/", params={"refresh_token": tokens[user_id]["refresh_token"]})
+            return response.status_code == 200
+        results["refresh"] = await drive(args.requests, args.concurrency, one_refresh)
+
+    async def one_get(i):
+        content_id, user_id = contents[(i * 7919) % len(contents)]
+        return (await client.get(f"/api/content/{content_id}", headers=bearer(tokens, user_id))).status_code == 200
+
+    if "content_get" in args.scenarios:
+        results["content_get"] = await drive(args.requests, args.concurrency, one_get)
+
+    if "content_list" in args.scenarios:
+        async def one_list(i):
+            workspace_id, owner_id = workspaces[i % len(workspaces)]
+            response = await client.get(f"/api/contents/workspace/{workspace_id}", params={"limit": args.page_size}, headers=bearer(tokens, owner_id))
+            return response.status_code == 200
+        results["content_list"] = await drive(args.requests, args.concurrency, one_list)
+
+    if "upload" in args.scenarios:
+        results["upload"] = await run_upload(client, args, data, tokens)
+
+    if "charge" in args.scenarios:
+        charge_run = uuid.uuid4().hex
+
+        async def one_charge(i):
+            response = await client.post("/api/charge/", json={"token": "tok_visa"}, headers={"Idempotency-Key": f"{charge_run}-{i}"})
+            return response.status_code == 200
+        results["charge"], results["content_get_during_charges"] = await asyncio.gather(
+            drive(args.requests, args.concurrency, one_charge),
+            drive(args.requests, args.concurrency, one_get),
+        )
+    return results
+
+
+# Server
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_until_up(base_url: str, server: subprocess.Popen, timeout: float = 60, path: str = "/docs"):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise RuntimeError(f"{server.args[2]} exited before it started serving")
+            try:
+                await client.get(path)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"{server.args[2]} did not start in time")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main(args):
+    if "charge" in args.scenarios and args.server == "inprocess" and not args.base_url:
+        raise SystemExit("The charge scenario needs a server it can point at the provider stub: use --server uvicorn or --base-url")
+    if args.storage == "s3" and (args.server == "inprocess" or args.base_url):
+        raise SystemExit("--storage s3 starts a server pointed at the object store stub: use --server uvicorn without --base-url")
+    run_id = uuid.uuid4().hex[:8]
+    data = await seed(args, run_id)
+    server = stub = storage_stub = None
+    server_env = dict(os.environ)
+    app_lifespan = contextlib.nullcontext()
+    timeout = httpx.Timeout(600.0)
+    try:
+        if args.base_url:
+            client = httpx.AsyncClient(base_url=args.base_url, timeout=timeout)
+        elif args.server == "inprocess":
+            from main import app
+            client = httpx.AsyncClient(app=app, base_url="http://benchmark", timeout=timeout)
+            app_lifespan = app.router.lifespan_context(app)
+        else:
+            if "charge" in args.scenarios:
+                stub_url = f"http://127.0.0.1:{free_port()}"
+                stub = subprocess.Popen([
+                    sys.executable, "-m", "benchmarks.stripe_stub", "--port", stub_url.rsplit(":", 1)[1],
+                    "--latency-ms", str(args.charge_latency_ms), "--failure-rate", str(args.charge_failure_rate),
+                ])
+                await wait_until_up(stub_url, stub, path="/health")
+                server_env["STRIPE_API_BASE"] = stub_url
+            if args.storage == "s3":
+                # The stub keeps its objects in a temporary directory that goes when it exits
+                storage_url = f"http://127.0.0.1:{free_port()}"
+                storage_stub = subprocess.Popen([
+                    sys.executable, "-m", "benchmarks.s3_stub", "--port", storage_url.rsplit(":", 1)[1],
+                    "--latency-ms", str(args.storage_latency_ms),
+                ])
+                await wait_until_up(storage_url, storage_stub, path="/health")
+                server_env.update({
+                    "STORAGE_BACKEND": "s3", "S3_ENDPOINT_URL": storage_url, "S3_BUCKET": "benchmark",
+                    "S3_ACCESS_KEY_ID": "stub", "S3_SECRET_ACCESS_KEY": "stub-secret",
+                })
+            base_url = f"http://127.0.0.1:{free_port()}"
+            server = subprocess.Popen([
+                sys.executable, "-m", "uvicorn", "main:app",
+                "--port", base_url.rsplit(":", 1)[1], "--workers", str(args.workers), "--log-level", "warning",
+            ], env=server_env)
+            await wait_until_up(base_url, server)
+            client = httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=httpx.Limits(max_connections=args.concurrency))
+
+        async with client, app_lifespan:
+            results = await run_scenarios(client, args, data)
+    finally:
+        for process in (server, stub, storage_stub):
+            if process is not None:
+                process.terminate()
+                process.wait()
+        if not args.keep:
+            await cleanup(data)
+
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "scenarios": results,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS[:4], help="Scenarios to run; upload and charge are opt-in")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--workspaces", type=int, default=100)
+    parser.add_argument("--members", type=int, default=5, help="Editors added to each workspace")
+    parser.add_argument("--contents", type=int, default=50000)
+    parser.add_argument("--requests", type=int, default=2000, help="Requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--uploads", type=int, default=1)
+    parser.add_argument("--upload-size", type=int, default=2 * 1024 ** 3)
+    parser.add_argument("--upload-chunk-size", type=int, default=64 * 1024 ** 2)
+    parser.add_argument("--upload-parallel", type=int, default=4)
+    parser.add_argument("--charge-latency-ms", type=float, default=300, help="How long the provider stub takes per charge")
+    parser.add_argument("--charge-failure-rate", type=float, default=0.05, help="Share of charge attempts the stub fails with a 500")
+    parser.add_argument("--storage", choices=["local", "s3"], default="local", help="Where the started server keeps media")
+    parser.add_argument("--storage-latency-ms", type=float, default=5, help="How long the object store stub takes per request")
+    parser.add_argument("--server", choices=["uvicorn", "inprocess"], default="uvicorn")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--base-url", help="Benchmark an already running server instead of starting one")
+    parser.add_argument("--keep", action="store_true", help="Leave the seeded data in the database")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = json.dumps(asyncio.run(main(args)), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
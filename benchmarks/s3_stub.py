@@ -0,0 +1,275 @@
+"""A local stand-in for an S3-compatible object store, to run the s3 storage backend without a cloud account.
+
+    python -m benchmarks.s3_stub --port 9100 --latency-ms 5
+    STORAGE_BACKEND=s3 S3_ENDPOINT_URL=http://127.0.0.1:9100 S3_BUCKET=media \\
+        S3_ACCESS_KEY_ID=stub S3_SECRET_ACCESS_KEY=stub-secret uvicorn main:app
+
+It speaks the subset of the S3 API the backend uses, path-style: PUT, ranged GET, HEAD and DELETE of
+objects, multipart uploads and ListObjectsV2. Buckets spring into existence on first use. Every
+request's SigV4 signature and payload hash is checked, as S3 would, so signing bugs show up here.
+Objects are files under --root (a temporary directory removed on exit by default). Each request takes
+--latency-ms to answer, and a --failure-rate share fail with a 500 before anything is done.
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import itertools
+import os
+import random
+import shutil
+import tempfile
+import xml.etree.ElementTree as ElementTree
+from datetime import datetime, timezone
+from email.utils import formatdate
+from urllib.parse import parse_qsl
+from xml.sax.saxutils import escape
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from utils import sigv4
+
+NAMESPACE = "http://s3.amazonaws.com/doc/2006-03-01/"
+BLOCK_SIZE = 1024 * 1024
+
+
+def xml_response(tag: str, body: str, status_code: int = 200) -> Response:
+    return Response(f'<?xml version="1.0" encoding="UTF-8"?><{tag} xmlns="{NAMESPACE}">{body}</{tag}>', status_code=status_code, media_type="application/xml")
+
+
+def error(status_code: int, code: str, message: str) -> Response:
+    return xml_response("Error", f"<Code>{code}</Code><Message>{escape(message)}</Message>", status_code)
+
+
+def _write(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.{random.getrandbits(32):x}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+def _concatenate(part_paths, path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.{random.getrandbits(32):x}.tmp"
+    with open(temp_path, "wb") as out:
+        for part_path in part_paths:
+            with open(part_path, "rb") as part:
+                shutil.copyfileobj(part, out, BLOCK_SIZE)
+    os.replace(temp_path, path)
+
+
+def _read(path: str, start: int, length: int):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            block = f.read(min(BLOCK_SIZE, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+
+
+def _list(bucket_path: str, prefix: str):
+    keys = []
+    for directory, _, filenames in os.walk(bucket_path):
+        for filename in filenames:
+            if not filename.endswith(".tmp"):
+                path = os.path.join(directory, filename)
+                keys.append((os.path.relpath(path, bucket_path).replace(os.sep, "/"), os.stat(path)))
+    return sorted((key, stat_result) for key, stat_result in keys if key.startswith(prefix))
+
+
+def make_app(root: str, access_key: str = "stub", secret_key: str = "stub-secret", latency_ms: float = 0, failure_rate: float = 0.0) -> Starlette:
+    etags = {}
+    uploads = {}
+    upload_ids = itertools.count(1)
+
+    def object_path(bucket: str, key: str) -> str:
+        path = os.path.normpath(os.path.join(root, bucket, key))
+        if not path.startswith(os.path.join(root, bucket) + os.sep):
+            raise ValueError(key)
+        return path
+
+    def check_signature(request: Request, body: bytes):
+        """None if the request is signed correctly by the stub's credentials, otherwise the error to answer with."""
+        authorization = request.headers.get("authorization", "")
+        if not authorization.startswith("AWS4-HMAC-SHA256 "):
+            return error(403, "AccessDenied", "Missing SigV4 authorization")
+        fields = dict(item.strip().split("=", 1) for item in authorization[len("AWS4-HMAC-SHA256 "):].split(","))
+        credential = fields.get("Credential", "").split("/")
+        if credential[0] != access_key or len(credential) != 5:
+            return error(403, "InvalidAccessKeyId", "Unknown access key")
+        payload_hash = request.headers.get("x-amz-content-sha256", "")
+        if payload_hash != "UNSIGNED-PAYLOAD" and payload_hash != hashlib.sha256(body).hexdigest():
+            return error(400, "XAmzContentSHA256Mismatch", "The payload does not match x-amz-content-sha256")
+        signed = fields.get("SignedHeaders", "").split(";")
+        if "host" not in signed:
+            return error(403, "AccessDenied", "The host header must be signed")
+        now = datetime.strptime(request.headers.get("x-amz-date", ""), "%Y%m%dT%H%M%SZ").replace(tzinfo=timezone.utc)
+        if abs((datetime.now(timezone.utc) - now).total_seconds()) > 900:
+            return error(403, "RequestTimeTooSkewed", "The request time is too far from the server time")
+        expected = sigv4.sign(
+            request.method,
+            request.scope["raw_path"].decode(),
+            sigv4.canonical_query(parse_qsl(request.scope["query_string"].decode(), keep_blank_values=True)),
+            {name: request.headers.get(name, "") for name in signed if name not in ("x-amz-content-sha256", "x-amz-date")},
+            payload_hash, access_key, secret_key, credential[2], credential[3], now=now,
+        )["authorization"].rsplit("Signature=", 1)[1]
+        if not hmac.compare_digest(expected, fields.get("Signature", "")):
+            return error(403, "SignatureDoesNotMatch", "The request signature does not match")
+        return None
+
+    async def prelude(request: Request):
+        """Read the body and check the request, returning (body, error response or None)."""
+        body = await request.body()
+        await asyncio.sleep(latency_ms / 1000)
+        if random.random() < failure_rate:
+            return body, error(500, "InternalError", "Stub failure")
+        try:
+            return body, check_signature(request, body)
+        except ValueError:
+            return body, error(400, "AuthorizationHeaderMalformed", "Malformed authorization")
+
+    async def bucket(request: Request):
+        _, failure = await prelude(request)
+        if failure is not None:
+            return failure
+        if request.query_params.get("list-type") != "2":
+            return error(501, "NotImplemented", "Only ListObjectsV2 is supported")
+        prefix = request.query_params.get("prefix", "")
+        max_keys = int(request.query_params.get("max-keys", 1000))
+        after = request.query_params.get("continuation-token", "")
+        keys = [item for item in await run_in_threadpool(_list, os.path.join(root, request.path_params["bucket"]), prefix) if item[0] > after]
+        page, truncated = keys[:max_keys], len(keys) > max_keys
+        body = "".join(
+            f"<Contents><Key>{escape(key)}</Key>"
+            f"<LastModified>{datetime.fromtimestamp(stat_result.st_mtime, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')}</LastModified>"
+            f"<Size>{stat_result.st_size}</Size></Contents>"
+            for key, stat_result in page
+        )
+        body += f"<KeyCount>{len(page)}</KeyCount><IsTruncated>{'true' if truncated else 'false'}</IsTruncated>"
+        if truncated:
+            body += f"<NextContinuationToken>{escape(page[-1][0])}</NextContinuationToken>"
+        return xml_response("ListBucketResult", body)
+
+    async def obj(request: Request):
+        body, failure = await prelude(request)
+        if failure is not None:
+            return failure
+        bucket_name, key = request.path_params["bucket"], request.path_params["key"]
+        try:
+            path = object_path(bucket_name, key)
+        except ValueError:
+            return error(400, "InvalidArgument", "Invalid key")
+        params = request.query_params
+
+        if request.method == "POST" and "uploads" in params:
+            upload_id = f"stub-{next(upload_ids)}.{random.getrandbits(48):x}"
+            uploads[upload_id] = (bucket_name, key, {})
+            return xml_response("InitiateMultipartUploadResult", f"<Bucket>{bucket_name}</Bucket><Key>{escape(key)}</Key><UploadId>{upload_id}</UploadId>")
+
+        if "uploadId" in params:
+            upload = uploads.get(params["uploadId"])
+            if upload is None or upload[:2] != (bucket_name, key):
+                return error(404, "NoSuchUpload", "The upload does not exist")
+            parts = upload[2]
+            part_directory = os.path.join(root, ".multipart", params["uploadId"])
+            if request.method == "PUT":
+                number = int(params["partNumber"])
+                await run_in_threadpool(_write, os.path.join(part_directory, str(number)), body)
+                parts[number] = hashlib.md5(body).digest()
+                return Response(headers={"etag": f'"{parts[number].hex()}"'})
+            if request.method == "DELETE":
+                uploads.pop(params["uploadId"], None)
+                await run_in_threadpool(shutil.rmtree, part_directory, True)
+                return Response(status_code=204)
+            if request.method == "POST":
+                listed = [
+                    (int(part.findtext("PartNumber")), part.findtext("ETag"))
+                    for part in ElementTree.fromstring(body).iterfind("Part")
+                ]
+                numbers = [number for number, _ in listed]
+                if numbers != sorted(numbers) or any(parts.get(number, b"").hex() != etag.strip('"') for number, etag in listed):
+                    return error(400, "InvalidPart", "A listed part was not uploaded or has a different ETag")
+                await run_in_threadpool(_concatenate, [os.path.join(part_directory, str(number)) for number in numbers], path)
+                await run_in_threadpool(shutil.rmtree, part_directory, True)
+                uploads.pop(params["uploadId"], None)
+                etags[path] = f'"{hashlib.md5(b"".join(parts[number] for number in numbers)).hexdigest()}-{len(numbers)}"'
+                return xml_response("CompleteMultipartUploadResult", f"<Bucket>{bucket_name}</Bucket><Key>{escape(key)}</Key><ETag>{escape(etags[path])}</ETag>")
+
+        if request.method == "PUT":
+            await run_in_threadpool(_write, path, body)
+            etags[path] = f'"{hashlib.md5(body).hexdigest()}"'
+            return Response(headers={"etag": etags[path]})
+
+        if request.method == "DELETE":
+            try:
+                await run_in_threadpool(os.remove, path)
+            except FileNotFoundError:
+                pass
+            etags.pop(path, None)
+            return Response(status_code=204)
+
+        try:
+            stat_result = await run_in_threadpool(os.stat, path)
+        except FileNotFoundError:
+            return error(404, "NoSuchKey", "The key does not exist") if request.method == "GET" else Response(status_code=404)
+        size = stat_result.st_size
+        headers = {
+            "etag": etags.get(path, f'"{stat_result.st_mtime_ns:x}-{size:x}"'),
+            "last-modified": formatdate(stat_result.st_mtime, usegmt=True),
+            "accept-ranges": "bytes",
+            "content-length": str(size),
+        }
+        if request.method == "HEAD":
+            return Response(headers=headers)
+
+        start, end, status_code = 0, size - 1, 200
+        range_header = request.headers.get("range", "")
+        if range_header.startswith("bytes="):
+            first, _, last = range_header[len("bytes="):].partition("-")
+            start, end = int(first), min(int(last), size - 1) if last else size - 1
+            if start >= size or start > end:
+                return error(416, "InvalidRange", "The requested range is not satisfiable")
+            status_code = 206
+            headers["content-range"] = f"bytes {start}-{end}/{size}"
+            headers["content-length"] = str(end - start + 1)
+        return StreamingResponse(_read(path, start, end - start + 1), status_code=status_code, headers=headers)
+
+    async def health(request: Request):
+        return JSONResponse({"objects": len(etags), "uploads": len(uploads)})
+
+    return Starlette(routes=[
+        Route("/health", health),
+        Route("/{bucket}", bucket, methods=["GET"]),
+        Route("/{bucket}/{key:path}", obj, methods=["GET", "HEAD", "PUT", "POST", "DELETE"]),
+    ])
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--root", help="Directory to keep objects in; a temporary one by default")
+    parser.add_argument("--access-key", default="stub")
+    parser.add_argument("--secret-key", default="stub-secret")
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    args = parse_args()
+    root = args.root or tempfile.mkdtemp(prefix="s3-stub-")
+    try:
+        app = make_app(os.path.abspath(root), args.access_key, args.secret_key, args.latency_ms, args.failure_rate)
+        uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+    finally:
+        if not args.root:
+            shutil.rmtree(root, ignore_errors=True)
@@ -0,0 +1,81 @@
+"""A local stand-in for the Stripe charges API, to exercise the payment path without the network.
+
+    python -m benchmarks.stripe_stub --port 12111 --latency-ms 300 --failure-rate 0.05
+    STRIPE_API_BASE=http://127.0.0.1:12111 uvicorn main:app
+
+Each charge takes --latency-ms to answer. A --failure-rate share of attempts fail with a 500 before
+anything is recorded, so retries can be seen succeeding. As with Stripe, a repeated Idempotency-Key
+gets the first response back, and one that is still being processed gets a 409. The test token
+tok_chargeDeclined is declined with a 402.
+"""
+import argparse
+import asyncio
+import itertools
+import random
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+
+def make_app(latency_ms: float = 300, failure_rate: float = 0.0) -> Starlette:
+    completed = {}
+    in_flight = set()
+    charge_ids = itertools.count(1)
+
+    async def create_charge(request: Request):
+        key = request.headers.get("idempotency-key")
+        if key in completed:
+            status_code, body = completed[key]
+            return JSONResponse(body, status_code=status_code, headers={"idempotent-replayed": "true"})
+        if key in in_flight:
+            return JSONResponse(
+                {"error": {"type": "idempotency_error", "message": "A request with this key is in progress"}},
+                status_code=409,
+            )
+
+        in_flight.add(key)
+        try:
+            form = await request.form()
+            await asyncio.sleep(latency_ms / 1000)
+            if random.random() < failure_rate:
+                return JSONResponse({"error": {"type": "api_error", "message": "Stub failure"}}, status_code=500)
+            if form.get("source") == "tok_chargeDeclined":
+                status_code, body = 402, {"error": {"type": "card_error", "code": "card_declined", "message": "Your card was declined."}}
+            else:
+                status_code, body = 200, {
+                    "id": f"ch_stub_{next(charge_ids)}",
+                    "object": "charge",
+                    "amount": int(form.get("amount", 0)),
+                    "currency": form.get("currency"),
+                    "status": "succeeded",
+                }
+            if key is not None:
+                completed[key] = (status_code, body)
+            return JSONResponse(body, status_code=status_code)
+        finally:
+            in_flight.discard(key)
+
+    async def health(request: Request):
+        return JSONResponse({"charges": len(completed)})
+
+    return Starlette(routes=[
+        Route("/v1/charges", create_charge, methods=["POST"]),
+        Route("/health", health),
+    ])
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--port", type=int, default=12111)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    args = parse_args()
+    uvicorn.run(make_app(args.latency_ms, args.failure_rate), host="127.0.0.1", port=args.port, log_level="warning")
@@ -9,11 +9,90 @@ SECRET_KEY = os.environ.get("SECRET_KEY")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get("ACCESS_TOKEN_EXPIRE_MINUTES"))
 REFERESH_TOKEN_EXPIRE_MINUTES = int(os.environ.get("REFERESH_TOKEN_EXPIRE_MINUTES"))
+REFRESH_TOKEN_PRUNE_INTERVAL_SECONDS = int(os.environ.get("REFRESH_TOKEN_PRUNE_INTERVAL_SECONDS", 3600))
+AUTH_CACHE_MAX_ENTRIES = int(os.environ.get("AUTH_CACHE_MAX_ENTRIES", 10000))
+AUTH_CACHE_TTL_SECONDS = int(os.environ.get("AUTH_CACHE_TTL_SECONDS", 60))
+API_KEY_CACHE_TTL_SECONDS = int(os.environ.get("API_KEY_CACHE_TTL_SECONDS", 30))
+HASH_POOL_WORKERS = int(os.environ.get("HASH_POOL_WORKERS", os.cpu_count() or 1))
+HASH_QUEUE_LIMIT = int(os.environ.get("HASH_QUEUE_LIMIT", HASH_POOL_WORKERS * 8))
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", 12))
 STRIPE_SECRET_KEY = os.environ.get("STRIPE_SECRET_KEY")
+# Overridable so the payment client can be pointed at a local stub (benchmarks/stripe_stub.py)
+STRIPE_API_BASE = os.environ.get("STRIPE_API_BASE", "https://api.stripe.com")
+STRIPE_TIMEOUT_SECONDS = float(os.environ.get("STRIPE_TIMEOUT_SECONDS", 10))
+STRIPE_MAX_RETRIES = int(os.environ.get("STRIPE_MAX_RETRIES", 2))
+STRIPE_MAX_CONNECTIONS = int(os.environ.get("STRIPE_MAX_CONNECTIONS", 20))
+STRIPE_WEBHOOK_SECRET = os.environ.get("STRIPE_WEBHOOK_SECRET")
+STRIPE_WEBHOOK_TOLERANCE_SECONDS = int(os.environ.get("STRIPE_WEBHOOK_TOLERANCE_SECONDS", 300))
+PAYMENT_EVENT_WORKERS = int(os.environ.get("PAYMENT_EVENT_WORKERS", 4))
+PAYMENT_EVENT_BATCH_SIZE = int(os.environ.get("PAYMENT_EVENT_BATCH_SIZE", 100))
+PAYMENT_EVENT_POLL_SECONDS = float(os.environ.get("PAYMENT_EVENT_POLL_SECONDS", 1))
+PAYMENT_EVENT_MAX_ATTEMPTS = int(os.environ.get("PAYMENT_EVENT_MAX_ATTEMPTS", 8))
+# Also how long a redelivered event is recognised as a duplicate; Stripe redelivers for up to three days
+PAYMENT_EVENT_RETENTION_DAYS = int(os.environ.get("PAYMENT_EVENT_RETENTION_DAYS", 30))
+# Where media lives: "local" keeps it under MEDIA_PATH, "s3" in an S3-compatible object store, so any
+# API node can serve any content. Either way a content's path is its key, and MEDIA_PATH holds in-flight uploads
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "local")
 MEDIA_PATH = "media/"
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL", "https://s3.amazonaws.com")
+S3_REGION = os.environ.get("S3_REGION", "us-east-1")
+S3_BUCKET = os.environ.get("S3_BUCKET")
+S3_ACCESS_KEY_ID = os.environ.get("S3_ACCESS_KEY_ID")
+S3_SECRET_ACCESS_KEY = os.environ.get("S3_SECRET_ACCESS_KEY")
+S3_TIMEOUT_SECONDS = float(os.environ.get("S3_TIMEOUT_SECONDS", 30))
+S3_MAX_CONNECTIONS = int(os.environ.get("S3_MAX_CONNECTIONS", 64))
+S3_MAX_RETRIES = int(os.environ.get("S3_MAX_RETRIES", 2))
+# Files bigger than one part are sent as a multipart upload, this many parts at a time
+S3_PART_SIZE = int(os.environ.get("S3_PART_SIZE", 16 * 1024 * 1024))
+S3_UPLOAD_CONCURRENCY = int(os.environ.get("S3_UPLOAD_CONCURRENCY", 4))
+STREAM_CHUNK_SIZE = int(os.environ.get("STREAM_CHUNK_SIZE", 1024 * 1024))
+# Internal location of MEDIA_PATH on the front proxy, e.g. "/protected-media/". When set, local media is not
+# streamed by the app: once access is checked the response hands the file to the proxy with X-Accel-Redirect
+MEDIA_ACCEL_REDIRECT_PREFIX = os.environ.get("MEDIA_ACCEL_REDIRECT_PREFIX", "")
+UPLOAD_BUFFER_SIZE = int(os.environ.get("UPLOAD_BUFFER_SIZE", 8 * 1024 * 1024))
+# Uploads are written here until they are stored. It lies inside MEDIA_PATH so the local backend stores them with a hard link
+UPLOAD_STAGING_PATH = os.path.join(MEDIA_PATH, ".uploads")
+UPLOAD_MAX_SIZE = int(os.environ.get("UPLOAD_MAX_SIZE", 50 * 1024 ** 3))
+UPLOAD_SESSION_TTL_HOURS = int(os.environ.get("UPLOAD_SESSION_TTL_HOURS", 24))
+UPLOAD_GC_INTERVAL_SECONDS = int(os.environ.get("UPLOAD_GC_INTERVAL_SECONDS", 600))
+MEDIA_GC_INTERVAL_SECONDS = int(os.environ.get("MEDIA_GC_INTERVAL_SECONDS", 60))
+# Deleted contents keep their media this long, so transfers already under way can finish
+MEDIA_GC_GRACE_SECONDS = int(os.environ.get("MEDIA_GC_GRACE_SECONDS", 300))
+MEDIA_RECONCILE_INTERVAL_SECONDS = int(os.environ.get("MEDIA_RECONCILE_INTERVAL_SECONDS", 86400))
+# Unreferenced files younger than this may belong to an upload still being saved, and are left alone
+MEDIA_ORPHAN_MIN_AGE_SECONDS = int(os.environ.get("MEDIA_ORPHAN_MIN_AGE_SECONDS", 3600))
+# Storage operations (deletes, stats, listings) per second allowed to the collector and reconciliation
+MEDIA_IO_OPS_PER_SECOND = float(os.environ.get("MEDIA_IO_OPS_PER_SECOND", 200))
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "false").lower() in ("1", "true", "yes")
+SQL_PROFILING_ENABLED = os.environ.get("SQL_PROFILING_ENABLED", "false").lower() in ("1", "true", "yes")
+SQL_PROFILE_SAMPLE_RATE = float(os.environ.get("SQL_PROFILE_SAMPLE_RATE", 0.01))
+SQL_SLOW_QUERY_MS = float(os.environ.get("SQL_SLOW_QUERY_MS", 100))
+SQL_N_PLUS_ONE_THRESHOLD = int(os.environ.get("SQL_N_PLUS_ONE_THRESHOLD", 5))
+DEFAULT_PAGE_SIZE = int(os.environ.get("DEFAULT_PAGE_SIZE", 50))
+MAX_PAGE_SIZE = int(os.environ.get("MAX_PAGE_SIZE", 200))
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", 1000))
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", 1000))
 
 class Settings:
     DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-    
+    ASYNC_DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+    # Connection pool, applied to the primary and to every replica
+    DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+    DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+    DB_POOL_TIMEOUT_SECONDS = float(os.environ.get("DB_POOL_TIMEOUT_SECONDS", 30))
+    DB_POOL_RECYCLE_SECONDS = int(os.environ.get("DB_POOL_RECYCLE_SECONDS", 1800))
+    DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "false").lower() in ("1", "true", "yes")
+
+    # Read replicas as comma-separated host[:port], sharing the primary's credentials and database name
+    DB_REPLICA_HOSTS = [host.strip() for host in os.environ.get("DB_REPLICA_HOSTS", "").split(",") if host.strip()]
+    ASYNC_REPLICA_URLS = [
+        f"postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{host if ':' in host else f'{host}:{DB_PORT}'}/{DB_NAME}"
+        for host in DB_REPLICA_HOSTS
+    ]
+    # Replicas further behind than this are skipped until they catch up
+    DB_REPLICA_MAX_LAG_SECONDS = float(os.environ.get("DB_REPLICA_MAX_LAG_SECONDS", 1))
+    DB_REPLICA_CHECK_INTERVAL_SECONDS = float(os.environ.get("DB_REPLICA_CHECK_INTERVAL_SECONDS", 5))
+
 
 settings = Settings()
@@ -1,22 +1,29 @@
 from .models.user import User
 from .models.workspace import Workspace, WorkspaceUserMapping
-from sqlalchemy.orm import Session
-from passlib.context import CryptContext
+from sqlalchemy import delete, func, insert, literal_column, select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
 from .models.content import Content
-from core.config import MEDIA_PATH
-import os
+from .models.upload import UploadSession, UploadChunk
+from .models.utils import RefreshToken
+from .models.payment import PaymentEvent
+from .models.media import MediaBlob
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from core.config import SECRET_KEY
+from utils import hashing
+import hashlib
+import hmac
+import re
 
-bcrypt_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+async def get_user(db: AsyncSession, user_id: int):
+    return await db.scalar(select(User).where(User.id == user_id))
 
-def get_user(db: Session, user_id: int):
-    return db.query(User).filter(User.id == user_id).first()
+async def get_user_by_username(db: AsyncSession, username: str):
+    return await db.scalar(select(User).where(User.username == username))
 
-def get_user_by_username(db: Session, username: str):
-    return db.query(User).filter(User.username == username).first()
-
-def create_user(db: Session, user: User):
-    hashed_password = bcrypt_context.hash(user.password)
+async def create_user(db: AsyncSession, user: User):
+    hashed_password = await hashing.hash_secret(user.password)
     db_user = User(
         username=user.username,
         email=user.email,
@@ -26,112 +33,415 @@ def create_user(db: Session, user: User):
         date_of_birth=user.date_of_birth
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
 
-def get_workspace(db: Session, workspace_id: int):
-    return db.query(Workspace).filter(Workspace.id == workspace_id).first()
+def digest_api_secret(api_secret: str) -> str:
+    # Keyed hash: cheap enough to check on every API request, useless without SECRET_KEY
+    return hmac.new(SECRET_KEY.encode(), api_secret.encode(), hashlib.sha256).hexdigest()
+
+
+# Delete one batch of expired or revoked refresh tokens; returns how many rows went
+async def delete_stale_refresh_tokens(db: AsyncSession, now, limit: int):
+    stale_ids = select(RefreshToken.id).where((RefreshToken.expires < now) | (RefreshToken.revoked == True)).limit(limit)
+    result = await db.execute(delete(RefreshToken).where(RefreshToken.id.in_(stale_ids.scalar_subquery())))
+    await db.commit()
+    return result.rowcount
+
+
+# Store a verified webhook event; returns False when the provider already delivered it
+async def create_payment_event(db: AsyncSession, event_id: str, event_type: str, payload: dict) -> bool:
+    result = await db.execute(
+        pg_insert(PaymentEvent)
+        .values(id=event_id, type=event_type, payload=payload)
+        .on_conflict_do_nothing(index_elements=[PaymentEvent.id])
+        .returning(PaymentEvent.id)
+    )
+    await db.commit()
+    return result.scalar() is not None
+
+
+# Lock a batch of due webhook events until the transaction ends. SKIP LOCKED hands concurrent workers,
+# in this process or another, disjoint batches instead of making them wait on each other
+async def claim_payment_events(db: AsyncSession, now, limit: int):
+    return (await db.scalars(
+        select(PaymentEvent)
+        .where(PaymentEvent.processed_datetime.is_(None), PaymentEvent.next_attempt_datetime <= now)
+        .order_by(PaymentEvent.next_attempt_datetime)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )).all()
+
+
+# Delete one batch of webhook events processed before the given time; returns how many rows went
+async def delete_processed_payment_events(db: AsyncSession, before, limit: int):
+    old_ids = select(PaymentEvent.id).where(PaymentEvent.processed_datetime < before).limit(limit)
+    result = await db.execute(delete(PaymentEvent).where(PaymentEvent.id.in_(old_ids.scalar_subquery())))
+    await db.commit()
+    return result.rowcount
+
+
+async def get_workspace(db: AsyncSession, workspace_id: int):
+    return await db.scalar(select(Workspace).where(Workspace.id == workspace_id))
+
+
+async def get_workspace_by_api_key(db: AsyncSession, api_key: str):
+    return await db.scalar(select(Workspace).where(Workspace.api_key == api_key))
+
 
+async def get_workspace_and_owner_by_api_key(db: AsyncSession, api_key: str):
+    return (await db.execute(
+        select(Workspace, User).join(User, User.id == Workspace.owner_id).where(Workspace.api_key == api_key)
+    )).first()
 
-def get_workspaces_by_owner(db: Session, owner_id: int):
-    return db.query(Workspace).filter(Workspace.owner_id == owner_id).all()
 
+async def set_workspace_api_key(db: AsyncSession, workspace: Workspace, api_key: str, api_secret: str):
+    workspace.api_key = api_key
+    workspace.api_secret_digest = digest_api_secret(api_secret)
+    await db.commit()
+    await db.refresh(workspace)
+    return workspace
 
-def create_workspace(db: Session, workspace: Workspace, owner_id: int):
-    # Hash (or encrypt) the API key and secret
-    hashed_api_key = bcrypt_context.hash(workspace.api_key)
-    hashed_api_secret = bcrypt_context.hash(workspace.api_secret)
 
+async def get_workspaces_by_owner(db: AsyncSession, owner_id: int):
+    return (await db.scalars(select(Workspace).where(Workspace.owner_id == owner_id))).all()
+
+
+async def create_workspace(db: AsyncSession, workspace: Workspace, owner_id: int):
     # Create the Workspace entry
     db_workspace = Workspace(
         name=workspace.name,
         description=workspace.description,
         owner_id=owner_id,
-        hashed_api_key=hashed_api_key,
-        hashed_api_secret=hashed_api_secret
+        api_key=workspace.api_key,
+        api_secret_digest=digest_api_secret(workspace.api_secret)
     )
     db.add(db_workspace)
-    db.commit()
-    db.refresh(db_workspace)
+    await db.flush()
 
-    # After the workspace has been created, add an entry to the WorkspaceUserMapping table designating the user as the owner
+    # Add an entry to the WorkspaceUserMapping table designating the user as the owner,
+    # committed together with the workspace itself
     workspace_user_mapping = WorkspaceUserMapping(
         workspace_id=db_workspace.id,
         user_id=owner_id,
         role='owner'
     )
     db.add(workspace_user_mapping)
-    db.commit()
-    db.refresh(workspace_user_mapping)
+    await db.commit()
+    await db.refresh(db_workspace)
 
     return db_workspace
 
 
 # Retrieve all user mappings for a specific workspace
-def get_user_mappings_by_workspace(db: Session, workspace_id: int):
-    return db.query(WorkspaceUserMapping).filter(WorkspaceUserMapping.workspace_id == workspace_id).all()
+async def get_user_mappings_by_workspace(db: AsyncSession, workspace_id: int):
+    return (await db.scalars(select(WorkspaceUserMapping).where(WorkspaceUserMapping.workspace_id == workspace_id))).all()
 
-# Create a new user mapping for a workspace
-def create_user_mapping_for_workspace(db: Session, workspace_id: int, user_id: int, role: str):
-    mapping = WorkspaceUserMapping(
-        workspace_id=workspace_id,
-        user_id=user_id,
-        role=role
-    )
-    db.add(mapping)
-    db.commit()
-    db.refresh(mapping)
+# Insert-or-update statement for memberships; re-adding a member only changes their role
+def _upsert_user_mappings(workspace_id: int, roles: dict):
+    stmt = pg_insert(WorkspaceUserMapping).values([
+        {"workspace_id": workspace_id, "user_id": user_id, "role": role} for user_id, role in roles.items()
+    ])
+    stmt = stmt.on_conflict_do_update(constraint="uq_workspace_user_mapping_workspace_id_user_id", set_={"role": stmt.excluded.role})
+    return stmt.returning(WorkspaceUserMapping).execution_options(populate_existing=True)
+
+# Create a new user mapping for a workspace, or change the role of an existing one
+async def create_user_mapping_for_workspace(db: AsyncSession, workspace_id: int, user_id: int, role: str):
+    mapping = await db.scalar(_upsert_user_mappings(workspace_id, {user_id: role}))
+    await db.commit()
     return mapping
 
+# Add or re-role many members and remove others, set-based and in a single transaction.
+# `roles` maps user ids to roles; returns the upserted mappings and the user ids actually removed.
+async def update_user_mappings_for_workspace(db: AsyncSession, workspace_id: int, roles: dict, remove_user_ids):
+    upserted = (await db.scalars(_upsert_user_mappings(workspace_id, roles))).all() if roles else []
+    removed = []
+    if remove_user_ids:
+        removed = (await db.scalars(
+            delete(WorkspaceUserMapping)
+            .where(WorkspaceUserMapping.workspace_id == workspace_id, WorkspaceUserMapping.user_id.in_(remove_user_ids))
+            .returning(WorkspaceUserMapping.user_id)
+        )).all()
+    await db.commit()
+    return upserted, removed
+
+# Which of the given user ids exist
+async def get_existing_user_ids(db: AsyncSession, user_ids):
+    return set((await db.scalars(select(User.id).where(User.id.in_(user_ids)))).all())
+
 
 # 1. Create a new content item
-def create_content(db: Session, content: Content, user_id: int):
+async def create_content(db: AsyncSession, content: Content, user_id: int):
     db_content = Content(
         name=content.name,
         title=content.title,
         path=content.path,
+        media_digest=content.media_digest,
         user_id=user_id,
         workspace_id=content.workspace_id
     )
     db.add(db_content)
-    db.commit()
-    db.refresh(db_content)
+    await db.commit()
+    await db.refresh(db_content)
     return db_content
 
-# 2. Retrieve a content item by its ID
-def get_content(db: Session, content_id: int):
-    return db.query(Content).filter(Content.id == content_id).first()
+# Create many content items with one multi-row INSERT ... RETURNING, and drop the resumable upload
+# sessions they consumed, all in a single transaction
+async def create_contents(db: AsyncSession, contents: list, user_id: int, upload_ids=()):
+    db_contents = []
+    if contents:
+        db_contents = (await db.scalars(
+            insert(Content).returning(Content, sort_by_parameter_order=True),
+            [
+                {
+                    "name": content.name, "title": content.title, "path": content.path, "media_digest": content.media_digest,
+                    "user_id": user_id, "workspace_id": content.workspace_id,
+                }
+                for content in contents
+            ],
+        )).all()
+    if upload_ids:
+        await db.execute(delete(UploadSession).where(UploadSession.id.in_(upload_ids)))
+    await db.commit()
+    return db_contents
 
-# 3. Retrieve all content items for a given workspace
-def get_contents_by_workspace(db: Session, workspace_id: int):
-    return db.query(Content).filter(Content.workspace_id == workspace_id).all()
+# 2. Retrieve a content item by its ID, unless it has been deleted
+async def get_content(db: AsyncSession, content_id: int):
+    content = await db.get(Content, content_id)
+    return content if content is not None and content.deleted_datetime is None else None
 
-# 4. Retrieve all content items added by a given user
-def get_contents_by_user(db: Session, user_id: int):
-    return db.query(Content).filter(Content.user_id == user_id).all()
+# Fetch one page of content, newest first, starting after the given (created_datetime, id) keyset.
+# Returns the rows and the keyset of the last row, or None when there are no more pages.
+async def get_content_page(db: AsyncSession, query, limit: int, after=None):
+    if after is not None:
+        query = query.where(tuple_(Content.created_datetime, Content.id) < tuple_(*after))
+    query = query.order_by(Content.created_datetime.desc(), Content.id.desc()).limit(limit + 1)
+    rows = (await db.scalars(query)).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, (rows[-1].created_datetime, rows[-1].id)
+
+# 3. Retrieve a page of content items for a given workspace
+async def get_contents_by_workspace(db: AsyncSession, workspace_id: int, limit: int, after=None):
+    query = select(Content).where(Content.workspace_id == workspace_id, Content.deleted_datetime.is_(None))
+    return await get_content_page(db, query, limit, after)
+
+# 4. Retrieve a page of content items added by a given user
+async def get_contents_by_user(db: AsyncSession, user_id: int, limit: int, after=None):
+    query = select(Content).where(Content.user_id == user_id, Content.deleted_datetime.is_(None))
+    return await get_content_page(db, query, limit, after)
+
+# Text search configuration used for Content.search_vector
+SEARCH_CONFIG = "simple"
+
+# Ranked search of a workspace's content by name and title, one page at a time.
+# "fulltext" takes web-search syntax (quotes, OR, -word), "prefix" matches words as they are typed,
+# "fuzzy" tolerates typos through trigram similarity. Returns the rows and the (rank, id) keyset
+# of the last row, or None when there are no more pages.
+async def search_contents_by_workspace(db: AsyncSession, workspace_id: int, q: str, mode: str, limit: int, after=None):
+    if mode == "fuzzy":
+        rank = func.greatest(func.similarity(Content.title, q), func.similarity(Content.name, q))
+        match = Content.title.op("%")(q) | Content.name.op("%")(q)
+    else:
+        if mode == "prefix":
+            words = re.findall(r"\w+", q)
+            if not words:
+                return [], None
+            tsquery = func.to_tsquery(SEARCH_CONFIG, " & ".join(f"{word}:*" for word in words))
+        else:
+            tsquery = func.websearch_to_tsquery(SEARCH_CONFIG, q)
+        rank = func.ts_rank_cd(Content.search_vector, tsquery)
+        match = Content.search_vector.op("@@")(tsquery)
+
+    query = select(Content, rank).where(Content.workspace_id == workspace_id, Content.deleted_datetime.is_(None), match)
+    if after is not None:
+        query = query.where(tuple_(rank, Content.id) < tuple_(*after))
+    rows = (await db.execute(query.order_by(rank.desc(), Content.id.desc()).limit(limit + 1))).all()
+    if len(rows) <= limit:
+        return [content for content, _ in rows], None
+    rows = rows[:limit]
+    return [content for content, _ in rows], (rows[-1][1], rows[-1][0].id)
+
+# Columns written by a content export, matching schemas.Content
+CONTENT_EXPORT_COLUMNS = (
+    Content.id, Content.name, Content.title, Content.user_id, Content.workspace_id,
+    Content.created_datetime, Content.updated_datetime, Content.is_available,
+)
+
+# Stream every content row of a workspace, newest first, in batches read from a server-side cursor.
+# Rows come back as plain mappings rather than ORM objects so nothing accumulates in the session.
+async def stream_contents_by_workspace(db: AsyncSession, workspace_id: int, batch_size: int):
+    query = (
+        select(*CONTENT_EXPORT_COLUMNS)
+        .where(Content.workspace_id == workspace_id, Content.deleted_datetime.is_(None))
+        .order_by(Content.created_datetime.desc(), Content.id.desc())
+        .execution_options(yield_per=batch_size)
+    )
+    result = await db.stream(query)
+    async for batch in result.mappings().partitions():
+        yield batch
 
 # 5. Update a content item by its ID
-def update_content(db: Session, content_id: int, updated_content: Content):
-    db_content = db.query(Content).filter(Content.id == content_id).first()
-    if db_content:
+async def update_content(db: AsyncSession, content_id: int, updated_content: Content):
+    # db.get is served from the identity map when the access check already loaded the row
+    db_content = await db.get(Content, content_id)
+    if db_content and db_content.deleted_datetime is None:
         for key, value in updated_content.__dict__.items():
             setattr(db_content, key, value)
-        db.commit()
-        db.refresh(db_content)
-    return db_content
+        await db.commit()
+        await db.refresh(db_content)
+        return db_content
+    return None
 
-def delete_content(db: Session, content_id: int):
-    db_content = db.query(Content).filter(Content.id == content_id).first()
-    if db_content:
-        # Set is_available to False
+# Tombstone a content: it stops being served at once, and the media collector removes its file and
+# then its row in the background, so the request never waits on the filesystem
+async def delete_content(db: AsyncSession, content_id: int):
+    db_content = await db.get(Content, content_id)
+    if db_content and db_content.deleted_datetime is None:
         db_content.is_available = False
-        
-        # Delete the associated media file
-        media_path = os.path.join(MEDIA_PATH, db_content.path)
-        if os.path.exists(media_path):
-            os.remove(media_path)
-
-        # Save the changes to the database
-        db.commit()
\ No newline at end of file
+        db_content.deleted_datetime = func.now()
+        await db.commit()
+
+# Lock a batch of contents deleted before the given time. Each row comes with its media blob, if any,
+# and for older media with whether a content that is not deleted still points at the same file
+async def claim_deleted_contents(db: AsyncSession, before, limit: int):
+    other = aliased(Content)
+    still_used = select(other.id).where(other.path == Content.path, other.deleted_datetime.is_(None)).exists()
+    return (await db.execute(
+        select(Content.id, Content.path, Content.media_digest, still_used)
+        .where(Content.deleted_datetime < before)
+        .order_by(Content.deleted_datetime)
+        .limit(limit)
+        .with_for_update(of=Content, skip_locked=True)
+    )).all()
+
+# Delete contents and drop the references they held on media blobs, given as {digest: count}
+async def purge_contents(db: AsyncSession, content_ids, released_blobs=None):
+    await db.execute(delete(Content).where(Content.id.in_(content_ids)))
+    for digest, count in sorted((released_blobs or {}).items()):
+        await db.execute(update(MediaBlob).where(MediaBlob.digest == digest).values(ref_count=MediaBlob.ref_count - count))
+    await db.commit()
+
+# Which of the given media paths a content, deleted or not, or a media blob points at
+async def get_referenced_paths(db: AsyncSession, paths) -> set:
+    return set(await db.scalars(
+        select(Content.path).where(Content.path.in_(paths))
+        .union(select(MediaBlob.path).where(MediaBlob.path.in_(paths)))
+    ))
+
+
+# Media blobs
+
+# {digest: path} of the given blobs that exist
+async def get_media_blob_paths(db: AsyncSession, digests) -> dict:
+    rows = await db.execute(select(MediaBlob.digest, MediaBlob.path).where(MediaBlob.digest.in_(digests)))
+    return dict(rows.all())
+
+
+# Take references on media blobs, given as {digest: (path, size, count)}, creating the rows of new ones.
+# Returns {digest: (path, created)}; an existing blob keeps its path. Runs in the caller's transaction,
+# and the rows stay locked until it ends, which keeps the collector away from blobs being reused.
+# Rows go in digest order so concurrent batches cannot deadlock
+async def reference_media_blobs(db: AsyncSession, blobs: dict) -> dict:
+    stmt = pg_insert(MediaBlob).values([
+        {"digest": digest, "path": path, "size": size, "ref_count": count}
+        for digest, (path, size, count) in sorted(blobs.items())
+    ])
+    stmt = stmt.on_conflict_do_update(index_elements=[MediaBlob.digest], set_={"ref_count": MediaBlob.ref_count + stmt.excluded.ref_count})
+    # xmax is 0 on a freshly inserted row version
+    rows = await db.execute(stmt.returning(MediaBlob.digest, MediaBlob.path, literal_column("xmax = 0")))
+    return {digest: (path, created) for digest, path, created in rows}
+
+# Lock a batch of media blobs that no content uses any more
+async def claim_unreferenced_blobs(db: AsyncSession, limit: int):
+    return (await db.execute(
+        select(MediaBlob.digest, MediaBlob.path)
+        .where(MediaBlob.ref_count <= 0)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )).all()
+
+async def delete_media_blobs(db: AsyncSession, digests):
+    await db.execute(delete(MediaBlob).where(MediaBlob.digest.in_(digests)))
+    await db.commit()
+
+# The next batch of (id, path) of contents that are not deleted, in id order after the given id
+async def get_content_paths_after(db: AsyncSession, after_id: int, limit: int):
+    return (await db.execute(
+        select(Content.id, Content.path)
+        .where(Content.id > after_id, Content.deleted_datetime.is_(None))
+        .order_by(Content.id)
+        .limit(limit)
+    )).all()
+
+
+# Resumable upload sessions
+
+async def create_upload_session(db: AsyncSession, upload_id: str, upload, user_id: int, expires_datetime):
+    db_upload = UploadSession(
+        id=upload_id,
+        user_id=user_id,
+        workspace_id=upload.workspace_id,
+        name=upload.name,
+        title=upload.title,
+        filename=upload.filename,
+        size=upload.size,
+        expires_datetime=expires_datetime
+    )
+    db.add(db_upload)
+    await db.commit()
+    await db.refresh(db_upload)
+    return db_upload
+
+async def get_upload_session(db: AsyncSession, upload_id: str, user_id: int, for_update: bool = False):
+    query = select(UploadSession).where(UploadSession.id == upload_id, UploadSession.user_id == user_id)
+    if for_update:
+        query = query.with_for_update()
+    return await db.scalar(query)
+
+async def get_upload_sessions(db: AsyncSession, upload_ids, user_id: int, for_update: bool = False):
+    query = select(UploadSession).where(UploadSession.id.in_(upload_ids), UploadSession.user_id == user_id)
+    if for_update:
+        query = query.with_for_update()
+    return {upload.id: upload for upload in (await db.scalars(query)).all()}
+
+# Received (offset, length) chunks of several upload sessions, keyed by session id
+async def get_upload_chunks_by_session(db: AsyncSession, upload_ids):
+    rows = await db.execute(
+        select(UploadChunk.session_id, UploadChunk.offset, UploadChunk.length)
+        .where(UploadChunk.session_id.in_(upload_ids))
+        .order_by(UploadChunk.session_id, UploadChunk.offset)
+    )
+    chunks = {}
+    for session_id, offset, length in rows:
+        chunks.setdefault(session_id, []).append((offset, length))
+    return chunks
+
+async def get_upload_chunks(db: AsyncSession, upload_id: str):
+    result = await db.execute(
+        select(UploadChunk.offset, UploadChunk.length).where(UploadChunk.session_id == upload_id).order_by(UploadChunk.offset)
+    )
+    return result.all()
+
+# Record a received chunk and push back the session expiry; re-sent chunks overwrite their earlier record
+async def record_upload_chunk(db: AsyncSession, upload_id: str, offset: int, length: int, expires_datetime):
+    stmt = pg_insert(UploadChunk).values(session_id=upload_id, offset=offset, length=length)
+    stmt = stmt.on_conflict_do_update(constraint="uq_upload_chunks_session_id_offset", set_={"length": stmt.excluded.length})
+    await db.execute(stmt)
+    await db.execute(update(UploadSession).where(UploadSession.id == upload_id).values(expires_datetime=expires_datetime))
+    await db.commit()
+
+async def delete_upload_session(db: AsyncSession, upload_id: str):
+    await db.execute(delete(UploadSession).where(UploadSession.id == upload_id))
+    await db.commit()
+
+async def get_expired_upload_session_ids(db: AsyncSession, now, limit: int):
+    result = await db.scalars(select(UploadSession.id).where(UploadSession.expires_datetime < now).limit(limit))
+    return result.all()
+
+async def get_upload_session_ids(db: AsyncSession, upload_ids):
+    result = await db.scalars(select(UploadSession.id).where(UploadSession.id.in_(upload_ids)))
+    return set(result.all())
@@ -1,19 +1,116 @@
-from sqlalchemy import create_engine
+from fastapi import Request
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+import asyncio
+import itertools
+import logging
+import math
+import time
 
 from core.config import settings
+from utils import background, metrics
+
+logger = logging.getLogger(__name__)
 
 DATABASE_URL = settings.DATABASE_URL
+ASYNC_DATABASE_URL = settings.ASYNC_DATABASE_URL
+
+# Pool settings shared by every engine
+POOL_OPTIONS = {
+    "pool_size": settings.DB_POOL_SIZE,
+    "max_overflow": settings.DB_MAX_OVERFLOW,
+    "pool_timeout": settings.DB_POOL_TIMEOUT_SECONDS,
+    "pool_recycle": settings.DB_POOL_RECYCLE_SECONDS,
+    "pool_pre_ping": settings.DB_POOL_PRE_PING,
+}
 
-engine = create_engine(DATABASE_URL)
+# Sync engine, kept for scripts and tooling that run outside the event loop
+engine = create_engine(DATABASE_URL, **POOL_OPTIONS)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Connection pool that records how long each checkout waited for a free connection."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            metrics.db_pool_checkout_seconds.observe(time.perf_counter() - start)
+
+
+# Async engine on asyncpg for the primary; every write goes here
+async_engine = create_async_engine(ASYNC_DATABASE_URL, poolclass=TimedQueuePool, **POOL_OPTIONS)
+
+# Optional read replicas, used by GET/HEAD endpoints
+replica_engines = [create_async_engine(url, poolclass=TimedQueuePool, **POOL_OPTIONS) for url in settings.ASYNC_REPLICA_URLS]
+# Seconds each replica trails the primary; replicas not yet checked or unreachable count as infinitely behind
+replica_lag = [math.inf] * len(replica_engines)
+_next_replica = itertools.count()
+
+# Pool occupancy, read when /metrics is scraped
+metrics.Gauge("db_pool_checked_out", "Connections currently checked out of the pool", callback=lambda: async_engine.pool.checkedout())
+metrics.Gauge("db_pool_overflow", "Connections open beyond the pool size", callback=lambda: max(async_engine.pool.overflow(), 0))
+metrics.Gauge(
+    "db_pool_saturation",
+    "Checked out connections as a fraction of the pool size plus overflow",
+    callback=lambda: async_engine.pool.checkedout() / (settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW),
+)
+metrics.Gauge("db_replicas_in_rotation", "Read replicas currently within the lag budget", callback=lambda: sum(
+    lag <= settings.DB_REPLICA_MAX_LAG_SECONDS for lag in replica_lag
+))
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
-    try:
+
+def read_engine():
+    """A replica within the lag budget, taken round-robin, or the primary when none is."""
+    in_rotation = [replica for replica, lag in zip(replica_engines, replica_lag) if lag <= settings.DB_REPLICA_MAX_LAG_SECONDS]
+    if not in_rotation:
+        return async_engine
+    return in_rotation[next(_next_replica) % len(in_rotation)]
+
+
+def use_primary(endpoint):
+    """Keep a read-only endpoint on the primary, for clients that expect to read their own writes."""
+    endpoint.use_primary = True
+    return endpoint
+
+
+async def get_db(request: Request):
+    """A session for one request: GET/HEAD endpoints read from a replica when one is in rotation."""
+    bind = async_engine
+    if replica_engines and request.method in ("GET", "HEAD") and not getattr(request.scope.get("endpoint"), "use_primary", False):
+        bind = read_engine()
+    async with AsyncSessionLocal(bind=bind) as db:
         yield db
-    finally:
-        db.close()
+
+
+# Zero on a replica that has replayed everything it received, so an idle primary does not look like lag
+REPLICA_LAG_SQL = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+
+async def _measure_lag(replica) -> float:
+    async with replica.connect() as conn:
+        return float(await conn.scalar(REPLICA_LAG_SQL))
+
+
+@background.periodic(settings.DB_REPLICA_CHECK_INTERVAL_SECONDS)
+async def check_replica_lag():
+    """Measure how far each replica trails the primary; unreachable ones drop out of rotation."""
+    for index, replica in enumerate(replica_engines):
+        try:
+            replica_lag[index] = await asyncio.wait_for(_measure_lag(replica), timeout=settings.DB_REPLICA_CHECK_INTERVAL_SECONDS)
+        except Exception:
+            if replica_lag[index] != math.inf:
+                logger.warning("Read replica %s is unreachable, sending its reads to the primary", settings.DB_REPLICA_HOSTS[index], exc_info=True)
+            replica_lag[index] = math.inf
@@ -1,4 +1,7 @@
 from . import user
 from . import workspace
 from . import utils
-from . import content
\ No newline at end of file
+from . import content
+from . import upload
+from . import payment
+from . import media
\ No newline at end of file
@@ -1,14 +1,27 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Computed, Integer, String, ForeignKey, DateTime, Boolean, Index, text
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import deferred, relationship
 from sqlalchemy.sql import func
 from db.database import Base
 
 class Content(Base):
     __tablename__ = "content"
+    __table_args__ = (
+        # Keyset pagination of the workspace and user listings
+        Index("ix_content_workspace_id_created_datetime_id", "workspace_id", "created_datetime", "id"),
+        Index("ix_content_user_id_created_datetime_id", "user_id", "created_datetime", "id"),
+        # Search: full-text and prefix matching on the tsvector, fuzzy matching on trigrams (pg_trgm)
+        Index("ix_content_search_vector", "search_vector", postgresql_using="gin"),
+        Index("ix_content_name_trgm", "name", postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"}),
+        Index("ix_content_title_trgm", "title", postgresql_using="gin", postgresql_ops={"title": "gin_trgm_ops"}),
+        # The media collector's queue of deleted contents
+        Index("ix_content_deleted_datetime", "deleted_datetime", postgresql_where=text("deleted_datetime IS NOT NULL")),
+    )
 
-    id = Column(Integer, primary_key=True, index=True)
-    name = Column(String, index=True, nullable=False)
-    title = Column(String, index=True, nullable=False)
+    id = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False)
+    title = Column(String, nullable=False)
+    # Indexed for media reconciliation and for checking whether a file is shared before removing it
     path = Column(String, index=True, nullable=False)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     workspace_id = Column(Integer, ForeignKey('workspaces.id'), nullable=True)
@@ -16,6 +29,16 @@ class Content(Base):
     updated_datetime = Column(DateTime(timezone=True), default=func.now(), onupdate=func.now())
     is_available = Column(Boolean, default=True, nullable=False)
     is_approved_by_owner = Column(Boolean, default=False, nullable=False)
+    # The media blob holding the file, whose reference count this row holds; NULL for media stored
+    # before content addressing. No foreign key, so dropping a blob does not have to scan this table
+    media_digest = Column(String(64))
+    # Tombstone: set on delete; the media collector later removes the file, then the row
+    deleted_datetime = Column(DateTime(timezone=True))
+    # Maintained by Postgres from title (weighted higher) and name; deferred so ordinary loads skip it
+    search_vector = deferred(Column(TSVECTOR, Computed(
+        "setweight(to_tsvector('simple', coalesce(title, '')), 'A') || setweight(to_tsvector('simple', coalesce(name, '')), 'B')",
+        persisted=True,
+    )))
 
     user = relationship("User", back_populates="content")
     workspace = relationship("Workspace", back_populates="content")
\ No newline at end of file
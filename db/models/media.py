@@ -0,0 +1,18 @@
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Index, text
+from sqlalchemy.sql import func
+from db.database import Base
+
+class MediaBlob(Base):
+    """One stored media file, named by the SHA-256 of its bytes and shared by every content with those bytes."""
+    __tablename__ = "media_blobs"
+    __table_args__ = (
+        # The collector's queue: blobs no content uses any more
+        Index("ix_media_blobs_unreferenced", "digest", postgresql_where=text("ref_count <= 0")),
+    )
+
+    digest = Column(String(64), primary_key=True)
+    path = Column(String, unique=True, nullable=False)
+    size = Column(BigInteger, nullable=False)
+    # Contents pointing at this blob, tombstoned ones included until the collector purges them
+    ref_count = Column(Integer, nullable=False)
+    created_datetime = Column(DateTime(timezone=True), server_default=func.now())
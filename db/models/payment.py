@@ -0,0 +1,23 @@
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Index, text
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.sql import func
+from db.database import Base
+
+class PaymentEvent(Base):
+    __tablename__ = "payment_events"
+    __table_args__ = (
+        # The workers' queue: only events still waiting to be processed, in the order they fall due
+        Index("ix_payment_events_pending", "next_attempt_datetime", postgresql_where=text("processed_datetime IS NULL")),
+    )
+
+    # The provider's event id; a redelivered event collides here and is dropped
+    id = Column(String(255), primary_key=True)
+    type = Column(String, nullable=False)
+    payload = Column(JSONB, nullable=False)
+    received_datetime = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    next_attempt_datetime = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    attempts = Column(Integer, default=0, server_default="0", nullable=False)
+    last_error = Column(String)
+    # Set once the event is handled, or given up on (failed); processed events are pruned after a retention period
+    processed_datetime = Column(DateTime(timezone=True), index=True)
+    failed = Column(Boolean, default=False, server_default="false", nullable=False)
@@ -0,0 +1,31 @@
+from sqlalchemy import Column, Integer, BigInteger, String, ForeignKey, DateTime, UniqueConstraint
+from sqlalchemy.orm import relationship
+from sqlalchemy.sql import func
+from db.database import Base
+
+class UploadSession(Base):
+    __tablename__ = "upload_sessions"
+
+    id = Column(String(32), primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    workspace_id = Column(Integer, ForeignKey('workspaces.id'), nullable=False)
+    name = Column(String, nullable=False)
+    title = Column(String, nullable=False)
+    filename = Column(String, nullable=False)
+    size = Column(BigInteger, nullable=False)
+    created_datetime = Column(DateTime(timezone=True), server_default=func.now())
+    expires_datetime = Column(DateTime(timezone=True), index=True, nullable=False)
+
+    chunks = relationship("UploadChunk", cascade="all, delete-orphan", passive_deletes=True)
+
+
+class UploadChunk(Base):
+    __tablename__ = "upload_chunks"
+    __table_args__ = (
+        UniqueConstraint("session_id", "offset", name="uq_upload_chunks_session_id_offset"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    session_id = Column(String(32), ForeignKey('upload_sessions.id', ondelete="CASCADE"), nullable=False)
+    offset = Column(BigInteger, nullable=False)
+    length = Column(BigInteger, nullable=False)
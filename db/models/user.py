@@ -8,12 +8,12 @@ from db.database import Base
 class User(Base):
     __tablename__ = "users"
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     username = Column(String, unique=True, index=True, nullable=False)
     email = Column(String, unique=True, index=True, nullable=False)
     hashed_password = Column(String, nullable=False)
-    first_name = Column(String, index=True, nullable=False)
-    last_name = Column(String, index=True, nullable=False)
+    first_name = Column(String, nullable=False)
+    last_name = Column(String, nullable=False)
     date_of_birth = Column(Date, nullable=False)
     create_datetime = Column(DateTime(timezone=True), server_default=func.now())
     update_datetime = Column(DateTime(timezone=True), onupdate=func.now())
@@ -5,8 +5,9 @@ from datetime import datetime
 class RefreshToken(Base):
     __tablename__ = "refresh_tokens"
 
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
-    token = Column(String, index=True, unique=True, nullable=False)
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), index=True, nullable=False)
+    # SHA-256 hex digest of the token: fixed-size unique index, and no usable tokens at rest
+    token_digest = Column(String(64), index=True, unique=True, nullable=False)
     expires = Column(DateTime, index=True, default=datetime.utcnow)
     revoked = Column(Boolean, default=False)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Enum
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Enum, UniqueConstraint
 from sqlalchemy.orm import relationship
 from db.database import Base
 from sqlalchemy.sql import func
@@ -8,12 +8,13 @@ from sqlalchemy.sql import func
 class Workspace(Base):
     __tablename__ = "workspaces"
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     name = Column(String, index=True, nullable=False)
     description = Column(String)
-    owner_id = Column(Integer, ForeignKey('users.id'), nullable=False)
-    hashed_api_key = Column(String)
-    hashed_api_secret = Column(String)
+    owner_id = Column(Integer, ForeignKey('users.id'), index=True, nullable=False)
+    # Public API key id, looked up through its unique index; the secret is stored as a keyed digest
+    api_key = Column(String, unique=True, index=True)
+    api_secret_digest = Column(String(64))
     create_datetime = Column(DateTime(timezone=True), server_default=func.now())
     update_datetime = Column(DateTime(timezone=True), onupdate=func.now())
     
@@ -25,8 +26,12 @@ class Workspace(Base):
 
 class WorkspaceUserMapping(Base):
     __tablename__ = "workspace_user_mapping"
+    __table_args__ = (
+        # One membership per user and workspace; also the index behind every access check
+        UniqueConstraint("workspace_id", "user_id", name="uq_workspace_user_mapping_workspace_id_user_id"),
+    )
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     workspace_id = Column(Integer, ForeignKey('workspaces.id'), nullable=False)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     role = Column(Enum('owner', 'editor', name="role_enum"), nullable=False)
\ No newline at end of file
@@ -1,10 +1,11 @@
 # schemas.py
 
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, ConfigDict, EmailStr, Field, model_validator
 from datetime import date
 from datetime import datetime
 from fastapi import UploadFile, Form
 from dataclasses import dataclass 
+from typing import Any, List, Literal, Optional
 
 class User(BaseModel):
     username: str
@@ -13,6 +14,14 @@ class User(BaseModel):
     last_name: str
     date_of_birth: date
 
+# Schema for the authenticated principal resolved from an access token
+class CurrentUser(User):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    # Set when the caller authenticated with a workspace API key; access is limited to that workspace
+    api_workspace_id: Optional[int] = None
+
 class CreateUser(BaseModel):
     username: str
     email: EmailStr
@@ -32,6 +41,11 @@ class CreateWorkspace(BaseModel):
     api_key: str 
     api_secret: str
 
+# Schema to re-issue a workspace's API credentials
+class WorkspaceApiKey(BaseModel):
+    api_key: str
+    api_secret: str
+
 class Workspace(BaseModel):
     name: str
     description: str
@@ -42,6 +56,21 @@ class WorkspaceUserMapping(BaseModel):
     user_id: int
     role: str
 
+# Schema for one member in a bulk membership change
+class WorkspaceMember(BaseModel):
+    user_id: int
+    role: Literal["owner", "editor"]
+
+# Schema to add, re-role and remove many workspace members at once
+class UpdateWorkspaceMembers(BaseModel):
+    upsert: List[WorkspaceMember] = []
+    remove: List[int] = []
+
+# Schema for the result of a bulk membership change
+class WorkspaceMembersChange(BaseModel):
+    upserted: List[WorkspaceUserMapping]
+    removed: List[int]
+
 # Base schema for Content
 class ContentBase(BaseModel):
     name: str
@@ -56,13 +85,57 @@ class Content(ContentBase):
     updated_datetime: datetime
     is_available: bool
 
+# Schema for one page of a Content listing
+class ContentPage(BaseModel):
+    items: List[Content]
+    next_cursor: Optional[str] = None
+
+# Text fields sent alongside an uploaded file
+class ContentUpload(ContentBase):
+    workspace_id: int
+
 # Schema to create Content
 class CreateContent(BaseModel):
     name: str 
     title: str 
     workspace_id: int
     path: str
+    media_digest: Optional[str] = None
+
+# One record of a batch ingest; its media is either a file part of the same request or a finished resumable upload
+class BatchContentItem(ContentUpload):
+    file: Optional[str] = None
+    upload_id: Optional[str] = None
+
+    @model_validator(mode="after")
+    def check_source(self):
+        if (self.file is None) == (self.upload_id is None):
+            raise ValueError("Give exactly one of 'file' or 'upload_id'")
+        return self
+
+# Outcome of one batch ingest record: the created content, or why it was skipped
+class BatchItemResult(BaseModel):
+    index: int
+    content: Optional[Content] = None
+    error: Optional[Any] = None
+
+class BatchResult(BaseModel):
+    created: int
+    items: List[BatchItemResult]
 
 # Schema to update Content
 class UpdateContent(ContentBase):
-    pass
\ No newline at end of file
+    pass
+
+# Schema to start a resumable upload
+class CreateUploadSession(ContentUpload):
+    filename: str
+    size: int = Field(gt=0)
+
+# Schema to report resumable upload progress; missing_ranges are [start, end) byte ranges
+class UploadProgress(BaseModel):
+    id: str
+    size: int
+    received_bytes: int
+    missing_ranges: List[List[int]]
+    expires_datetime: datetime
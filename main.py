@@ -1,7 +1,25 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from api.endpoints import user, payment, workspace, content
+from api.endpoints import user, payment, workspace, content, upload, metrics as metrics_endpoint
+from core.config import METRICS_ENABLED, SQL_PROFILING_ENABLED
+from db.database import async_engine, replica_engines
+from utils import background, hashing, media_gc, metrics, payments, profiling, storage
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    hashing.start()
+    payments.start()
+    storage.start()
+    background.start()
+    yield
+    await background.stop()
+    await storage.close()
+    await payments.close()
+    hashing.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
 
 API_PREFIX = "/api"
 
@@ -9,3 +27,13 @@ app.include_router(user.router,tags=["User"], prefix=API_PREFIX)
 app.include_router(payment.router,tags=["Payment"], prefix=API_PREFIX)
 app.include_router(workspace.router,tags=["Workspace"], prefix=API_PREFIX)
 app.include_router(content.router,tags=["Content"], prefix=API_PREFIX)
+app.include_router(upload.router,tags=["Upload"], prefix=API_PREFIX)
+
+if METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+    app.include_router(metrics_endpoint.router, tags=["Metrics"])
+
+if SQL_PROFILING_ENABLED:
+    for db_engine in [async_engine, *replica_engines]:
+        profiling.install(db_engine.sync_engine)
+    app.add_middleware(profiling.ProfilingMiddleware)
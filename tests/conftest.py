@@ -0,0 +1,12 @@
+import os
+
+# core.config reads these at import. The tests run against the local stubs in benchmarks/ and, where
+# one needs it, the database configured in the environment
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
+os.environ.setdefault("REFERESH_TOKEN_EXPIRE_MINUTES", "1440")
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("DB_HOST", "localhost")
+os.environ.setdefault("DB_PORT", "5432")
+os.environ.setdefault("DB_NAME", "contentify")
+os.environ.setdefault("DB_USER", "postgres")
+os.environ.setdefault("DB_PASSWORD", "postgres")
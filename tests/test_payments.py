@@ -0,0 +1,127 @@
+import asyncio
+import types
+
+import httpx
+import pytest
+
+from benchmarks import stripe_stub
+from utils import payments
+
+
+class StubTransport(httpx.AsyncBaseTransport):
+    """Send requests to a stripe_stub app in process, recording each attempt's Idempotency-Key.
+
+    `faults` are applied to attempts in order: an exception is raised instead of sending, a status code
+    is answered instead of sending, and "lost" sends the request but raises as if the response never arrived.
+    """
+
+    def __init__(self, app, faults=()):
+        self.app = app
+        self.inner = httpx.ASGITransport(app=app)
+        self.faults = list(faults)
+        self.keys = []
+
+    async def handle_async_request(self, request):
+        self.keys.append(request.headers.get("idempotency-key"))
+        fault = self.faults.pop(0) if self.faults else None
+        if isinstance(fault, Exception):
+            raise fault
+        if isinstance(fault, int):
+            return httpx.Response(fault, json={"error": {"message": f"Injected {fault}"}})
+        response = await self.inner.handle_async_request(request)
+        if fault == "lost":
+            await response.aread()
+            raise httpx.ReadError("Connection reset")
+        return response
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(payments, "STRIPE_MAX_RETRIES", 2)
+    monkeypatch.setattr(payments, "_backoff", lambda attempt: 0)
+
+
+def charge_all(transport, *charges):
+    """Create the given (source, idempotency key) charges concurrently; returns results or PaymentErrors."""
+    async def main():
+        payments._client = httpx.AsyncClient(transport=transport, base_url="http://stripe.test")
+        try:
+            return await asyncio.gather(
+                *(payments.create_charge(2000, "usd", source, "Test", key) for source, key in charges),
+                return_exceptions=True,
+            )
+        finally:
+            await payments.close()
+    return asyncio.run(main())
+
+
+def charge(transport, source="tok_visa", key="key-1"):
+    result, = charge_all(transport, (source, key))
+    if isinstance(result, BaseException):
+        raise result
+    return result
+
+
+def stub_charges(transport) -> int:
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=transport.app), base_url="http://stripe.test") as client:
+            return (await client.get("/health")).json()["charges"]
+    return asyncio.run(main())
+
+
+def test_transport_error_is_retried():
+    transport = StubTransport(stripe_stub.make_app(latency_ms=0), faults=[httpx.ConnectError("Connection refused")])
+    assert charge(transport)["status"] == "succeeded"
+    assert transport.keys == ["key-1", "key-1"]
+
+
+def test_server_error_is_retried(monkeypatch):
+    # The stub fails an attempt when random() falls under failure_rate: the first one here, not the second
+    draws = iter([0.0, 0.9])
+    monkeypatch.setattr(stripe_stub, "random", types.SimpleNamespace(random=lambda: next(draws)))
+    transport = StubTransport(stripe_stub.make_app(latency_ms=0, failure_rate=0.5))
+    assert charge(transport)["status"] == "succeeded"
+    assert transport.keys == ["key-1", "key-1"]
+    assert stub_charges(transport) == 1
+
+
+def test_retry_reuses_idempotency_key():
+    # The first attempt is charged but its response is lost; the retry gets that same charge back
+    transport = StubTransport(stripe_stub.make_app(latency_ms=0), faults=["lost"])
+    result = charge(transport)
+    assert transport.keys == ["key-1", "key-1"]
+    assert result["id"] == "ch_stub_1"
+    assert stub_charges(transport) == 1
+
+
+def test_conflict_while_in_flight_is_retried(monkeypatch):
+    # The second request arrives while the first is still being processed and gets a 409, then the replay
+    monkeypatch.setattr(payments, "_backoff", lambda attempt: 0.1)
+    transport = StubTransport(stripe_stub.make_app(latency_ms=50))
+    first, second = charge_all(transport, ("tok_visa", "key-1"), ("tok_visa", "key-1"))
+    assert first["id"] == second["id"]
+    assert len(transport.keys) == 3
+    assert stub_charges(transport) == 1
+
+
+def test_rate_limit_is_retried():
+    transport = StubTransport(stripe_stub.make_app(latency_ms=0), faults=[429])
+    assert charge(transport)["status"] == "succeeded"
+    assert transport.keys == ["key-1", "key-1"]
+
+
+def test_decline_is_not_retried_and_answers_400():
+    transport = StubTransport(stripe_stub.make_app(latency_ms=0))
+    with pytest.raises(payments.PaymentError) as error:
+        charge(transport, source="tok_chargeDeclined")
+    assert error.value.status_code == 400
+    assert str(error.value) == "Your card was declined."
+    assert len(transport.keys) == 1
+
+
+def test_exhausted_retries_answer_502():
+    transport = StubTransport(stripe_stub.make_app(latency_ms=0, failure_rate=1.0))
+    with pytest.raises(payments.PaymentError) as error:
+        charge(transport)
+    assert error.value.status_code == 502
+    assert transport.keys == ["key-1"] * 3
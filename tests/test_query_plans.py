@@ -0,0 +1,41 @@
+import asyncio
+
+import pytest
+from sqlalchemy import text
+
+from benchmarks import check_plans
+from db.database import async_engine
+
+
+def run_conn(test):
+    async def main():
+        try:
+            async with async_engine.connect() as conn:
+                return await test(conn)
+        finally:
+            await async_engine.dispose()
+    return asyncio.run(main())
+
+
+@pytest.fixture
+def database():
+    async def ping(conn):
+        await conn.execute(text("SELECT 1"))
+    try:
+        run_conn(ping)
+    except Exception as e:
+        pytest.skip(f"No database to test against: {e!r}")
+
+
+@pytest.mark.parametrize("name", list(check_plans.HOT_PATHS))
+def test_hot_path_is_served_by_an_index(database, name):
+    async def test(conn):
+        await conn.execute(text("SET enable_seqscan = off"))
+        try:
+            return await check_plans.hot_path_seq_scans(conn, check_plans.HOT_PATHS[name])
+        finally:
+            await conn.rollback()
+
+    results = run_conn(test)
+    assert results, "the hot path sent no statements"
+    assert [(" ".join(statement.split()), scans) for statement, scans in results if scans] == []
@@ -0,0 +1,174 @@
+import asyncio
+import os
+import socket
+import threading
+import time
+
+import httpx
+import pytest
+import uvicorn
+
+from benchmarks import s3_stub
+from utils import storage
+
+PART_SIZE = 64 * 1024
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def stub(tmp_path, monkeypatch):
+    """An s3_stub served on a local port, with the S3 backend pointed at it. Part numbers added to
+    `stub.failing_parts` are answered with a 500."""
+    app = s3_stub.make_app(str(tmp_path))
+    failing_parts = set()
+
+    async def with_failures(scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "PUT":
+            params = dict(item.partition("=")[::2] for item in scope["query_string"].decode().split("&"))
+            if params.get("partNumber", "").isdigit() and int(params["partNumber"]) in failing_parts:
+                await s3_stub.error(500, "InternalError", "Injected failure")(scope, receive, send)
+                return
+        await app(scope, receive, send)
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(with_failures, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+
+    endpoint = f"http://127.0.0.1:{port}"
+    monkeypatch.setattr(storage, "S3_ENDPOINT_URL", endpoint)
+    monkeypatch.setattr(storage, "S3_BUCKET", "media")
+    monkeypatch.setattr(storage, "S3_ACCESS_KEY_ID", "stub")
+    monkeypatch.setattr(storage, "S3_SECRET_ACCESS_KEY", "stub-secret")
+    monkeypatch.setattr(storage, "S3_PART_SIZE", PART_SIZE)
+    monkeypatch.setattr(storage, "S3_MAX_RETRIES", 2)
+    monkeypatch.setattr(storage, "_backoff", lambda attempt: 0)
+    stub.endpoint = endpoint
+    stub.failing_parts = failing_parts
+    yield stub
+    server.should_exit = True
+    thread.join()
+
+
+def run(test):
+    """Run `test(backend)` on a started S3 backend."""
+    async def main():
+        backend = storage.S3Storage()
+        backend.start()
+        try:
+            return await test(backend)
+        finally:
+            await backend.close()
+    return asyncio.run(main())
+
+
+async def read_all(backend, key, start, length) -> bytes:
+    return b"".join([block async for block in backend.read_range(key, start, length)])
+
+
+def health(stub) -> dict:
+    return httpx.get(f"{stub.endpoint}/health").json()
+
+
+@pytest.fixture
+def source(tmp_path):
+    def write(size: int) -> str:
+        path = tmp_path / f"source-{size}"
+        path.write_bytes(os.urandom(size))
+        return str(path)
+    return write
+
+
+def test_put_single_request(stub, source):
+    path = source(1000)
+
+    async def test(backend):
+        await backend.put("media/aa/single.mp4", path)
+        return await backend.stat("media/aa/single.mp4"), await read_all(backend, "media/aa/single.mp4", 0, 1000)
+
+    stat, data = run(test)
+    assert stat.size == 1000
+    assert "-" not in stat.etag
+    assert data == open(path, "rb").read()
+
+
+def test_put_multipart(stub, source):
+    size = 3 * PART_SIZE + 123
+    path = source(size)
+
+    async def test(backend):
+        await backend.put("media/aa/multi part.mp4", path)
+        return await backend.stat("media/aa/multi part.mp4"), await read_all(backend, "media/aa/multi part.mp4", 0, size)
+
+    stat, data = run(test)
+    assert stat.size == size
+    # A multipart ETag ends in the number of parts
+    assert stat.etag.strip('"').endswith("-4")
+    assert data == open(path, "rb").read()
+    assert health(stub)["uploads"] == 0
+
+
+def test_read_range(stub, source):
+    path = source(PART_SIZE * 2)
+    expected = open(path, "rb").read()
+
+    async def test(backend):
+        await backend.put("media/aa/range.mp4", path)
+        return await read_all(backend, "media/aa/range.mp4", 1000, 5000), await read_all(backend, "media/aa/range.mp4", len(expected) - 10, 10)
+
+    middle, tail = run(test)
+    assert middle == expected[1000:6000]
+    assert tail == expected[-10:]
+
+
+def test_stat_missing_key_is_none(stub):
+    assert run(lambda backend: backend.stat("media/aa/missing.mp4")) is None
+
+
+def test_delete(stub, source):
+    path = source(100)
+
+    async def test(backend):
+        await backend.put("media/aa/gone.mp4", path)
+        deleted = await backend.delete("media/aa/gone.mp4")
+        return deleted, await backend.stat("media/aa/gone.mp4")
+
+    deleted, stat = run(test)
+    assert deleted is True
+    assert stat is None
+
+
+def test_list_pages(stub, source):
+    path = source(10)
+    keys = [f"media/{index:02d}/item.mp4" for index in range(5)]
+
+    async def test(backend):
+        for key in keys:
+            await backend.put(key, path)
+        return [batch async for batch in backend.list(batch_size=2)]
+
+    batches = run(test)
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    assert [key for batch in batches for key, _ in batch] == keys
+    assert all(mtime > 0 for batch in batches for _, mtime in batch)
+
+
+def test_failed_part_aborts_multipart_upload(stub, source):
+    path = source(3 * PART_SIZE)
+    stub.failing_parts.add(2)
+
+    async def test(backend):
+        with pytest.raises(storage.StorageError):
+            await backend.put("media/aa/failed.mp4", path)
+        return await backend.stat("media/aa/failed.mp4")
+
+    assert run(test) is None
+    # The parts already sent were dropped with the upload
+    assert health(stub)["uploads"] == 0
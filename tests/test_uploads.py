@@ -0,0 +1,34 @@
+import asyncio
+import hashlib
+
+from utils import media, storage, uploads
+
+GOOD = b"GOODDATA"
+EVIL = b"EVILEVIL"
+
+
+def test_late_chunk_write_cannot_change_a_published_blob(tmp_path, monkeypatch):
+    # MEDIA_PATH and upload staging are relative to the working directory
+    monkeypatch.chdir(tmp_path)
+
+    async def main():
+        uploads.create_staging_file("upload1", len(GOOD))
+        writer = uploads.open_chunk_writer("upload1", 0)
+        await writer.write(GOOD)
+        await writer.close()
+
+        # A re-sent chunk at offset 0 is still open while the upload completes
+        late_writer = uploads.open_chunk_writer("upload1", 0)
+        copy_path, digest = uploads.copy_staged_file("upload1")
+        path = media.blob_path(digest, "clip.mp4")
+        await storage.LocalStorage().put(path, copy_path)
+        uploads.remove_file(copy_path)
+
+        await late_writer.write(EVIL)
+        await late_writer.close()
+        return digest, path
+
+    digest, path = asyncio.run(main())
+    assert digest == hashlib.sha256(GOOD).hexdigest()
+    with open(path, "rb") as blob:
+        assert blob.read() == GOOD
@@ -0,0 +1,206 @@
+import asyncio
+import contextlib
+import hashlib
+import hmac
+import json
+import types
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import delete, func, select
+
+from db import crud
+from db.database import AsyncSessionLocal, async_engine
+from db.models.payment import PaymentEvent
+from utils import metrics, webhooks
+
+SECRET = "whsec_test"
+TOLERANCE = 300
+
+
+def signature_header(payload: bytes, timestamp: int, secret: str = SECRET) -> str:
+    signature = hmac.new(secret.encode(), f"{timestamp}.".encode() + payload, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+@pytest.fixture(autouse=True)
+def tolerance(monkeypatch):
+    monkeypatch.setattr(webhooks, "STRIPE_WEBHOOK_TOLERANCE_SECONDS", TOLERANCE)
+
+
+# Signature verification
+
+PAYLOAD = b'{"id": "evt_1", "type": "charge.succeeded"}'
+
+
+def test_valid_signature():
+    webhooks.verify_signature(PAYLOAD, signature_header(PAYLOAD, 1_700_000_000), SECRET, now=1_700_000_000)
+
+
+def test_signature_among_several_is_enough():
+    header = f"t=1700000000,v1={'0' * 64}," + signature_header(PAYLOAD, 1_700_000_000).split(",")[1]
+    webhooks.verify_signature(PAYLOAD, header, SECRET, now=1_700_000_000)
+
+
+@pytest.mark.parametrize("offset", [-TOLERANCE, TOLERANCE])
+def test_timestamp_at_the_edge_of_the_tolerance(offset):
+    webhooks.verify_signature(PAYLOAD, signature_header(PAYLOAD, 1_700_000_000), SECRET, now=1_700_000_000 + offset)
+
+
+@pytest.mark.parametrize("offset", [-TOLERANCE - 1, TOLERANCE + 1])
+def test_timestamp_outside_the_tolerance(offset):
+    with pytest.raises(HTTPException) as error:
+        webhooks.verify_signature(PAYLOAD, signature_header(PAYLOAD, 1_700_000_000), SECRET, now=1_700_000_000 + offset)
+    assert error.value.status_code == 400
+    assert "tolerance" in error.value.detail
+
+
+@pytest.mark.parametrize("header", [
+    signature_header(PAYLOAD, 1_700_000_000, secret="whsec_other"),
+    signature_header(PAYLOAD + b" ", 1_700_000_000),
+    # The timestamp is signed too
+    signature_header(PAYLOAD, 1_700_000_000).replace("t=1700000000", "t=1700000001"),
+])
+def test_invalid_signature(header):
+    with pytest.raises(HTTPException) as error:
+        webhooks.verify_signature(PAYLOAD, header, SECRET, now=1_700_000_000)
+    assert error.value.status_code == 400
+    assert error.value.detail == "Invalid signature"
+
+
+@pytest.mark.parametrize("header", [None, "", "v1=abc", "t=1700000000", "t=soon,v1=abc"])
+def test_malformed_signature(header):
+    with pytest.raises(HTTPException) as error:
+        webhooks.verify_signature(PAYLOAD, header, SECRET, now=1_700_000_000)
+    assert error.value.status_code == 400
+
+
+def test_unconfigured_secret_refuses_events():
+    with pytest.raises(HTTPException) as error:
+        webhooks.verify_signature(PAYLOAD, signature_header(PAYLOAD, 1_700_000_000), "", now=1_700_000_000)
+    assert error.value.status_code == 503
+
+
+# Deduplication, against the database in the environment
+
+def run_db(test):
+    async def main():
+        try:
+            async with AsyncSessionLocal() as db:
+                return await test(db)
+        finally:
+            await async_engine.dispose()
+    return asyncio.run(main())
+
+
+@pytest.fixture
+def database():
+    async def ping(db):
+        await db.execute(select(1))
+    try:
+        run_db(ping)
+    except Exception as e:
+        pytest.skip(f"No database to test against: {e!r}")
+
+
+def test_redelivered_event_is_stored_once(database):
+    event_id = f"evt_test_{uuid.uuid4().hex}"
+    event = {"id": event_id, "type": "charge.succeeded", "data": {"object": {"id": "ch_1"}}}
+
+    async def test(db):
+        try:
+            first = await crud.create_payment_event(db, event_id, event["type"], event)
+            second = await crud.create_payment_event(db, event_id, event["type"], dict(event, delivery=2))
+            rows = await db.scalar(select(func.count()).select_from(PaymentEvent).where(PaymentEvent.id == event_id))
+            payload = await db.scalar(select(PaymentEvent.payload).where(PaymentEvent.id == event_id))
+            return first, second, rows, payload
+        finally:
+            await db.execute(delete(PaymentEvent).where(PaymentEvent.id == event_id))
+            await db.commit()
+
+    first, second, rows, payload = run_db(test)
+    assert (first, second, rows) == (True, False, 1)
+    # The first delivery is the one kept
+    assert payload == event
+
+
+# Processing, with the claimed events handed out by a stand-in for the database
+
+class FakeSession:
+    def begin_nested(self):
+        return contextlib.nullcontext()
+
+    async def commit(self):
+        pass
+
+
+def pending_event(event_type: str, payload: dict = None):
+    return types.SimpleNamespace(
+        id=f"evt_{uuid.uuid4().hex}", type=event_type, payload=payload or {}, attempts=0, last_error=None,
+        next_attempt_datetime=None, processed_datetime=None, failed=False,
+    )
+
+
+@pytest.fixture
+def claimed(monkeypatch):
+    """The events the next _process_batch claims."""
+    events = []
+
+    async def claim_payment_events(db, now, limit):
+        return [event for event in events if event.processed_datetime is None][:limit]
+
+    monkeypatch.setattr(crud, "claim_payment_events", claim_payment_events)
+    return events
+
+
+def process_batch():
+    return asyncio.run(webhooks._process_batch(FakeSession()))
+
+
+def test_retry_delay_doubles_up_to_an_hour():
+    assert [webhooks._retry_delay(attempts).total_seconds() for attempts in range(1, 11)] == [
+        10, 20, 40, 80, 160, 320, 640, 1280, 2560, 3600,
+    ]
+
+
+def test_failing_event_backs_off_until_the_attempt_limit(claimed, monkeypatch):
+    async def broken(db, payload):
+        raise RuntimeError("handler failed")
+
+    monkeypatch.setitem(webhooks._handlers, "test.broken", broken)
+    monkeypatch.setattr(webhooks, "PAYMENT_EVENT_MAX_ATTEMPTS", 4)
+    event = pending_event("test.broken")
+    claimed.append(event)
+
+    for attempts in range(1, 4):
+        before = datetime.now(timezone.utc)
+        assert process_batch() == 1
+        assert event.attempts == attempts
+        assert event.processed_datetime is None
+        assert "handler failed" in event.last_error
+        delay = event.next_attempt_datetime - before
+        assert webhooks._retry_delay(attempts) <= delay < webhooks._retry_delay(attempts) + timedelta(seconds=1)
+
+    assert process_batch() == 1
+    assert event.attempts == 4
+    assert event.failed is True
+    assert event.processed_datetime is not None
+    # Given up on, so no longer claimed
+    assert process_batch() == 0
+
+
+def test_charge_events_are_handled(claimed):
+    succeeded = pending_event("charge.succeeded", {"data": {"object": {"id": "ch_1", "amount": 2000, "currency": "usd"}}})
+    failed = pending_event("charge.failed", {"data": {"object": {"id": "ch_2", "failure_message": "Your card was declined."}}})
+    unhandled = pending_event("customer.created")
+    claimed.extend([succeeded, failed, unhandled])
+    counts = dict(metrics.payment_charges._values)
+
+    assert process_batch() == 3
+    for event in (succeeded, failed, unhandled):
+        assert event.processed_datetime is not None
+        assert event.failed is False
+    assert metrics.payment_charges._values[("succeeded",)] == counts.get(("succeeded",), 0) + 1
+    assert metrics.payment_charges._values[("failed",)] == counts.get(("failed",), 0) + 1
@@ -0,0 +1,102 @@
+from typing import Dict, Iterable, Optional
+
+from fastapi import Depends, HTTPException
+from sqlalchemy import and_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db import schemas
+from db.database import get_db
+from db.models.content import Content
+from db.models.workspace import Workspace, WorkspaceUserMapping
+from utils import auth
+
+
+class AccessResolver:
+    """Per-request authorization for the current user.
+
+    Each lookup resolves the caller's effective role ("owner", "editor" or None) in a workspace
+    with a single joined query, and memoizes it for the rest of the request.
+    """
+
+    def __init__(self, db: AsyncSession, current_user: schemas.CurrentUser):
+        self.db = db
+        self.user = current_user
+        self._roles: Dict[int, Optional[str]] = {}
+
+    def _role(self, owner_id, mapped_role):
+        if owner_id == self.user.id:
+            return "owner"
+        return mapped_role
+
+    def _membership_join(self, workspace_id_column):
+        return and_(WorkspaceUserMapping.workspace_id == workspace_id_column, WorkspaceUserMapping.user_id == self.user.id)
+
+    async def workspace_roles(self, workspace_ids: Iterable[int]) -> Dict[int, Optional[str]]:
+        """Batch form: the caller's role in each workspace, fetching only ones not seen yet."""
+        workspace_ids = set(workspace_ids)
+        missing = workspace_ids - self._roles.keys()
+        if missing:
+            rows = await self.db.execute(
+                select(Workspace.id, Workspace.owner_id, WorkspaceUserMapping.role)
+                .outerjoin(WorkspaceUserMapping, self._membership_join(Workspace.id))
+                .where(Workspace.id.in_(missing))
+            )
+            # (workspace_id, user_id) is unique, so each workspace yields one row
+            for workspace_id, owner_id, mapped_role in rows:
+                self._roles[workspace_id] = self._role(owner_id, mapped_role)
+            for workspace_id in missing:
+                self._roles.setdefault(workspace_id, None)
+        return {workspace_id: self._roles[workspace_id] for workspace_id in workspace_ids}
+
+    async def workspace_role(self, workspace_id: int) -> Optional[str]:
+        return (await self.workspace_roles([workspace_id]))[workspace_id]
+
+    async def require_workspaces(self, workspace_ids: Iterable[int]):
+        """Verify the user is a member or an owner of every given workspace."""
+        roles = await self.workspace_roles(workspace_ids)
+        for workspace_id, role in roles.items():
+            auth.check_workspace_scope(self.user, workspace_id)
+            if role is None:
+                raise HTTPException(status_code=403, detail="Access forbidden: You are not a member or owner of this workspace")
+        return roles
+
+    async def require_workspace(self, workspace_id: int) -> str:
+        """Verify the user is a member or an owner of the given workspace and return their role."""
+        return (await self.require_workspaces([workspace_id]))[workspace_id]
+
+    async def require_workspace_owner(self, workspace_id: int):
+        """Verify the user owns the given workspace."""
+        if await self.require_workspace(workspace_id) != "owner":
+            raise HTTPException(status_code=403, detail="Access forbidden: Only the workspace owner can do this")
+
+    async def resolve_content(self, content_id: int):
+        """Fetch a content that has not been deleted together with the caller's role in its workspace, in one query."""
+        row = (await self.db.execute(
+            select(Content, Workspace.owner_id, WorkspaceUserMapping.role)
+            .outerjoin(Workspace, Workspace.id == Content.workspace_id)
+            .outerjoin(WorkspaceUserMapping, self._membership_join(Content.workspace_id))
+            .where(Content.id == content_id, Content.deleted_datetime.is_(None))
+            .limit(1)
+        )).first()
+        if row is None:
+            return None, None
+        content, owner_id, mapped_role = row
+        role = self._role(owner_id, mapped_role)
+        if content.workspace_id is not None:
+            self._roles[content.workspace_id] = role
+        return content, role
+
+    async def require_content(self, content_id: int) -> Content:
+        """Verify the user has access to the given content (either as its uploader or the workspace owner)."""
+        content, role = await self.resolve_content(content_id)
+        if not content:
+            raise HTTPException(status_code=404, detail="Content not found")
+
+        auth.check_workspace_scope(self.user, content.workspace_id)
+        if content.user_id != self.user.id and role != "owner":
+            raise HTTPException(status_code=403, detail="Access forbidden: You don't have permissions")
+        return content
+
+
+async def get_access(current_user: schemas.User = Depends(auth.get_current_user_or_api_key), db: AsyncSession = Depends(get_db)):
+    return AccessResolver(db, current_user)
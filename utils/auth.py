@@ -1,45 +1,137 @@
 from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status
-from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from fastapi.security import APIKeyHeader, OAuth2PasswordBearer
+from sqlalchemy import event, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from db import crud, models, schemas, database
 from db.models.user import User
 from db.models.utils import RefreshToken
+from db.models.workspace import Workspace
 from datetime import timedelta, datetime
-from passlib.context import CryptContext
-from utils import auth 
-from core.config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, REFERESH_TOKEN_EXPIRE_MINUTES
+from utils import auth, background, hashing
+from utils.cache import TTLCache
+from core.config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, REFERESH_TOKEN_EXPIRE_MINUTES, AUTH_CACHE_MAX_ENTRIES, AUTH_CACHE_TTL_SECONDS, API_KEY_CACHE_TTL_SECONDS, REFRESH_TOKEN_PRUNE_INTERVAL_SECONDS
+from typing import Optional
+import hashlib
+import hmac
+import secrets
+import time
 
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/login")
-bcrypt_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/login", auto_error=False)
+api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
+api_secret_header = APIKeyHeader(name="X-API-Secret", auto_error=False)
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
-    credentials_exception = HTTPException(
+# Verified access token claims keyed by the raw token; an entry never outlives its token
+token_claims_cache = TTLCache(maxsize=AUTH_CACHE_MAX_ENTRIES, ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+# Resolved principals keyed by user id; dropped whenever the user row changes
+principal_cache = TTLCache(maxsize=AUTH_CACHE_MAX_ENTRIES, ttl=AUTH_CACHE_TTL_SECONDS)
+# Verified workspace API keys: api_key -> (secret digest, principal)
+api_key_cache = TTLCache(maxsize=AUTH_CACHE_MAX_ENTRIES, ttl=API_KEY_CACHE_TTL_SECONDS)
+
+
+def decode_access_token(token: str) -> dict:
+    claims = token_claims_cache.get(token)
+    if claims is None:
+        claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        token_claims_cache.set(token, claims, ttl=claims["exp"] - time.time())
+    return claims
+
+
+def invalidate_user(user_id: int):
+    principal_cache.pop(user_id)
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_modified_user(mapper, connection, target):
+    invalidate_user(target.id)
+
+
+@event.listens_for(Workspace, "after_update")
+@event.listens_for(Workspace, "after_delete")
+def _invalidate_modified_workspace(mapper, connection, target):
+    if target.api_key:
+        api_key_cache.pop(target.api_key)
+
+
+def _credentials_exception():
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(database.get_db)):
+    credentials_exception = _credentials_exception()
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_access_token(token)
         username: str = payload.get("sub")
-        if username is None:
+        user_id: int = payload.get("id")
+        if username is None or user_id is None:
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    user = crud.get_user_by_username(db, username=username)
+    user = principal_cache.get(user_id)
     if user is None:
-        raise credentials_exception
+        db_user = await crud.get_user(db, user_id=user_id)
+        if db_user is None:
+            raise credentials_exception
+        user = schemas.CurrentUser.model_validate(db_user)
+        principal_cache.set(user_id, user)
     return user
 
 
-def authorize_user(username: str, password: str, db):
-    user = db.query(User).filter(User.username == username).first()
+async def authenticate_api_key(api_key: str, api_secret: str, db: AsyncSession):
+    """Resolve a workspace API key to its owner, limited to that workspace."""
+    secret_digest = crud.digest_api_secret(api_secret)
+    cached = api_key_cache.get(api_key)
+    if cached is None:
+        row = await crud.get_workspace_and_owner_by_api_key(db, api_key=api_key)
+        if row is None or row.Workspace.api_secret_digest is None:
+            raise _credentials_exception()
+        principal = schemas.CurrentUser.model_validate(row.User).model_copy(update={"api_workspace_id": row.Workspace.id})
+        cached = (row.Workspace.api_secret_digest, principal)
+        api_key_cache.set(api_key, cached)
+    stored_digest, principal = cached
+    if not hmac.compare_digest(secret_digest, stored_digest):
+        raise _credentials_exception()
+    return principal
+
+
+async def get_current_user_or_api_key(
+    token: Optional[str] = Depends(optional_oauth2_scheme),
+    api_key: Optional[str] = Depends(api_key_header),
+    api_secret: Optional[str] = Depends(api_secret_header),
+    db: AsyncSession = Depends(database.get_db),
+):
+    """Authenticate with either a bearer access token or a workspace API key/secret pair."""
+    if token is None and api_key and api_secret:
+        return await authenticate_api_key(api_key, api_secret, db)
+    if token is None:
+        raise _credentials_exception()
+    return await get_current_user(token, db)
+
+
+def check_workspace_scope(current_user: schemas.CurrentUser, workspace_id: int):
+    """Reject a workspace API key used outside the workspace it belongs to."""
+    if current_user.api_workspace_id is not None and current_user.api_workspace_id != workspace_id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access forbidden: API key is not valid for this workspace")
+
+
+async def authorize_user(username: str, password: str, db: AsyncSession):
+    user = await db.scalar(select(User).where(User.username == username))
     if not user:
         return None
-    if not bcrypt_context.verify(password, user.hashed_password):
+    valid, new_hash = await hashing.verify_and_update(password, user.hashed_password)
+    if not valid:
         return None
+    if new_hash:
+        # The stored hash uses an outdated cost; the caller's next commit persists the rehash
+        user.hashed_password = new_hash
 
     return user
 
@@ -55,48 +147,58 @@ def create_refresh_token(user_id: int, expiration_delta: timedelta = timedelta(m
     token_data = {
         "type": "refresh",
         "user_id": user_id,
-        "exp": datetime.utcnow() + expiration_delta
+        "exp": datetime.utcnow() + expiration_delta,
+        # Keeps two tokens issued to the same user in the same second distinct
+        "jti": secrets.token_hex(8)
     }
     return jwt.encode(token_data, SECRET_KEY, algorithm=ALGORITHM)
 
 
-def verify_user(form_data, db: Session):
-    user = auth.authorize_user(form_data.username, form_data.password, db)
+def digest_refresh_token(refresh_token: str) -> str:
+    # Refresh tokens are stored and looked up by a fixed-size digest, never in the clear
+    return hashlib.sha256(refresh_token.encode()).hexdigest()
+
+
+async def verify_user(form_data, db: AsyncSession):
+    user = await auth.authorize_user(form_data.username, form_data.password, db)
     if not user:
         raise HTTPException(status_code=404, detail="password is wrong")
     
-    # Revoke all existing refresh tokens for the user
-    existing_tokens = db.query(RefreshToken).filter_by(user_id=user.id).all()
-    for token in existing_tokens:
-        token.revoked = True
-    db.commit()
+    # Revoke all existing refresh tokens for the user in one statement
+    await db.execute(
+        update(RefreshToken)
+        .where(RefreshToken.user_id == user.id, RefreshToken.revoked == False)
+        .values(revoked=True)
+    )
 
     access_token = auth.create_access_token(user.username, user.id)
     refresh_token = auth.create_refresh_token(user.id)
 
-    # Store refresh token in the database
-    new_refresh_token = RefreshToken(user_id=user.id, token=refresh_token, expires=datetime.utcnow() + timedelta(minutes=REFERESH_TOKEN_EXPIRE_MINUTES))
+    # Store refresh token in the database, in the same transaction as the revocation
+    new_refresh_token = RefreshToken(user_id=user.id, token_digest=digest_refresh_token(refresh_token), expires=datetime.utcnow() + timedelta(minutes=REFERESH_TOKEN_EXPIRE_MINUTES))
     db.add(new_refresh_token)
-    db.commit()
+    await db.commit()
 
     token_resp = { "token_type": "Bearer", "access_token": access_token, "refresh_token": refresh_token}
     return token_resp
 
 
-def create_new_access_token(refresh_token: str, db: Session):
+async def create_new_access_token(refresh_token: str, db: AsyncSession):
     # verify the refresh token
     try:
         payload = jwt.decode(refresh_token, SECRET_KEY, algorithms=[ALGORITHM])
         if payload.get("type") != "refresh":
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid token type")
 
-        stored_token = db.query(RefreshToken).filter(RefreshToken.token == refresh_token, RefreshToken.revoked == False).first()
+        stored_token = await db.scalar(select(RefreshToken.id).where(RefreshToken.token_digest == digest_refresh_token(refresh_token), RefreshToken.revoked == False))
         if not stored_token:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Token not found")
 
         # generate a new access token
         user_id = payload.get("user_id")
-        user = db.query(User).filter(User.id == user_id).first()
+        user = principal_cache.get(user_id) or await crud.get_user(db, user_id=user_id)
+        if user is None:
+            raise _credentials_exception()
         new_access_token = create_access_token(user.username, user.id)
         token_resp = { "token_type": "Bearer", "access_token": new_access_token, "refresh_token": refresh_token}
         return token_resp
@@ -104,14 +206,24 @@ def create_new_access_token(refresh_token: str, db: Session):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Could not validate refresh token")
     
 
-def logout(refresh_token: str, db: Session):
-    # Query for the refresh token in the database
-    stored_token = db.query(RefreshToken).filter(RefreshToken.token == refresh_token).first()
-
+async def logout(refresh_token: str, db: AsyncSession):
     # If token is found and not already revoked, set it as revoked
-    if stored_token and not stored_token.revoked:
-        stored_token.revoked = True
-        db.commit()
+    revoked_id = await db.scalar(
+        update(RefreshToken)
+        .where(RefreshToken.token_digest == digest_refresh_token(refresh_token), RefreshToken.revoked == False)
+        .values(revoked=True)
+        .returning(RefreshToken.id)
+    )
+    if revoked_id:
+        await db.commit()
         return {"detail": "Refresh token has been revoked"}
     else:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Token not found or already revoked")
+
+
+@background.periodic(REFRESH_TOKEN_PRUNE_INTERVAL_SECONDS)
+async def prune_refresh_tokens(batch_size: int = 5000):
+    """Delete expired and revoked refresh tokens in small batches so the table stays small."""
+    async with database.AsyncSessionLocal() as db:
+        while await crud.delete_stale_refresh_tokens(db, now=datetime.utcnow(), limit=batch_size) == batch_size:
+            pass
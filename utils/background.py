@@ -0,0 +1,36 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+_jobs = []
+_tasks = []
+
+
+def periodic(interval: float):
+    """Register a coroutine function to run every `interval` seconds while the app is up."""
+    def decorator(fn):
+        _jobs.append((fn, interval))
+        return fn
+    return decorator
+
+
+async def _run_every(fn, interval: float):
+    while True:
+        try:
+            await fn()
+        except Exception:
+            logger.exception("Background job %s failed", fn.__name__)
+        await asyncio.sleep(interval)
+
+
+def start():
+    for fn, interval in _jobs:
+        _tasks.append(asyncio.create_task(_run_every(fn, interval), name=fn.__name__))
+
+
+async def stop():
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
@@ -0,0 +1,59 @@
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+
+from fastapi import Request, Response
+
+# Responses depend on the caller's credentials, so only the client may keep them, and must revalidate first
+CACHE_CONTROL = "private, no-cache"
+
+
+def version_tag(*parts) -> str:
+    """A weak entity tag over whatever determines a representation: ids, row versions, cursors."""
+    digest = hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest()
+    return f'W/"{digest}"'
+
+
+def http_date(value: datetime) -> str:
+    return format_datetime(value.astimezone(timezone.utc), usegmt=True)
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """Weak comparison, as If-None-Match calls for: W/ prefixes are ignored."""
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+
+def is_not_modified(request_headers, etag: str, last_modified: Optional[datetime] = None) -> bool:
+    """Whether the client's copy is current. If-None-Match wins over If-Modified-Since when both are sent."""
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+    if_modified_since = request_headers.get("if-modified-since")
+    if not if_modified_since or last_modified is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    # HTTP dates carry whole seconds
+    return last_modified.replace(microsecond=0) <= since
+
+
+def evaluate(request: Request, response: Response, etag: str, last_modified: Optional[datetime] = None) -> Optional[Response]:
+    """Put the validators on the response, and return a 304 to send instead when the client's copy is current.
+
+    Returning the 304 from the endpoint skips serializing the body altogether.
+    """
+    headers = {"etag": etag, "cache-control": CACHE_CONTROL}
+    if last_modified is not None:
+        headers["last-modified"] = http_date(last_modified)
+    if is_not_modified(request.headers, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
@@ -0,0 +1,39 @@
+import csv
+import io
+from datetime import datetime
+from typing import AsyncIterator, Sequence
+
+import orjson
+
+# Response media type for each export format
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def ndjson_chunk(rows) -> bytes:
+    """One JSON object per line; orjson writes datetimes as RFC 3339."""
+    return b"".join(orjson.dumps(dict(row), option=orjson.OPT_APPEND_NEWLINE) for row in rows)
+
+
+def _csv_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def csv_chunk(rows, header: Sequence[str] = None) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(header)
+    writer.writerows([_csv_value(value) for value in row.values()] for row in rows)
+    return buffer.getvalue().encode()
+
+
+async def encode(batches: AsyncIterator, fmt: str, columns: Sequence[str]) -> AsyncIterator[bytes]:
+    """Serialize batches of row mappings as they arrive, one response chunk per batch."""
+    if fmt == "csv":
+        # The header goes out even when there are no rows
+        yield csv_chunk([], header=columns)
+    async for rows in batches:
+        yield csv_chunk(rows) if fmt == "csv" else ndjson_chunk(rows)
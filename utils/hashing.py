@@ -0,0 +1,105 @@
+import asyncio
+import math
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+from core.config import HASH_POOL_WORKERS, HASH_QUEUE_LIMIT, BCRYPT_ROUNDS
+from utils import metrics
+
+# bcrypt cost used for new hashes; hashes with a lower cost are rehashed on login. It comes from config so
+# every worker process agrees on it: were they to differ, a login could rehash back and forth between them
+bcrypt_rounds = BCRYPT_ROUNDS
+
+_pool = None
+_pending = 0
+
+
+# Worker side: these run inside the pool processes
+
+@lru_cache(maxsize=None)
+def _context(rounds: int) -> CryptContext:
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__default_rounds=rounds,
+        bcrypt__min_rounds=rounds,
+    )
+
+def _hash(secret: str, rounds: int) -> str:
+    return _context(rounds).hash(secret)
+
+def _verify_and_update(secret: str, hashed: str, rounds: int):
+    return _context(rounds).verify_and_update(secret, hashed)
+
+def _timed(fn, submitted_at: float, *args):
+    # Wall clock, since the submitting side lives in another process
+    return time.time() - submitted_at, fn(*args)
+
+def _time_hash(rounds: int) -> float:
+    start = time.perf_counter()
+    _context(rounds).hash("calibration")
+    return time.perf_counter() - start
+
+
+# Event loop side
+
+def start():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=HASH_POOL_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+metrics.Gauge("hash_queue_pending", "bcrypt jobs queued or running in the hashing pool", callback=lambda: _pending)
+
+async def _submit(fn, *args):
+    """Run fn in the hashing pool, rejecting with 503 once the queue is full."""
+    global _pending
+    if _pending >= HASH_QUEUE_LIMIT:
+        metrics.hash_rejected.inc()
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, please retry shortly",
+            headers={"Retry-After": "1"},
+        )
+    start()
+    _pending += 1
+    try:
+        waited, result = await asyncio.get_running_loop().run_in_executor(_pool, _timed, fn, time.time(), *args)
+        metrics.hash_queue_seconds.observe(waited)
+        return result
+    finally:
+        _pending -= 1
+
+async def hash_secret(secret: str) -> str:
+    return await _submit(_hash, secret, bcrypt_rounds)
+
+async def verify_and_update(secret: str, hashed: str):
+    """Return (valid, new_hash); new_hash is set when the stored hash uses an outdated cost."""
+    return await _submit(_verify_and_update, secret, hashed, bcrypt_rounds)
+
+def calibrate(target_ms: float, min_rounds: int = 10, max_rounds: int = 16) -> int:
+    """Pick the highest bcrypt cost whose hash time stays within target_ms on this machine."""
+    elapsed = min(_time_hash(min_rounds) for _ in range(3))
+    # Every extra round doubles the work
+    extra = math.floor(math.log2(target_ms / (elapsed * 1000))) if elapsed > 0 else 0
+    return max(min_rounds, min(max_rounds, min_rounds + extra))
+
+
+if __name__ == "__main__":
+    # Run once on the production hardware and set BCRYPT_ROUNDS to the result:
+    #     python -m utils.hashing --target-ms 250
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Print the bcrypt cost whose hash time fits a target")
+    parser.add_argument("--target-ms", type=float, default=250)
+    print(calibrate(parser.parse_args().target_ms))
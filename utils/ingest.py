@@ -0,0 +1,141 @@
+import asyncio
+import json
+import logging
+from typing import Dict, List, Tuple
+
+from fastapi import HTTPException, status
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.config import BATCH_MAX_ITEMS
+from db import crud, schemas
+from utils import auth, media, uploads
+from utils.access import AccessResolver
+from utils.media import MediaWriter
+
+logger = logging.getLogger(__name__)
+
+
+def parse_items(raw_items: str) -> List[dict]:
+    try:
+        records = json.loads(raw_items)
+    except (TypeError, ValueError):
+        records = None
+    if not isinstance(records, list):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="'items' must be a JSON array")
+    if len(records) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"A batch holds at most {BATCH_MAX_ITEMS} items")
+    return records
+
+
+async def ingest(
+    db: AsyncSession,
+    access: AccessResolver,
+    records: List[dict],
+    writers: Dict[str, Tuple[str, MediaWriter]],
+    rejected_files: Dict[str, str],
+) -> dict:
+    """Validate, authorize and store a batch of content records, reporting an outcome for each one.
+
+    Records that fail are skipped without affecting the rest. Media for the accepted ones is hashed and
+    stored as blobs concurrently outside any transaction, then the blob references and every row go in with
+    one short transaction.
+    """
+    user = access.user
+    errors = {}
+    items = {}
+    for index, record in enumerate(records):
+        try:
+            items[index] = schemas.BatchContentItem.model_validate(record)
+        except ValidationError as e:
+            errors[index] = e.errors(include_url=False, include_context=False)
+
+    # Every workspace in the batch is checked with one query
+    roles = await access.workspace_roles({item.workspace_id for item in items.values()})
+    upload_ids = {item.upload_id for item in items.values() if item.upload_id is not None}
+    sessions = await crud.get_upload_sessions(db, upload_ids, user.id, for_update=True) if upload_ids else {}
+    chunks = await crud.get_upload_chunks_by_session(db, list(sessions)) if sessions else {}
+
+    claimed = set()
+    for index, item in list(items.items()):
+        source = item.file if item.file is not None else item.upload_id
+        try:
+            auth.check_workspace_scope(user, item.workspace_id)
+            if roles[item.workspace_id] is None:
+                error = "Access forbidden: You are not a member or owner of this workspace"
+            elif source in claimed:
+                error = f"'{source}' is used by more than one item"
+            elif item.file is not None:
+                error = rejected_files.get(item.file) or (None if item.file in writers else f"No file part named '{item.file}'")
+            elif item.upload_id not in sessions:
+                error = "Upload not found"
+            elif user.api_workspace_id is not None and sessions[item.upload_id].workspace_id != user.api_workspace_id:
+                error = "Access forbidden: API key is not valid for this upload's workspace"
+            elif uploads.merge_ranges(chunks.get(item.upload_id, []), sessions[item.upload_id].size)[1]:
+                error = "Upload is incomplete"
+            else:
+                error = None
+        except HTTPException as e:
+            error = e.detail
+        if error is not None:
+            errors[index] = error
+            del items[index]
+        else:
+            claimed.add(source)
+
+    # Let go of the sessions' locks and the connection while files are hashed and stored
+    await db.commit()
+    loop = asyncio.get_running_loop()
+
+    # Private copies of the resumable uploads, removed once the batch is done with them
+    copies = []
+
+    async def prepare(item):
+        """The item's file as (source path, digest, size, filename) for media.upload_blobs."""
+        if item.file is not None:
+            filename, writer = writers[item.file]
+            return writer.temp_path, await writer.finish(), writer.size, filename
+        upload = sessions[item.upload_id]
+        copy_path, digest = await loop.run_in_executor(None, uploads.copy_staged_file, upload.id)
+        copies.append(copy_path)
+        return copy_path, digest, upload.size, upload.filename
+
+    try:
+        prepared = await asyncio.gather(*(prepare(item) for item in items.values()), return_exceptions=True)
+        sources = {}
+        for (index, item), source in zip(list(items.items()), prepared):
+            if isinstance(source, BaseException):
+                logger.error("Could not store batch item %s", index, exc_info=source)
+                errors[index] = "Could not store the file"
+                del items[index]
+            else:
+                sources[index] = source
+
+        placed = await media.upload_blobs(db, list(sources.values())) if sources else {}
+
+        # Lock the sessions again; one that is gone was published by a concurrent request meanwhile
+        locked = await crud.get_upload_sessions(db, upload_ids, user.id, for_update=True) if upload_ids else {}
+        for index, item in list(items.items()):
+            if item.upload_id is not None and item.upload_id not in locked:
+                errors[index] = "Upload not found"
+                del items[index]
+                del sources[index]
+
+        # Sources stay on disk until the rows commit, so a failed batch can simply be retried
+        paths = await media.reference_blobs(db, list(sources.values()), placed) if sources else []
+        contents = [
+            schemas.CreateContent(name=item.name, title=item.title, workspace_id=item.workspace_id, path=path, media_digest=sources[index][1])
+            for (index, item), path in zip(items.items(), paths)
+        ]
+        upload_ids = [item.upload_id for item in items.values() if item.upload_id]
+        created = await crud.create_contents(db, contents, user.id, upload_ids=upload_ids)
+        for upload_id in upload_ids:
+            await loop.run_in_executor(None, uploads.remove_staging_file, upload_id)
+
+        results = [{"index": index, "error": error} for index, error in errors.items()]
+        results += [{"index": index, "content": content} for index, content in zip(items, created)]
+        results.sort(key=lambda result: result["index"])
+        return {"created": len(created), "items": results}
+    finally:
+        for copy_path in copies:
+            await loop.run_in_executor(None, uploads.remove_file, copy_path)
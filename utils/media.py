@@ -0,0 +1,169 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+
+from fastapi import HTTPException
+
+from core.config import MEDIA_PATH, UPLOAD_BUFFER_SIZE, UPLOAD_STAGING_PATH
+from db import crud
+from utils import metrics, storage
+
+SUPPORTED_EXTENSIONS = ["mp4", "mov", "avi", "wmv", "flv", "webm", "mpeg4", "3gpp", "mpegps", "cineform", "hevc", "dnxhr", "prores"]
+
+
+def check_file_extension(filename: str):
+    """Reject files whose extension is not a supported video format."""
+    file_extension = filename.split(".")[-1].lower()
+    if file_extension not in SUPPORTED_EXTENSIONS:
+        raise HTTPException(status_code=400, detail="Unsupported file format")
+
+
+def blob_path(digest: str, filename: str) -> str:
+    """Where the blob with the given SHA-256 lives: fanned out over two levels of hash-prefix directories
+    so none grows large. The extension of the first upload is kept so the media type can be guessed."""
+    extension = os.path.splitext(filename)[1].lower()
+    return os.path.join(MEDIA_PATH, digest[:2], digest[2:4], digest + extension)
+
+
+async def place_blob(source: str, path: str):
+    """Store the file at `source` as the blob at `path` unless it is already there, leaving `source` in place."""
+    if await storage.backend.stat(path) is None:
+        await storage.backend.put(path, source)
+
+
+async def upload_blobs(db, sources) -> dict:
+    """Put (source path, digest, size, filename) files at their content-addressed keys, before any row refers to them.
+
+    A digest that already has a blob keeps its path and is only stored again if its media went missing.
+    This ends the caller's transaction first, so the transfer holds no pooled connection and no row lock.
+    Returns {digest: (path, known)} for reference_blobs.
+    """
+    first_source = {}
+    for source, digest, size, filename in sources:
+        first_source.setdefault(digest, (source, blob_path(digest, filename)))
+    known = await crud.get_media_blob_paths(db, list(first_source))
+    await db.commit()
+
+    placed = {digest: (known.get(digest, path), digest in known) for digest, (_, path) in first_source.items()}
+    await asyncio.gather(*(place_blob(first_source[digest][0], path) for digest, (path, _) in placed.items()))
+    return placed
+
+
+async def reference_blobs(db, sources, placed: dict) -> list:
+    """Take the references to blobs stored by upload_blobs in the caller's transaction, returning each source's blob path.
+
+    Identical files share one blob. Should the transaction never commit, the uploaded files are left
+    unreferenced and reconciliation removes them; the sources stay on disk until it commits.
+    """
+    wanted = {}
+    for source, digest, size, filename in sources:
+        path, _, count = wanted.get(digest, (placed[digest][0], size, 0))
+        wanted[digest] = (path, size, count + 1)
+    blobs = await crud.reference_media_blobs(db, wanted)
+
+    # A blob that existed before the upload but is new now was collected in between, file and all
+    first_source = {}
+    for source, digest, _, _ in sources:
+        first_source.setdefault(digest, source)
+    collected = [(first_source[digest], path) for digest, (path, created) in blobs.items() if created and placed[digest][1]]
+    await asyncio.gather(*(storage.backend.put(path, source) for source, path in collected))
+    return [blobs[digest][0] for _, digest, _, _ in sources]
+
+
+class BufferedWriter:
+    """Write a stream of data into a file descriptor starting at `offset`.
+
+    Incoming data is coalesced into `buffer_size` blocks. Each full block is written from a worker
+    thread while the next one fills, so network and disk I/O overlap with at most two blocks in memory.
+    """
+
+    def __init__(self, fd: int, offset: int = 0, buffer_size: int = UPLOAD_BUFFER_SIZE):
+        self._fd = fd
+        self._offset = offset
+        self._buffer = bytearray()
+        self._pending = None
+        self.buffer_size = buffer_size
+        self.size = 0
+        self.closed = False
+
+    def _write_all(self, block, offset):
+        view = memoryview(block)
+        while view:
+            written = os.pwrite(self._fd, view, offset)
+            view = view[written:]
+            offset += written
+
+    def _finish(self):
+        os.close(self._fd)
+
+    async def _flush(self):
+        if self._pending is not None:
+            await self._pending
+            self._pending = None
+        if self._buffer:
+            block, self._buffer = self._buffer, bytearray()
+            self._pending = asyncio.get_running_loop().run_in_executor(None, self._write_all, block, self._offset)
+            self._offset += len(block)
+
+    async def write(self, data):
+        self._buffer += data
+        self.size += len(data)
+        metrics.upload_bytes.inc(len(data))
+        if len(self._buffer) >= self.buffer_size:
+            await self._flush()
+
+    async def close(self):
+        """Write out everything buffered and release the file."""
+        if self.closed:
+            return
+        await self._flush()  # start writing whatever is still buffered
+        await self._flush()  # and wait for that write to land
+        await asyncio.get_running_loop().run_in_executor(None, self._finish)
+        self.closed = True
+
+    async def abort(self):
+        """Stop writing, dropping anything still buffered."""
+        if self._pending is not None:
+            try:
+                await self._pending
+            except OSError:
+                pass
+            self._pending = None
+        if not self.closed:
+            os.close(self._fd)
+            self.closed = True
+
+
+class MediaWriter(BufferedWriter):
+    """Write an upload to a temp file in upload staging, hashing it on the way for upload_blobs."""
+
+    def __init__(self, directory: str = UPLOAD_STAGING_PATH, buffer_size: int = UPLOAD_BUFFER_SIZE):
+        os.makedirs(directory, exist_ok=True)
+        fd, self.temp_path = tempfile.mkstemp(dir=directory, suffix=".part")
+        self._sha256 = hashlib.sha256()
+        super().__init__(fd, buffer_size=buffer_size)
+
+    def _write_all(self, block, offset):
+        # Blocks arrive one at a time and in order, in a worker thread
+        self._sha256.update(block)
+        super()._write_all(block, offset)
+
+    def _finish(self):
+        # mkstemp creates the file owner-only; published media is world-readable like before
+        os.fchmod(self._fd, 0o644)
+        os.fsync(self._fd)
+        super()._finish()
+
+    async def finish(self) -> str:
+        """Write out the rest of the file and return its SHA-256."""
+        await self.close()
+        return self._sha256.hexdigest()
+
+    async def discard(self):
+        """Drop the partial file, e.g. when the upload fails or is rejected."""
+        await self.abort()
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, os.remove, self.temp_path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import text
+
+from core.config import (
+    MEDIA_GC_INTERVAL_SECONDS, MEDIA_GC_GRACE_SECONDS, MEDIA_RECONCILE_INTERVAL_SECONDS, MEDIA_ORPHAN_MIN_AGE_SECONDS,
+    MEDIA_IO_OPS_PER_SECOND,
+)
+from db import crud
+from db.database import AsyncSessionLocal, async_engine
+from utils import background, metrics, storage
+
+logger = logging.getLogger(__name__)
+
+# Postgres advisory lock held while reconciling, so only one app process walks the media storage
+RECONCILE_LOCK_ID = 0x6D65646961
+
+
+class Throttle:
+    """Space storage operations out to at most `rate` per second, so cleanup never saturates the disk or the object store."""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0
+        self._next = time.monotonic()
+
+    async def wait(self, ops: int = 1):
+        now = time.monotonic()
+        if self._next > now:
+            await asyncio.sleep(self._next - now)
+        self._next = max(now, self._next) + ops * self.interval
+
+
+@background.periodic(MEDIA_GC_INTERVAL_SECONDS)
+async def collect_deleted_media(batch_size: int = 100):
+    """Purge deleted contents a batch at a time, then remove the media blobs no content uses any more.
+
+    A file goes before its row: if the row delete then fails, the next run finds the row again and carries on.
+    """
+    throttle = Throttle(MEDIA_IO_OPS_PER_SECOND)
+    async with AsyncSessionLocal() as db:
+        while True:
+            before = datetime.now(timezone.utc) - timedelta(seconds=MEDIA_GC_GRACE_SECONDS)
+            rows = await crud.claim_deleted_contents(db, before, limit=batch_size)
+            if not rows:
+                break
+            released = {}
+            for _, path, digest, still_used in rows:
+                if digest is not None:
+                    # Blob-backed media goes once its reference count drops to zero, below
+                    released[digest] = released.get(digest, 0) + 1
+                elif not still_used:
+                    await throttle.wait()
+                    if await storage.backend.delete(path):
+                        metrics.media_files_removed.inc(labels=("deleted",))
+            await crud.purge_contents(db, [content_id for content_id, _, _, _ in rows], released)
+            if len(rows) < batch_size:
+                break
+
+        # The blob rows stay locked while their files go, so an upload of the same bytes waits for the
+        # row to be gone and then stores the file afresh
+        while blobs := await crud.claim_unreferenced_blobs(db, limit=batch_size):
+            for _, path in blobs:
+                await throttle.wait()
+                if await storage.backend.delete(path):
+                    metrics.media_files_removed.inc(labels=("deleted",))
+            await crud.delete_media_blobs(db, [digest for digest, _ in blobs])
+            if len(blobs) < batch_size:
+                break
+
+
+# Reconciliation
+
+async def remove_orphan_files(throttle: Throttle, batch_size: int) -> int:
+    """Remove stored media that no content or blob points at, such as blobs whose row was never
+    committed and temp files of interrupted writes."""
+    removed = 0
+    cutoff = time.time() - MEDIA_ORPHAN_MIN_AGE_SECONDS
+    async for batch in storage.backend.list(batch_size):
+        await throttle.wait(len(batch))
+        async with AsyncSessionLocal() as db:
+            referenced = await crud.get_referenced_paths(db, [path for path, _ in batch])
+        for path, mtime in batch:
+            if path in referenced or mtime > cutoff:
+                continue
+            await throttle.wait()
+            if await storage.backend.delete(path):
+                logger.info("Removed orphaned media file %s", path)
+                metrics.media_files_removed.inc(labels=("orphan",))
+                removed += 1
+    return removed
+
+
+async def find_missing_files(throttle: Throttle, batch_size: int) -> int:
+    """Count contents whose media file is gone. They are reported, not changed, since a missing mount
+    would otherwise look like every file being lost."""
+    missing_count = 0
+    after_id = 0
+    while True:
+        async with AsyncSessionLocal() as db:
+            rows = await crud.get_content_paths_after(db, after_id, limit=batch_size)
+        if not rows:
+            break
+        await throttle.wait(len(rows))
+        stats = await asyncio.gather(*(storage.backend.stat(path) for _, path in rows))
+        missing = [content_id for (content_id, _), stat in zip(rows, stats) if stat is None]
+        if missing:
+            logger.warning("Media missing for contents %s", ", ".join(str(content_id) for content_id in missing[:20]))
+        missing_count += len(missing)
+        after_id = rows[-1][0]
+    return missing_count
+
+
+@background.periodic(MEDIA_RECONCILE_INTERVAL_SECONDS)
+async def reconcile_media(batch_size: int = 500):
+    """Compare media storage with the content table in both directions, at a throttled pace."""
+    async with async_engine.connect() as conn:
+        locked = await conn.scalar(text("SELECT pg_try_advisory_lock(:id)"), {"id": RECONCILE_LOCK_ID})
+        # The lock belongs to the session, so the transaction can end without keeping the connection idle in it
+        await conn.commit()
+        if not locked:
+            return
+        try:
+            throttle = Throttle(MEDIA_IO_OPS_PER_SECOND)
+            removed = await remove_orphan_files(throttle, batch_size)
+            missing = await find_missing_files(throttle, batch_size)
+            metrics.media_missing_files.set(missing)
+            logger.info("Media reconciliation removed %d orphaned files; %d contents are missing their media", removed, missing)
+        finally:
+            await conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": RECONCILE_LOCK_ID})
+            await conn.commit()
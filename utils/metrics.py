@@ -0,0 +1,168 @@
+import bisect
+import time
+from typing import Callable, Dict, Sequence, Tuple
+
+# Latency buckets in seconds, shared by every histogram unless one asks for its own
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames: Sequence[str], labels: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        _registry.append(self)
+
+    def _samples(self):
+        return []
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, extra, value in self._samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, labels, extra)} {value}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple, float] = {} if labelnames else {(): 0}
+
+    def inc(self, amount: float = 1, labels: Tuple = ()):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def _samples(self):
+        return [("", labels, "", value) for labels, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    """A value that goes up and down; `callback` reads it at scrape time instead."""
+    kind = "gauge"
+
+    def __init__(self, name, help, labelnames=(), callback: Callable[[], float] = None):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple, float] = {} if labelnames else {(): 0}
+        self.callback = callback
+
+    def inc(self, amount: float = 1, labels: Tuple = ()):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, amount: float = 1, labels: Tuple = ()):
+        self.inc(-amount, labels)
+
+    def set(self, value: float, labels: Tuple = ()):
+        self._values[labels] = value
+
+    def _samples(self):
+        if self.callback is not None:
+            return [("", (), "", self.callback())]
+        return [("", labels, "", value) for labels, value in self._values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (last one is +Inf), sum]
+        self._series: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, labels: Tuple = ()):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def _samples(self):
+        samples = []
+        for labels, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                samples.append(("_bucket", labels, f'le="{bound}"', cumulative))
+            samples.append(("_sum", labels, "", total))
+            samples.append(("_count", labels, "", cumulative))
+        return samples
+
+
+def render() -> str:
+    """Every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Metrics recorded across the app
+
+request_seconds = Histogram("http_request_duration_seconds", "Time to serve a request, by route template", ("method", "route", "status"))
+requests_in_flight = Gauge("http_requests_in_flight", "Requests currently being served")
+upload_bytes = Counter("upload_received_bytes_total", "Upload bytes received; rate() of this is upload throughput in bytes/sec")
+hash_queue_seconds = Histogram("hash_queue_wait_seconds", "Time a bcrypt job waited for a free hashing worker")
+hash_rejected = Counter("hash_rejected_total", "bcrypt jobs turned away because the hashing queue was full")
+db_pool_checkout_seconds = Histogram("db_pool_checkout_wait_seconds", "Time spent getting a connection from the pool, including opening a new one")
+payment_request_seconds = Histogram("payment_provider_request_seconds", "Time for one request to the payment provider, by response status", ("status",))
+payment_retries = Counter("payment_provider_retries_total", "Requests to the payment provider that were retried")
+media_files_removed = Counter("media_files_removed_total", "Media files removed in the background, by reason (deleted, orphan)", ("reason",))
+media_missing_files = Gauge("media_missing_files", "Contents whose media file was missing at the last reconciliation")
+payment_events = Counter("payment_webhook_events_total", "Payment webhook events, by outcome (received, duplicate, processed, retried, failed)", ("outcome",))
+payment_charges = Counter("payment_charges_total", "Charges the payment provider reported through webhooks, by outcome (succeeded, failed)", ("outcome",))
+storage_request_seconds = Histogram("storage_request_seconds", "Time for one request to the object store, by method and response status", ("method", "status"))
+storage_retries = Counter("storage_retries_total", "Requests to the object store that were retried")
+
+
+class MetricsMiddleware:
+    """Time every HTTP request and label it with its route template, so /content/1 and /content/2 share a series."""
+
+    def __init__(self, app):
+        self.app = app
+        self._route_paths = {}
+
+    def _route(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if endpoint not in self._route_paths:
+            for route in scope["app"].routes:
+                self._route_paths.setdefault(getattr(route, "endpoint", None), getattr(route, "path", "unmatched"))
+        return self._route_paths.get(endpoint, "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        requests_in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            requests_in_flight.dec()
+            request_seconds.observe(time.perf_counter() - start, (scope["method"], self._route(scope), status_code))
@@ -0,0 +1,53 @@
+import base64
+import json
+from datetime import datetime
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, status
+
+# A keyset position: (created_datetime, id) of the last row on the previous page
+Keyset = Tuple[datetime, int]
+
+
+def encode_cursor(keyset: Optional[Keyset]) -> Optional[str]:
+    """Turn a keyset position into an opaque cursor string."""
+    if keyset is None:
+        return None
+    created_datetime, row_id = keyset
+    raw = json.dumps([created_datetime.isoformat(), row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Keyset]:
+    """Turn an opaque cursor string back into a keyset position."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_datetime, row_id = json.loads(raw)
+        return datetime.fromisoformat(created_datetime), int(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+# A ranked search position: (rank, id) of the last row on the previous page
+RankKeyset = Tuple[float, int]
+
+
+def encode_rank_cursor(keyset: Optional[RankKeyset]) -> Optional[str]:
+    """Turn a search keyset into an opaque cursor string; the rank survives JSON exactly."""
+    if keyset is None:
+        return None
+    raw = json.dumps(list(keyset)).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_rank_cursor(cursor: Optional[str]) -> Optional[RankKeyset]:
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        rank, row_id = json.loads(raw)
+        return float(rank), int(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
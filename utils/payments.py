@@ -0,0 +1,91 @@
+import asyncio
+import logging
+import random
+import time
+
+import httpx
+
+from core.config import STRIPE_API_BASE, STRIPE_SECRET_KEY, STRIPE_TIMEOUT_SECONDS, STRIPE_MAX_RETRIES, STRIPE_MAX_CONNECTIONS
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# One pooled client for the app's lifetime, so charges reuse keep-alive TLS connections
+_client = None
+
+
+class PaymentError(Exception):
+    """A charge that did not go through; `status_code` is what the API answers with."""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def start():
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            base_url=STRIPE_API_BASE,
+            headers={"Authorization": f"Bearer {STRIPE_SECRET_KEY}"} if STRIPE_SECRET_KEY else None,
+            timeout=httpx.Timeout(STRIPE_TIMEOUT_SECONDS),
+            limits=httpx.Limits(max_connections=STRIPE_MAX_CONNECTIONS, max_keepalive_connections=STRIPE_MAX_CONNECTIONS),
+        )
+
+async def close():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _should_retry(response: httpx.Response) -> bool:
+    # Stripe says outright whether a retry can help; otherwise retry conflicts, rate limits and server errors
+    should_retry = response.headers.get("stripe-should-retry")
+    if should_retry is not None:
+        return should_retry == "true"
+    return response.status_code in (409, 429) or response.status_code >= 500
+
+def _backoff(attempt: int) -> float:
+    """Exponential backoff with jitter, so a burst of failed charges does not retry in lockstep."""
+    return min(0.5 * 2 ** (attempt - 1), 4.0) * random.uniform(0.5, 1.0)
+
+def _error_message(response: httpx.Response) -> str:
+    try:
+        return response.json()["error"]["message"]
+    except (ValueError, KeyError, TypeError):
+        return f"Payment provider answered {response.status_code}"
+
+
+async def _post(path: str, data: dict, idempotency_key: str) -> dict:
+    """POST to the provider, retrying transient failures. Every attempt carries the same idempotency key,
+    so a retry of a request that did reach the provider cannot charge twice."""
+    headers = {"Idempotency-Key": idempotency_key}
+    for attempt in range(STRIPE_MAX_RETRIES + 1):
+        if attempt:
+            metrics.payment_retries.inc()
+            await asyncio.sleep(_backoff(attempt))
+        start = time.perf_counter()
+        try:
+            response = await _client.post(path, data=data, headers=headers)
+        except httpx.TransportError as e:
+            metrics.payment_request_seconds.observe(time.perf_counter() - start, ("error",))
+            logger.warning("Payment provider request failed (attempt %d): %r", attempt + 1, e)
+            continue
+        metrics.payment_request_seconds.observe(time.perf_counter() - start, (str(response.status_code),))
+        if response.is_success:
+            return response.json()
+        if not _should_retry(response):
+            raise PaymentError(_error_message(response))
+        logger.warning("Payment provider answered %d (attempt %d)", response.status_code, attempt + 1)
+    raise PaymentError("The payment provider is unavailable, please retry later", status_code=502)
+
+
+async def create_charge(amount: int, currency: str, source: str, description: str, idempotency_key: str) -> dict:
+    """Create a charge without blocking the event loop; `amount` is in the currency's smallest unit."""
+    return await _post("/v1/charges", {
+        "amount": amount,
+        "currency": currency,
+        "source": source,
+        "description": description,
+    }, idempotency_key)
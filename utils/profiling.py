@@ -0,0 +1,112 @@
+import logging
+import random
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import List, Optional, Tuple
+
+from sqlalchemy import event
+
+from core.config import SQL_PROFILE_SAMPLE_RATE, SQL_SLOW_QUERY_MS, SQL_N_PLUS_ONE_THRESHOLD
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "x-sql-profile"
+# How many of a request's slowest statements are logged
+TOP_STATEMENTS = 3
+
+
+class QueryProfile:
+    """Statements run on behalf of one request, with their timings."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.statements: List[Tuple[float, str]] = []
+
+    def record(self, statement: str, elapsed: float):
+        self.count += 1
+        self.total += elapsed
+        self.statements.append((elapsed, statement))
+
+    def repeated(self) -> List[Tuple[str, int]]:
+        """Statements run often enough in one request to look like an N+1 pattern."""
+        counts = Counter(statement for _, statement in self.statements)
+        return [(statement, n) for statement, n in counts.most_common() if n >= SQL_N_PLUS_ONE_THRESHOLD]
+
+    def slowest(self, n: int = TOP_STATEMENTS) -> List[Tuple[float, str]]:
+        return sorted(self.statements, reverse=True)[:n]
+
+    def header(self) -> str:
+        return f"count={self.count};time_ms={self.total * 1000:.2f};repeated={len(self.repeated())}"
+
+
+_current: ContextVar[Optional[QueryProfile]] = ContextVar("sql_profile", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("profile_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["profile_start"].pop()
+    profile = _current.get()
+    if profile is not None:
+        profile.record(statement, elapsed)
+
+
+def _handle_error(exception_context):
+    # A failed statement never reaches after_cursor_execute; drop its start time
+    connection = exception_context.connection
+    if connection is not None and connection.info.get("profile_start"):
+        connection.info["profile_start"].pop()
+
+
+def install(engine):
+    """Time every statement the engine runs, charging it to the request that issued it."""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+def _log(scope, status_code: int, profile: QueryProfile):
+    repeated = profile.repeated()
+    slow = profile.total * 1000 >= SQL_SLOW_QUERY_MS
+    if not (repeated or slow or random.random() < SQL_PROFILE_SAMPLE_RATE):
+        return
+    level = logging.WARNING if repeated or slow else logging.INFO
+    lines = [f"{scope['method']} {scope['path']} -> {status_code}: {profile.count} queries in {profile.total * 1000:.2f}ms"]
+    for elapsed, statement in profile.slowest():
+        lines.append(f"  {elapsed * 1000:.2f}ms {' '.join(statement.split())}")
+    for statement, n in repeated:
+        lines.append(f"  possible N+1, ran {n} times: {' '.join(statement.split())}")
+    logger.log(level, "\n".join(lines))
+
+
+class ProfilingMiddleware:
+    """Attach each request's query count and DB time as a response header, and log the suspicious ones."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile = QueryProfile()
+        token = _current.set(profile)
+        status_code = 500
+
+        async def send_with_profile(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(PROFILE_HEADER.encode(), profile.header().encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile)
+        finally:
+            _current.reset(token)
+            _log(scope, status_code, profile)
@@ -0,0 +1,63 @@
+import hashlib
+import hmac
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+# Payload hash of a request without a body
+EMPTY_SHA256 = hashlib.sha256(b"").hexdigest()
+
+
+def canonical_query(params) -> str:
+    """Query string in SigV4 canonical form, which is also how it is sent: sorted, every part percent-encoded."""
+    pairs = [(quote(str(key), safe="-_.~"), quote(str(value), safe="-_.~")) for key, value in dict(params).items()]
+    return "&".join(f"{key}={value}" for key, value in sorted(pairs))
+
+
+def _hmac(key: bytes, message: str) -> bytes:
+    return hmac.new(key, message.encode(), hashlib.sha256).digest()
+
+
+def signature(secret_key: str, date_stamp: str, region: str, service: str, string_to_sign: str) -> str:
+    key = _hmac(("AWS4" + secret_key).encode(), date_stamp)
+    for part in (region, service, "aws4_request"):
+        key = _hmac(key, part)
+    return hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+
+
+def sign(
+    method: str,
+    path: str,
+    query: str,
+    headers: dict,
+    payload_hash: str,
+    access_key: str,
+    secret_key: str,
+    region: str,
+    service: str = "s3",
+    now: datetime = None,
+) -> dict:
+    """AWS Signature Version 4 for one request: returns the headers to send along with `headers`.
+
+    `path` is the already percent-encoded request path and `query` the canonical_query() string. Every
+    header in `headers` is signed, and must be sent exactly as given; it must include host.
+    """
+    now = now or datetime.now(timezone.utc)
+    amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+    headers = {name.lower(): str(value).strip() for name, value in headers.items()}
+    headers["x-amz-content-sha256"] = payload_hash
+    headers["x-amz-date"] = amz_date
+
+    signed_headers = ";".join(sorted(headers))
+    canonical_headers = "".join(f"{name}:{headers[name]}\n" for name in sorted(headers))
+    canonical_request = "\n".join([method, path, query, canonical_headers, signed_headers, payload_hash])
+    scope = f"{amz_date[:8]}/{region}/{service}/aws4_request"
+    string_to_sign = "\n".join(["AWS4-HMAC-SHA256", amz_date, scope, hashlib.sha256(canonical_request.encode()).hexdigest()])
+
+    return {
+        "x-amz-content-sha256": payload_hash,
+        "x-amz-date": amz_date,
+        "authorization": (
+            f"AWS4-HMAC-SHA256 Credential={access_key}/{scope}, SignedHeaders={signed_headers}, "
+            f"Signature={signature(secret_key, amz_date[:8], region, service, string_to_sign)}"
+        ),
+    }
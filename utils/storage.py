@@ -0,0 +1,340 @@
+import asyncio
+import contextlib
+import hashlib
+import logging
+import os
+import random
+import time
+import uuid
+import xml.etree.ElementTree as ElementTree
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, List, NamedTuple, Optional, Tuple
+from urllib.parse import quote
+from xml.sax.saxutils import escape
+
+import httpx
+
+from core.config import (
+    STORAGE_BACKEND, MEDIA_PATH, UPLOAD_STAGING_PATH, STREAM_CHUNK_SIZE, S3_ENDPOINT_URL, S3_REGION, S3_BUCKET,
+    S3_ACCESS_KEY_ID, S3_SECRET_ACCESS_KEY, S3_TIMEOUT_SECONDS, S3_MAX_CONNECTIONS, S3_MAX_RETRIES, S3_PART_SIZE,
+    S3_UPLOAD_CONCURRENCY,
+)
+from utils import metrics, sigv4
+
+logger = logging.getLogger(__name__)
+
+# S3 accepts at most this many parts per multipart upload
+MAX_PARTS = 10000
+
+
+class ObjectStat(NamedTuple):
+    size: int
+    mtime: float
+    etag: str
+
+
+class StorageError(Exception):
+    """The object store refused or failed a request."""
+
+
+# Both backends take the same calls: put (store a local file under a key), stat, read_range, delete and
+# list. Keys are the paths stored in content.path and media_blobs.path.
+
+class LocalStorage:
+    """Media as files under MEDIA_PATH; a key is the file's path."""
+
+    def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    def local_path(self, key: str) -> Optional[str]:
+        """The file behind a key, for sendfile."""
+        return key
+
+    @staticmethod
+    def _put(key: str, source: str):
+        os.makedirs(os.path.dirname(key), exist_ok=True)
+        # Hard-linked under a temporary name and renamed over the key, so readers only ever see a complete file
+        temp_path = f"{key}.{uuid.uuid4().hex}.link"
+        os.link(source, temp_path)
+        os.replace(temp_path, key)
+        # Fresh mtime, so reconciliation does not take the file for an old orphan before its row commits
+        os.utime(key)
+
+    async def put(self, key: str, source: str):
+        """Store the file at `source` under `key`; `source` itself is left in place."""
+        await asyncio.get_running_loop().run_in_executor(None, self._put, key, source)
+
+    @staticmethod
+    def _stat(key: str) -> Optional[ObjectStat]:
+        try:
+            stat_result = os.stat(key)
+        except FileNotFoundError:
+            return None
+        return ObjectStat(stat_result.st_size, stat_result.st_mtime, f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"')
+
+    async def stat(self, key: str) -> Optional[ObjectStat]:
+        return await asyncio.get_running_loop().run_in_executor(None, self._stat, key)
+
+    async def read_range(self, key: str, start: int, length: int) -> AsyncIterator[bytes]:
+        """The `length` bytes from `start`, read in large blocks from a worker thread."""
+        loop = asyncio.get_running_loop()
+        fd = await loop.run_in_executor(None, os.open, key, os.O_RDONLY)
+        try:
+            while length > 0:
+                block = await loop.run_in_executor(None, os.pread, fd, min(STREAM_CHUNK_SIZE, length), start)
+                if not block:
+                    break
+                start += len(block)
+                length -= len(block)
+                yield block
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def _delete(key: str) -> bool:
+        try:
+            os.remove(key)
+            return True
+        except FileNotFoundError:
+            return False
+
+    async def delete(self, key: str) -> bool:
+        """Remove a key; False if it was already gone."""
+        return await asyncio.get_running_loop().run_in_executor(None, self._delete, key)
+
+    @classmethod
+    def _walk(cls, directory: str):
+        """Every regular file under `directory`, skipping upload staging, which the upload collector owns."""
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if os.path.normpath(entry.path) != os.path.normpath(UPLOAD_STAGING_PATH):
+                        yield from cls._walk(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry
+
+    @staticmethod
+    def _next_batch(entries, size: int) -> List[Tuple[str, float]]:
+        batch = []
+        for entry in entries:
+            batch.append((entry.path, entry.stat(follow_symlinks=False).st_mtime))
+            if len(batch) == size:
+                break
+        return batch
+
+    async def list(self, batch_size: int) -> AsyncIterator[List[Tuple[str, float]]]:
+        """Every stored key with its modification time, `batch_size` at a time."""
+        loop = asyncio.get_running_loop()
+        if not await loop.run_in_executor(None, os.path.isdir, MEDIA_PATH):
+            return
+        entries = self._walk(MEDIA_PATH)
+        with contextlib.closing(entries):
+            while batch := await loop.run_in_executor(None, self._next_batch, entries, batch_size):
+                yield batch
+
+
+def _read_part(path: str, offset: int, length: int) -> Tuple[bytes, str]:
+    """A part of a file with its SHA-256, which signs the request carrying it."""
+    data = bytearray()
+    with open(path, "rb", buffering=0) as f:
+        while len(data) < length:
+            block = os.pread(f.fileno(), length - len(data), offset + len(data))
+            if not block:
+                raise StorageError(f"{path} is shorter than expected")
+            data += block
+    return bytes(data), hashlib.sha256(data).hexdigest()
+
+
+def _backoff(attempt: int) -> float:
+    return min(0.2 * 2 ** (attempt - 1), 2.0) * random.uniform(0.5, 1.0)
+
+
+def _error_message(response: httpx.Response) -> str:
+    try:
+        return ElementTree.fromstring(response.content).findtext("{*}Message") or response.reason_phrase
+    except ElementTree.ParseError:
+        return response.reason_phrase
+
+
+class S3Storage:
+    """Media in a bucket of an S3-compatible object store (AWS S3, MinIO, ...), addressed path-style.
+
+    Requests are signed with SigV4 and sent through one pooled httpx client. Connection errors,
+    throttling and server errors are retried; every request S3 accepts here is safe to repeat.
+    """
+
+    def __init__(self):
+        self._client = None
+        self._endpoint = S3_ENDPOINT_URL.rstrip("/")
+        self._host = httpx.URL(self._endpoint).netloc.decode("ascii")
+
+    def start(self):
+        if not S3_BUCKET or not S3_ACCESS_KEY_ID or not S3_SECRET_ACCESS_KEY:
+            raise RuntimeError("STORAGE_BACKEND=s3 needs S3_BUCKET, S3_ACCESS_KEY_ID and S3_SECRET_ACCESS_KEY")
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(S3_TIMEOUT_SECONDS),
+                limits=httpx.Limits(max_connections=S3_MAX_CONNECTIONS, max_keepalive_connections=S3_MAX_CONNECTIONS),
+            )
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def local_path(self, key: str) -> Optional[str]:
+        return None
+
+    def _build(self, method: str, key: str, params, content: bytes, headers, payload_hash: str) -> httpx.Request:
+        path = quote(f"/{S3_BUCKET}/{key}" if key else f"/{S3_BUCKET}")
+        query = sigv4.canonical_query(params or {})
+        headers = {"host": self._host, **(headers or {})}
+        headers.update(sigv4.sign(method, path, query, headers, payload_hash, S3_ACCESS_KEY_ID, S3_SECRET_ACCESS_KEY, S3_REGION))
+        return self._client.build_request(method, f"{self._endpoint}{path}?{query}" if query else f"{self._endpoint}{path}", headers=headers, content=content)
+
+    async def _request(
+        self, method: str, key: str = "", params=None, content: bytes = b"", headers=None, payload_hash: str = None, stream: bool = False,
+    ) -> httpx.Response:
+        """Send a signed request and return the response, whatever its status, once it is not worth retrying."""
+        payload_hash = payload_hash or (hashlib.sha256(content).hexdigest() if content else sigv4.EMPTY_SHA256)
+        for attempt in range(S3_MAX_RETRIES + 1):
+            if attempt:
+                metrics.storage_retries.inc()
+                await asyncio.sleep(_backoff(attempt))
+            # Signed afresh for every attempt, since a signature is only good for a few minutes
+            request = self._build(method, key, params, content, headers, payload_hash)
+            start = time.perf_counter()
+            try:
+                response = await self._client.send(request, stream=stream)
+            except httpx.TransportError as e:
+                metrics.storage_request_seconds.observe(time.perf_counter() - start, (method, "error"))
+                logger.warning("Object store %s %s failed (attempt %d): %r", method, key, attempt + 1, e)
+                error = repr(e)
+                continue
+            metrics.storage_request_seconds.observe(time.perf_counter() - start, (method, str(response.status_code)))
+            if response.status_code != 429 and response.status_code < 500:
+                return response
+            if stream:
+                await response.aclose()
+            logger.warning("Object store answered %d to %s %s (attempt %d)", response.status_code, method, key, attempt + 1)
+            error = f"answered {response.status_code}"
+        raise StorageError(f"Object store {method} {key} failed: {error}")
+
+    @staticmethod
+    def _check(response: httpx.Response) -> httpx.Response:
+        if not response.is_success:
+            raise StorageError(f"Object store answered {response.status_code}: {_error_message(response)}")
+        return response
+
+    async def put(self, key: str, source: str):
+        """Upload the file at `source` to `key`, as one request or, when it is bigger than a part, as a multipart upload."""
+        loop = asyncio.get_running_loop()
+        size = await loop.run_in_executor(None, os.path.getsize, source)
+        if size <= S3_PART_SIZE:
+            data, payload_hash = await loop.run_in_executor(None, _read_part, source, 0, size)
+            self._check(await self._request("PUT", key, content=data, payload_hash=payload_hash))
+        else:
+            await self._put_multipart(key, source, size)
+
+    async def _put_multipart(self, key: str, source: str, size: int):
+        """Upload parts S3_UPLOAD_CONCURRENCY at a time. A part is read from disk only when a worker picks it up,
+        so at most that many parts are in memory."""
+        loop = asyncio.get_running_loop()
+        part_size = max(S3_PART_SIZE, -(-size // MAX_PARTS))
+        response = self._check(await self._request("POST", key, {"uploads": ""}))
+        upload_id = ElementTree.fromstring(response.content).findtext("{*}UploadId")
+
+        etags = {}
+        part_numbers = iter(range(1, -(-size // part_size) + 1))
+
+        async def worker():
+            for number in part_numbers:
+                offset = (number - 1) * part_size
+                data, payload_hash = await loop.run_in_executor(None, _read_part, source, offset, min(part_size, size - offset))
+                part = self._check(await self._request("PUT", key, {"partNumber": number, "uploadId": upload_id}, content=data, payload_hash=payload_hash))
+                etags[number] = part.headers["etag"]
+
+        workers = [asyncio.create_task(worker()) for _ in range(S3_UPLOAD_CONCURRENCY)]
+        try:
+            await asyncio.gather(*workers)
+            body = "<CompleteMultipartUpload>" + "".join(
+                f"<Part><PartNumber>{number}</PartNumber><ETag>{escape(etags[number])}</ETag></Part>" for number in sorted(etags)
+            ) + "</CompleteMultipartUpload>"
+            response = self._check(await self._request("POST", key, {"uploadId": upload_id}, content=body.encode()))
+            # Completing can still fail after the 200 has been sent, with the error in the body
+            if ElementTree.fromstring(response.content).tag.endswith("Error"):
+                raise StorageError(f"Object store could not complete the upload of {key}: {_error_message(response)}")
+        except BaseException:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            # The parts are kept, and billed, until the upload is aborted
+            try:
+                await self._request("DELETE", key, {"uploadId": upload_id})
+            except Exception:
+                logger.warning("Could not abort the multipart upload of %s", key, exc_info=True)
+            raise
+
+    async def stat(self, key: str) -> Optional[ObjectStat]:
+        response = await self._request("HEAD", key)
+        if response.status_code == 404:
+            return None
+        self._check(response)
+        return ObjectStat(
+            int(response.headers["content-length"]),
+            parsedate_to_datetime(response.headers["last-modified"]).timestamp(),
+            response.headers["etag"],
+        )
+
+    async def read_range(self, key: str, start: int, length: int) -> AsyncIterator[bytes]:
+        """The `length` bytes from `start`, streamed from a ranged GET."""
+        response = await self._request("GET", key, headers={"range": f"bytes={start}-{start + length - 1}"}, stream=True)
+        try:
+            if response.status_code == 404:
+                raise FileNotFoundError(key)
+            if not response.is_success:
+                await response.aread()
+                self._check(response)
+            async for chunk in response.aiter_bytes(STREAM_CHUNK_SIZE):
+                yield chunk
+        finally:
+            await response.aclose()
+
+    async def delete(self, key: str) -> bool:
+        # S3 answers 204 whether or not the key existed
+        self._check(await self._request("DELETE", key))
+        return True
+
+    async def list(self, batch_size: int) -> AsyncIterator[List[Tuple[str, float]]]:
+        """Every key under MEDIA_PATH with its modification time, one ListObjectsV2 page at a time."""
+        params = {"list-type": "2", "prefix": MEDIA_PATH, "max-keys": batch_size}
+        while True:
+            root = ElementTree.fromstring(self._check(await self._request("GET", params=params)).content)
+            batch = [
+                (item.findtext("{*}Key"), datetime.fromisoformat(item.findtext("{*}LastModified").replace("Z", "+00:00")).timestamp())
+                for item in root.iterfind("{*}Contents")
+            ]
+            if batch:
+                yield batch
+            if root.findtext("{*}IsTruncated") != "true":
+                return
+            params["continuation-token"] = root.findtext("{*}NextContinuationToken")
+
+
+if STORAGE_BACKEND == "local":
+    backend = LocalStorage()
+elif STORAGE_BACKEND == "s3":
+    backend = S3Storage()
+else:
+    raise ValueError(f"Unknown STORAGE_BACKEND {STORAGE_BACKEND!r}, expected 'local' or 's3'")
+
+
+def start():
+    backend.start()
+
+async def close():
+    await backend.close()
@@ -0,0 +1,123 @@
+import asyncio
+import contextlib
+import mimetypes
+import os
+import re
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import quote
+
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from core.config import MEDIA_ACCEL_REDIRECT_PREFIX, MEDIA_PATH
+from utils import storage
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def parse_range(header: str, size: int):
+    """Return the (start, end) inclusive byte range asked for, None to send the whole file,
+    or raise ValueError when the range cannot be satisfied. Multi-range requests get the whole file."""
+    match = _RANGE_RE.match(header.strip().replace(" ", ""))
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError("Empty suffix range")
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+
+def accel_redirect(key: str, media_type: str = None) -> Response:
+    """Hand a local file to the front proxy (nginx X-Accel-Redirect), which serves it and its ranges with sendfile."""
+    location = MEDIA_ACCEL_REDIRECT_PREFIX.rstrip("/") + "/" + quote(os.path.relpath(key, MEDIA_PATH))
+    media_type = media_type or mimetypes.guess_type(key)[0] or "application/octet-stream"
+    return Response(headers={"x-accel-redirect": location}, media_type=media_type)
+
+
+class RangeFileResponse(Response):
+    """Serve stored media with HTTP Range/If-Range support.
+
+    When the media is a local file and the server advertises the ASGI `http.response.zerocopysend`
+    extension the open file is handed to it (sendfile in the kernel). uvicorn does not offer it, so
+    there the bytes are streamed from the storage backend, and the event loop never waits on disk or
+    the object store; see accel_redirect for sendfile behind nginx.
+    """
+
+    def __init__(self, key: str, stat: storage.ObjectStat, request_headers, method: str = "GET", media_type: str = None):
+        self.key = key
+        self.send_body = method != "HEAD"
+        size = stat.size
+        etag = stat.etag
+        last_modified = formatdate(stat.mtime, usegmt=True)
+        media_type = media_type or mimetypes.guess_type(key)[0] or "application/octet-stream"
+
+        self.start, self.end = 0, size - 1
+        status_code = 200
+        headers = {"accept-ranges": "bytes", "etag": etag, "last-modified": last_modified}
+
+        range_header = request_headers.get("range")
+        if range_header and size and self._if_range_matches(request_headers.get("if-range"), etag, stat.mtime):
+            try:
+                byte_range = parse_range(range_header, size)
+            except ValueError:
+                byte_range = False
+            if byte_range is False:
+                status_code = 416
+                headers["content-range"] = f"bytes */{size}"
+                self.start, self.end = 0, -1
+            elif byte_range is not None:
+                self.start, self.end = byte_range
+                status_code = 206
+                headers["content-range"] = f"bytes {self.start}-{self.end}/{size}"
+
+        self.length = self.end - self.start + 1
+        headers["content-length"] = str(self.length)
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+
+    @staticmethod
+    def _if_range_matches(if_range, etag: str, mtime: float) -> bool:
+        """A Range only applies if If-Range is absent or still names the current representation."""
+        if not if_range:
+            return True
+        if if_range.startswith('"') or if_range.startswith("W/"):
+            return if_range == etag
+        try:
+            return parsedate_to_datetime(if_range).timestamp() >= int(mtime)
+        except (TypeError, ValueError):
+            return False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if not self.send_body or self.length <= 0:
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        local_path = storage.backend.local_path(self.key)
+        if local_path is not None and "http.response.zerocopysend" in scope.get("extensions", {}):
+            loop = asyncio.get_running_loop()
+            # The extension takes a file object, and reads its fileno()
+            file = await loop.run_in_executor(None, open, local_path, "rb")
+            try:
+                await send({"type": "http.response.zerocopysend", "file": file, "offset": self.start, "count": self.length})
+            finally:
+                await loop.run_in_executor(None, file.close)
+            return
+
+        remaining = self.length
+        async with contextlib.aclosing(storage.backend.read_range(self.key, self.start, self.length)) as blocks:
+            async for block in blocks:
+                remaining -= len(block)
+                await send({"type": "http.response.body", "body": block, "more_body": remaining > 0})
+        if remaining > 0:
+            # The media shrank or went away underneath us; end the body rather than hang the client
+            await send({"type": "http.response.body", "body": b""})
@@ -0,0 +1,247 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, Request, status
+import multipart
+from multipart.exceptions import MultipartParseError
+from multipart.multipart import parse_options_header
+
+from core.config import UPLOAD_BUFFER_SIZE, UPLOAD_MAX_SIZE, UPLOAD_STAGING_PATH, UPLOAD_SESSION_TTL_HOURS, UPLOAD_GC_INTERVAL_SECONDS
+from db import crud
+from db.database import AsyncSessionLocal
+from utils import background, media
+from utils.media import BufferedWriter, MediaWriter
+
+# Form fields are small text values; anything larger is a malformed or abusive request
+MAX_FIELD_SIZE = 64 * 1024
+
+
+def _decode(value: bytes, what: str) -> str:
+    try:
+        return value.decode()
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"{what} is not valid UTF-8")
+
+
+async def stream_multipart(
+    request: Request,
+    open_file: Callable[[str, str], Optional[MediaWriter]],
+    max_field_size: int = MAX_FIELD_SIZE,
+    max_file_size: int = UPLOAD_MAX_SIZE,
+    on_field: Optional[Callable[[str, str], Awaitable[None]]] = None,
+) -> Tuple[Dict[str, str], List[Tuple[str, str, MediaWriter]]]:
+    """Parse a multipart/form-data body straight from the request stream.
+
+    Text fields are returned as a dict. Each file part is written to the MediaWriter returned by
+    `open_file(field_name, filename)` as it arrives, instead of being spooled to a temporary
+    UploadFile first; `open_file` may raise HTTPException to reject a part before any of it is read,
+    or return None to skip the part. `on_field(name, value)` is awaited as each text field completes,
+    so a caller can reject the request before the file parts that follow are read.
+    Returns (fields, files) with files as (field_name, filename, writer), all writers closed.
+    On any error every writer opened so far is discarded.
+    """
+    _, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if not boundary:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Expected a multipart/form-data body")
+
+    messages = []
+    header_field = bytearray()
+    header_value = bytearray()
+    part_headers = {}
+
+    def on_part_begin():
+        part_headers.clear()
+
+    def on_header_field(data, start, end):
+        header_field.extend(data[start:end])
+
+    def on_header_value(data, start, end):
+        header_value.extend(data[start:end])
+
+    def on_header_end():
+        part_headers[bytes(header_field).lower()] = bytes(header_value)
+        header_field.clear()
+        header_value.clear()
+
+    def on_headers_finished():
+        messages.append(("begin", dict(part_headers)))
+
+    def on_part_data(data, start, end):
+        messages.append(("data", memoryview(data)[start:end]))
+
+    def on_part_end():
+        messages.append(("end", None))
+
+    parser = multipart.MultipartParser(boundary, {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+
+    fields = {}
+    files = []
+    field_name = None
+    field_value = None
+    writer = None
+    skipping = False
+    try:
+        async for chunk in request.stream():
+            try:
+                parser.write(chunk)
+            except MultipartParseError:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Malformed multipart body")
+            for message, payload in messages:
+                if message == "begin":
+                    _, disposition = parse_options_header(payload.get(b"content-disposition", b""))
+                    field_name = _decode(disposition.get(b"name", b""), "Field name")
+                    filename = disposition.get(b"filename")
+                    if filename is not None:
+                        filename = _decode(filename, "Filename")
+                        writer = open_file(field_name, filename)
+                        if writer is not None:
+                            files.append((field_name, filename, writer))
+                        else:
+                            skipping = True
+                    else:
+                        field_value = bytearray()
+                elif message == "data":
+                    if skipping:
+                        continue
+                    if writer is not None:
+                        if writer.size + len(payload) > max_file_size:
+                            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"File '{field_name}' is too large")
+                        await writer.write(payload)
+                    else:
+                        field_value.extend(payload)
+                        if len(field_value) > max_field_size:
+                            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"Field '{field_name}' is too large")
+                elif message == "end":
+                    if skipping:
+                        skipping = False
+                    elif writer is not None:
+                        await writer.close()
+                        writer = None
+                    else:
+                        fields[field_name] = _decode(field_value, f"Field '{field_name}'")
+                        if on_field is not None:
+                            await on_field(field_name, fields[field_name])
+            messages.clear()
+        parser.finalize()
+    except Exception:
+        for _, _, opened in files:
+            await opened.discard()
+        raise
+    return fields, files
+
+
+# Resumable uploads
+
+def staging_path(upload_id: str) -> str:
+    return os.path.join(UPLOAD_STAGING_PATH, f"{upload_id}.part")
+
+
+def create_staging_file(upload_id: str, size: int):
+    """Create the sparse file that chunks of a resumable upload are written into."""
+    os.makedirs(UPLOAD_STAGING_PATH, exist_ok=True)
+    fd = os.open(staging_path(upload_id), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+    try:
+        os.ftruncate(fd, size)
+    finally:
+        os.close(fd)
+
+
+def open_chunk_writer(upload_id: str, offset: int) -> BufferedWriter:
+    """Writer for one chunk; several can write disjoint ranges of the same file in parallel."""
+    return BufferedWriter(os.open(staging_path(upload_id), os.O_WRONLY), offset=offset)
+
+
+def copy_staged_file(upload_id: str) -> Tuple[str, str]:
+    """Copy a fully received upload to a fresh file and return (its path, its SHA-256), ready for media.upload_blobs.
+
+    Chunk PUTs write the staging file through their own descriptors, and a re-sent one may still be
+    writing while the upload completes. The copy is hashed as it is written and nothing else holds it,
+    so the stored blob is exactly the bytes its digest names. The caller removes it with remove_file.
+    """
+    fd, path = tempfile.mkstemp(dir=UPLOAD_STAGING_PATH, suffix=".part")
+    sha256 = hashlib.sha256()
+    try:
+        with open(staging_path(upload_id), "rb", buffering=0) as source, os.fdopen(fd, "wb") as copy:
+            while block := source.read(UPLOAD_BUFFER_SIZE):
+                sha256.update(block)
+                copy.write(block)
+            copy.flush()
+            # mkstemp creates the file owner-only; published media is world-readable
+            os.fchmod(copy.fileno(), 0o644)
+            os.fsync(copy.fileno())
+    except BaseException:
+        remove_file(path)
+        raise
+    return path, sha256.hexdigest()
+
+
+def remove_file(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def remove_staging_file(upload_id: str):
+    remove_file(staging_path(upload_id))
+
+
+def merge_ranges(chunks, size: int):
+    """Return (received_bytes, missing [start, end) ranges) for the (offset, length) chunks of a file."""
+    received = 0
+    missing = []
+    position = 0
+    for offset, length in chunks:
+        end = min(offset + length, size)
+        if offset > position:
+            missing.append([position, offset])
+        if end > position:
+            received += end - max(offset, position)
+            position = end
+    if position < size:
+        missing.append([position, size])
+    return received, missing
+
+
+def _stale_staging_ids(older_than: float):
+    try:
+        entries = list(os.scandir(UPLOAD_STAGING_PATH))
+    except FileNotFoundError:
+        return []
+    return [
+        entry.name[:-len(".part")] for entry in entries
+        if entry.name.endswith(".part") and entry.stat().st_mtime < older_than
+    ]
+
+
+@background.periodic(UPLOAD_GC_INTERVAL_SECONDS)
+async def collect_abandoned_uploads(batch_size: int = 500):
+    """Delete expired upload sessions with their staged data, and staged files whose session is gone."""
+    loop = asyncio.get_running_loop()
+    async with AsyncSessionLocal() as db:
+        while upload_ids := await crud.get_expired_upload_session_ids(db, datetime.now(timezone.utc), limit=batch_size):
+            for upload_id in upload_ids:
+                await loop.run_in_executor(None, remove_staging_file, upload_id)
+                await crud.delete_upload_session(db, upload_id)
+
+        stale_ids = await loop.run_in_executor(None, _stale_staging_ids, time.time() - UPLOAD_SESSION_TTL_HOURS * 3600)
+        for start in range(0, len(stale_ids), batch_size):
+            batch = stale_ids[start:start + batch_size]
+            live_ids = await crud.get_upload_session_ids(db, batch)
+            for upload_id in batch:
+                if upload_id not in live_ids:
+                    await loop.run_in_executor(None, remove_staging_file, upload_id)
@@ -0,0 +1,158 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+from fastapi import HTTPException, Request, status
+
+from core.config import (
+    STRIPE_WEBHOOK_SECRET, STRIPE_WEBHOOK_TOLERANCE_SECONDS, PAYMENT_EVENT_WORKERS, PAYMENT_EVENT_BATCH_SIZE,
+    PAYMENT_EVENT_POLL_SECONDS, PAYMENT_EVENT_MAX_ATTEMPTS, PAYMENT_EVENT_RETENTION_DAYS,
+)
+from db import crud
+from db.database import AsyncSessionLocal
+from utils import background, metrics
+
+logger = logging.getLogger(__name__)
+
+# Provider events are small; anything bigger is not one
+MAX_EVENT_SIZE = 1024 * 1024
+
+# Event type -> coroutine function taking (db, event payload), run inside the worker's transaction
+_handlers = {}
+
+
+def handler(event_type: str):
+    """Register a coroutine function to handle one type of payment event; this is where anything that reacts
+    to a payment hooks in (see the charge handlers at the end of this module). Events without a handler
+    are marked processed and otherwise ignored. Handlers must be safe to run again for the same event,
+    since a failure after they ran schedules a retry."""
+    def decorator(fn):
+        _handlers[event_type] = fn
+        return fn
+    return decorator
+
+
+# Receiving
+
+async def read_payload(request: Request) -> bytes:
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > MAX_EVENT_SIZE:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="Event too large")
+    return bytes(body)
+
+
+def verify_signature(payload: bytes, signature_header: str, secret: str = STRIPE_WEBHOOK_SECRET, now: float = None):
+    """Check a Stripe-Signature header ("t=<timestamp>,v1=<hex hmac>,..."): an HMAC-SHA256 of
+    "<timestamp>.<payload>" under the endpoint secret, signed recently enough not to be a replay."""
+    if not secret:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Payment webhooks are not configured")
+    timestamp, signatures = None, []
+    for item in (signature_header or "").split(","):
+        key, _, value = item.strip().partition("=")
+        if key == "t":
+            timestamp = value
+        elif key == "v1":
+            signatures.append(value)
+    if not timestamp or not timestamp.isdigit() or not signatures:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Missing or malformed signature")
+
+    expected = hmac.new(secret.encode(), timestamp.encode() + b"." + payload, hashlib.sha256).hexdigest()
+    if not any(hmac.compare_digest(expected, signature) for signature in signatures):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid signature")
+    if abs((time.time() if now is None else now) - int(timestamp)) > STRIPE_WEBHOOK_TOLERANCE_SECONDS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Signature timestamp outside the tolerance")
+
+
+def parse_event(payload: bytes) -> dict:
+    try:
+        event = json.loads(payload)
+    except ValueError:
+        event = None
+    if not isinstance(event, dict) or not isinstance(event.get("id"), str) or not isinstance(event.get("type"), str):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Not a payment event")
+    return event
+
+
+# Processing
+
+def _retry_delay(attempts: int) -> timedelta:
+    return timedelta(seconds=min(10 * 2 ** (attempts - 1), 3600))
+
+
+async def _process_batch(db) -> int:
+    """Claim one batch of due events, run their handlers and record the outcome, all in one transaction."""
+    now = datetime.now(timezone.utc)
+    events = await crud.claim_payment_events(db, now, limit=PAYMENT_EVENT_BATCH_SIZE)
+    for event in events:
+        fn = _handlers.get(event.type)
+        try:
+            if fn is not None:
+                # A savepoint per event, so one failing handler does not undo the rest of the batch
+                async with db.begin_nested():
+                    await fn(db, event.payload)
+        except Exception as e:
+            event.attempts += 1
+            event.last_error = repr(e)[:1000]
+            if event.attempts >= PAYMENT_EVENT_MAX_ATTEMPTS:
+                logger.error("Giving up on payment event %s (%s) after %d attempts", event.id, event.type, event.attempts, exc_info=True)
+                event.processed_datetime = now
+                event.failed = True
+                metrics.payment_events.inc(labels=("failed",))
+            else:
+                logger.warning("Payment event %s (%s) failed, retrying later", event.id, event.type, exc_info=True)
+                event.next_attempt_datetime = now + _retry_delay(event.attempts)
+                metrics.payment_events.inc(labels=("retried",))
+        else:
+            event.attempts += 1
+            event.processed_datetime = now
+            metrics.payment_events.inc(labels=("processed",))
+    await db.commit()
+    return len(events)
+
+
+async def _worker():
+    async with AsyncSessionLocal() as db:
+        while await _process_batch(db) == PAYMENT_EVENT_BATCH_SIZE:
+            pass
+
+
+@background.periodic(PAYMENT_EVENT_POLL_SECONDS)
+async def process_payment_events():
+    """Drain due webhook events with a pool of workers, each claiming its own batches."""
+    results = await asyncio.gather(*(_worker() for _ in range(PAYMENT_EVENT_WORKERS)), return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error("Payment event worker failed", exc_info=result)
+
+
+@background.periodic(3600)
+async def prune_payment_events(batch_size: int = 5000):
+    """Delete events processed longer ago than the retention period."""
+    before = datetime.now(timezone.utc) - timedelta(days=PAYMENT_EVENT_RETENTION_DAYS)
+    async with AsyncSessionLocal() as db:
+        while await crud.delete_processed_payment_events(db, before, limit=batch_size) == batch_size:
+            pass
+
+
+# Handlers
+
+# Charges are not stored here, so the provider's final word on each one is logged and counted
+
+@handler("charge.succeeded")
+async def charge_succeeded(db, event: dict):
+    charge = event["data"]["object"]
+    logger.info("Charge %s succeeded: %s %s", charge["id"], charge.get("amount"), charge.get("currency"))
+    metrics.payment_charges.inc(labels=("succeeded",))
+
+
+@handler("charge.failed")
+async def charge_failed(db, event: dict):
+    charge = event["data"]["object"]
+    logger.warning("Charge %s failed: %s", charge["id"], charge.get("failure_message"))
+    metrics.payment_charges.inc(labels=("failed",))